@@ -0,0 +1,387 @@
+import sys
+import gzip
+import json
+import re
+import time
+import random
+import hashlib
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from xml.sax.saxutils import escape
+
+# ---------------------------------------------------------------------------
+# Local stand-in for the AcoustID and MusicBrainz web services
+#
+#   POST /v2/lookup               AcoustID lookup, single or batched (form data, optionally gzip)
+#   GET  /ws/2/recording/<mbid>   MusicBrainz recording XML
+#   GET  /ws/2/release/<mbid>     MusicBrainz release XML with its tracklist
+#   GET  /ws/2/recording?query=   MusicBrainz recording search: one hit, exactly
+#                                 the title and artist asked for, score 100
+#
+# Answers are derived from the fingerprint / MBID, so they are stable between
+# runs. Fingerprints of synthetic album tracks (bench.library) carry their
+# album, track number and track count; these are encoded into the MBIDs, so
+# recordings and releases can be answered without any server-side state.
+# Latency, error rate and throttling are tunable, and requests above the
+# configured per-service rate get 503 + Retry-After, like the real thing.
+#
+#   python -m bench.fake_services --port 8080 --latency 0.05 --error-rate 0.02
+# ---------------------------------------------------------------------------
+
+MB_NS = "http://musicbrainz.org/ns/mmd-2.0#"
+
+
+def fake_mbid(seed):
+    """A deterministic MBID-shaped string."""
+    h = hashlib.md5(seed.encode()).hexdigest()
+    return f"{h[:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:32]}"
+
+
+class FakeServiceConfig:
+    def __init__(
+        self,
+        latency=0.0,
+        jitter=0.0,
+        error_rate=0.0,
+        acoustid_rate=3.0,
+        musicbrainz_rate=1.0,
+        retry_after=1,
+        unknown_rate=0.0,
+        seed=0,
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rates = {"acoustid": acoustid_rate, "musicbrainz": musicbrainz_rate}
+        self.retry_after = retry_after
+        self.unknown_rate = unknown_rate
+        self.random = random.Random(seed)
+
+
+class FakeServiceState:
+    """Request counters and the sliding windows used to detect rate violations."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.windows = {"acoustid": [], "musicbrainz": []}
+        self.counts = {}
+
+    def count(self, name):
+        with self.lock:
+            self.counts[name] = self.counts.get(name, 0) + 1
+
+    def over_rate(self, service, rate):
+        """True if this request exceeds `rate` requests per second."""
+        if not rate:
+            return False
+        now = time.monotonic()
+        with self.lock:
+            # 0.9 s window: 10% tolerance for arrival jitter.
+            window = [t for t in self.windows[service] if now - t < 0.9]
+            window.append(now)
+            self.windows[service] = window
+            return len(window) > rate + 0.5
+
+
+class FakeServiceHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+
+    def log_message(self, *args):
+        pass
+
+    @property
+    def config(self):
+        return self.server.config
+
+    @property
+    def state(self):
+        return self.server.state
+
+    def _send(self, status, body, content_type, headers=None):
+        body = body.encode() if isinstance(body, str) else body
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _simulate(self, service):
+        """Apply latency, throttling and random errors. Returns True if a response was sent."""
+        self.state.count(f"{service}_requests")
+        delay = self.config.latency + self.config.random.uniform(0, self.config.jitter)
+        if delay:
+            time.sleep(delay)
+        if self.state.over_rate(service, self.config.rates[service]):
+            self.state.count(f"{service}_throttled")
+            self._send(
+                503, "rate limit exceeded", "text/plain",
+                {"Retry-After": str(self.config.retry_after)},
+            )
+            return True
+        if self.config.random.random() < self.config.error_rate:
+            self.state.count(f"{service}_errors")
+            self._send(502, "bad gateway", "text/plain")
+            return True
+        return False
+
+    def do_POST(self):
+        path = urlparse(self.path).path
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length)
+        if not path.endswith("/lookup"):
+            self._send(404, "not found", "text/plain")
+            return
+        if self._simulate("acoustid"):
+            return
+        if self.headers.get("Content-Encoding") == "gzip":
+            body = gzip.decompress(body)
+        form = parse_qs(body.decode())
+        self._send(200, json.dumps(acoustid_response(form, self.config)), "application/json")
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        path = url.path
+        if path == "/ws/2/recording":
+            build, arg = search_xml, parse_qs(url.query).get("query", [""])[0]
+        elif path.startswith("/ws/2/recording/"):
+            build, arg = recording_xml, path.rsplit("/", 1)[-1]
+        elif path.startswith("/ws/2/release/"):
+            build, arg = release_xml, path.rsplit("/", 1)[-1]
+        else:
+            self._send(404, "not found", "text/plain")
+            return
+        if self._simulate("musicbrainz"):
+            return
+        body = build(arg)
+        if body is None:
+            self._send(404, "not found", "text/plain")
+            return
+        self._send(200, body, "application/xml; charset=utf-8")
+
+
+ALBUM_RECORDING, ALBUM_RELEASE, COMPILATION = "a1b0", "a1b1", "a1b2"
+
+
+def album_track(fingerprint):
+    """(album, track, count) encoded in a synthetic album track's fingerprint, or None."""
+    from bench.library import ALBUM_MAGIC
+    from core.duplicates import FingerprintError, decode_fingerprint
+    try:
+        _, values = decode_fingerprint(fingerprint)
+    except FingerprintError:
+        return None
+    if len(values) < 3 or values[0] != ALBUM_MAGIC:
+        return None
+    return values[1], values[2] >> 16, values[2] & 0xFFFF
+
+
+def album_mbid(kind, album, track, count, seed=""):
+    """An MBID-shaped id carrying album/track/count (see parse_album_mbid)."""
+    h = hashlib.md5(f"{kind}:{album}:{track}:{seed}".encode()).hexdigest()
+    return f"{kind}{album:04x}-{track:04x}-{count:04x}-0000-{h[:12]}"
+
+
+def parse_album_mbid(mbid):
+    """(kind, album, track, count) from album_mbid(), or None."""
+    if mbid[:4] not in (ALBUM_RECORDING, ALBUM_RELEASE, COMPILATION):
+        return None
+    try:
+        return mbid[:4], int(mbid[4:8], 16), int(mbid[9:13], 16), int(mbid[14:18], 16)
+    except ValueError:
+        return None
+
+
+def _lookup_results(fingerprint, config):
+    """Results for one fingerprint; fingerprints starting with 'UNKNOWN' never match."""
+    digest = hashlib.md5(fingerprint.encode()).digest()
+    if fingerprint.startswith("UNKNOWN") or digest[0] / 255 < config.unknown_rate:
+        return []
+    album = album_track(fingerprint)
+    if album:
+        rid = album_mbid(ALBUM_RECORDING, *album)
+    else:
+        rid = fake_mbid("rec:" + fingerprint)
+    return [{
+        "id": fake_mbid("track:" + fingerprint),
+        "score": 0.9 + digest[1] / 2550,
+        "recordings": [{
+            "id": rid,
+            "title": f"Title {rid[-8:]}",
+            "artists": [{"id": fake_mbid("artist:" + rid), "name": f"Artist {rid[9:13]}"}],
+        }],
+    }]
+
+
+def acoustid_response(form, config):
+    """Build a lookup response for single (`fingerprint`) or batched (`fingerprint.N`) requests."""
+    if "fingerprint" in form:
+        return {"status": "ok", "results": _lookup_results(form["fingerprint"][0], config)}
+    batch = [
+        {"index": key.split(".", 1)[1], "results": _lookup_results(values[0], config)}
+        for key, values in form.items()
+        if key.startswith("fingerprint.")
+    ]
+    if not batch:
+        return {"status": "error", "error": {"code": 6, "message": "missing fingerprint"}}
+    return {"status": "ok", "fingerprints": batch}
+
+
+def _credit_xml(artist_id, artist):
+    return (
+        f'<artist-credit><name-credit><artist id="{artist_id}"><name>{artist}</name>'
+        f"<sort-name>{artist}</sort-name></artist></name-credit></artist-credit>"
+    )
+
+
+def _release_summary_xml(release_id, title, date):
+    return (
+        f'<release id="{release_id}"><title>{escape(title)}</title>'
+        f"<status>Official</status><date>{date}</date></release>"
+    )
+
+
+def recording_xml(mbid):
+    """A MusicBrainz recording with one artist and its releases, as XML.
+
+    Album tracks are on their album and on a (earlier) compilation; other
+    recordings on one release of their own.
+    """
+    title = escape(f"Title {mbid[-8:]}")
+    album = parse_album_mbid(mbid)
+    if album and album[0] == ALBUM_RECORDING:
+        _, number, track, count = album
+        artist_id = fake_mbid(f"artist:album{number}")
+        artist = escape(f"Artist {number:04d}")
+        releases = (
+            _release_summary_xml(album_mbid(ALBUM_RELEASE, number, 0, count),
+                                 f"Album {number:04d}", "2001-01-01")
+            + _release_summary_xml(album_mbid(COMPILATION, number, track, count),
+                                   f"Greatest Hits {number:04d}", "1999-01-01")
+        )
+        listed = 2
+    else:
+        artist_id = fake_mbid("artist:" + mbid)
+        artist = escape(f"Artist {mbid[9:13]}")
+        releases = _release_summary_xml(
+            fake_mbid("release:" + mbid[:4]), f"Album {mbid[:4]}", "2001-01-01"
+        )
+        listed = 1
+    return (
+        f'<?xml version="1.0" encoding="UTF-8"?>'
+        f'<metadata xmlns="{MB_NS}">'
+        f'<recording id="{mbid}"><title>{title}</title>'
+        f"{_credit_xml(artist_id, artist)}"
+        f'<release-list count="{listed}">{releases}</release-list>'
+        f"</recording></metadata>"
+    )
+
+
+_SEARCH_FIELD = re.compile(r'(recording|artist):"((?:[^"\\]|\\.)*)"')
+
+
+def search_xml(query):
+    """Search results for a `recording:"..." AND artist:"..."` query: one
+    recording with exactly that title and artist; None for other queries."""
+    fields = {key: re.sub(r"\\(.)", r"\1", value) for key, value in _SEARCH_FIELD.findall(query)}
+    if "recording" not in fields or "artist" not in fields:
+        return None
+    title, artist = fields["recording"], fields["artist"]
+    mbid = fake_mbid(f"search:{artist}:{title}")
+    return (
+        f'<?xml version="1.0" encoding="UTF-8"?>'
+        f'<metadata xmlns="{MB_NS}" xmlns:ext="http://musicbrainz.org/ns/ext#-2.0">'
+        f'<recording-list count="1" offset="0">'
+        f'<recording id="{mbid}" ext:score="100"><title>{escape(title)}</title>'
+        f"{_credit_xml(fake_mbid('artist:' + artist), escape(artist))}"
+        f'<release-list count="1">'
+        f'{_release_summary_xml(fake_mbid("release:" + mbid), "Album " + mbid[:4], "2001-01-01")}'
+        f"</release-list></recording></recording-list></metadata>"
+    )
+
+
+def release_xml(mbid):
+    """A synthetic album (or compilation) with its tracklist, as XML; None for a recording id.
+
+    Releases of recordings outside albums are answered with an empty tracklist.
+    """
+    album = parse_album_mbid(mbid)
+    if album and album[0] == ALBUM_RECORDING:
+        return None
+    kind, number, track, count = album or (None, 0, 0, 0)
+    if kind is None:
+        title, date, numbers = f"Album {mbid[:4]}", "2001-01-01", []
+    elif kind == ALBUM_RELEASE:
+        title, date, numbers = f"Album {number:04d}", "2001-01-01", range(1, count + 1)
+    else:
+        title, date, numbers = f"Greatest Hits {number:04d}", "1999-01-01", [track]
+    artist_id = fake_mbid(f"artist:album{number}")
+    artist = escape(f"Artist {number:04d}")
+    tracks = "".join(
+        f'<track id="{fake_mbid(f"{mbid}:{n}")}"><position>{i}</position><number>{i}</number>'
+        f'<recording id="{rid}"><title>{escape(f"Title {rid[-8:]}")}</title></recording></track>'
+        for i, n in enumerate(numbers, start=1)
+        for rid in [album_mbid(ALBUM_RECORDING, number, n, count)]
+    )
+    return (
+        f'<?xml version="1.0" encoding="UTF-8"?>'
+        f'<metadata xmlns="{MB_NS}">'
+        f'<release id="{mbid}"><title>{escape(title)}</title><status>Official</status>'
+        f"<date>{date}</date>{_credit_xml(artist_id, artist)}"
+        f'<medium-list count="1"><medium><position>1</position>'
+        f'<track-list count="{len(numbers)}">{tracks}</track-list></medium></medium-list>'
+        f"</release></metadata>"
+    )
+
+
+def start_server(config=None, port=0):
+    """Start the fake server on a background thread. Returns (server, base_url)."""
+    server = ThreadingHTTPServer(("127.0.0.1", port), FakeServiceHandler)
+    server.daemon_threads = True
+    server.config = config or FakeServiceConfig()
+    server.state = FakeServiceState()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def point_clients_at(base_url):
+    """Route acoustid/musicbrainzngs (and core.services) to a fake server."""
+    import acoustid
+    import musicbrainzngs
+    acoustid.set_base_url(base_url + "/v2/")
+    musicbrainzngs.set_hostname(base_url.split("://", 1)[1], use_https=False)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fake AcoustID/MusicBrainz server.")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds per request")
+    parser.add_argument("--jitter", type=float, default=0.0, help="extra random latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of 502s")
+    parser.add_argument("--unknown-rate", type=float, default=0.0,
+                        help="fraction of fingerprints with no match")
+    parser.add_argument("--acoustid-rate", type=float, default=3.0)
+    parser.add_argument("--musicbrainz-rate", type=float, default=1.0)
+    parser.add_argument("--retry-after", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    config = FakeServiceConfig(
+        latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+        acoustid_rate=args.acoustid_rate, musicbrainz_rate=args.musicbrainz_rate,
+        retry_after=args.retry_after, unknown_rate=args.unknown_rate,
+    )
+    server, url = start_server(config, args.port)
+    print(f"Fake services listening on {url} (Ctrl+C to stop)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
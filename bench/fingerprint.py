@@ -0,0 +1,121 @@
+import os
+import sys
+import math
+import time
+import wave
+import random
+import shutil
+import argparse
+import tempfile
+from array import array
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+from core.fingerprint import compare_engines, fingerprint_file_silent, fingerprint_native, native_available
+
+# ---------------------------------------------------------------------------
+# In-process Chromaprint engine vs fpcalc
+#
+#   python -m bench.fingerprint
+#   python -m bench.fingerprint --files 40 --seconds 150 --workers 8
+#
+# Writes WAV files of synthetic music (a few detuned tones changing every
+# half second, plus noise), which every audioread install can decode in
+# process, and checks three things:
+#
+#   threads   the native engine on --workers threads gives exactly the
+#             fingerprints it gives one file at a time
+#   fpcalc    if fpcalc is installed, both engines agree on every file
+#             (same duration, similarity >= --min-similarity)
+#   speed     files/s of the native engine (1 and --workers threads) and
+#             of fpcalc
+#
+# Needs libchromaprint (exits with status 2 without it). Exits with status 1
+# if a check fails.
+# ---------------------------------------------------------------------------
+
+RATE = 22050
+
+
+def write_wav(path, rng, seconds):
+    """`seconds` of mono 16-bit audio: tones that change every half second."""
+    samples = array("h")
+    step = RATE // 2
+    for start in range(0, RATE * seconds, step):
+        tones = [rng.uniform(110, 1760) for _ in range(3)]
+        phase = [rng.uniform(0, 2 * math.pi) for _ in tones]
+        for n in range(start, start + step):
+            t = n / RATE
+            value = sum(math.sin(2 * math.pi * f * t + p) for f, p in zip(tones, phase))
+            samples.append(int(8000 * value / len(tones) + rng.gauss(0, 300)))
+    with wave.open(str(path), "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(RATE)
+        w.writeframes(samples.tobytes())
+
+
+def timed(label, fn, files, workers=1):
+    start = time.perf_counter()
+    if workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(fn, files))
+    else:
+        results = [fn(path) for path in files]
+    elapsed = time.perf_counter() - start
+    print(f"{label:22s} {len(files) / elapsed:8.1f} files/s  ({elapsed:.2f}s)")
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare in-process Chromaprint with fpcalc.")
+    parser.add_argument("--files", type=int, default=16)
+    parser.add_argument("--seconds", type=int, default=150, help="length of each file")
+    parser.add_argument("--workers", type=int, default=min(8, os.cpu_count() or 1))
+    parser.add_argument("--min-similarity", type=float, default=0.99)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    if not native_available():
+        print("libchromaprint / audioread not available; nothing to compare.")
+        return 2
+    fpcalc = os.environ.get("FPCALC") or shutil.which("fpcalc")
+    if fpcalc:
+        os.environ["FPCALC"] = fpcalc
+
+    rng = random.Random(args.seed)
+    problems = []
+    with tempfile.TemporaryDirectory(prefix="fingerprint-bench-") as work:
+        files = [Path(work) / f"track{i:03d}.wav" for i in range(args.files)]
+        for path in files:
+            write_wav(path, rng, args.seconds)
+        print(f"{len(files)} files of {args.seconds}s")
+
+        single = timed("native, 1 thread", fingerprint_native, files)
+        threaded = timed(f"native, {args.workers} threads", fingerprint_native, files, args.workers)
+        if threaded != single:
+            problems.append("threads: fingerprints differ from the single-threaded run")
+
+        if fpcalc:
+            timed("fpcalc, 1 process", fingerprint_file_silent, files)
+            timed(f"fpcalc, {args.workers} processes", fingerprint_file_silent, files, args.workers)
+            worst = 1.0
+            for path in files:
+                result = compare_engines(path)
+                worst = min(worst, result["similarity"])
+                if result["similarity"] < args.min_similarity:
+                    problems.append(f"fpcalc: {path.name} similarity {result['similarity']:.4f}")
+                if result["native_duration"] != result["fpcalc_duration"]:
+                    problems.append(f"fpcalc: {path.name} duration {result['native_duration']} "
+                                    f"vs {result['fpcalc_duration']}")
+            print(f"fpcalc agreement: lowest similarity {worst:.4f}")
+        else:
+            print("fpcalc not found; skipping the comparison.")
+
+    for problem in problems:
+        print(f"FAIL {problem}")
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,329 @@
+import os
+import sys
+import random
+import struct
+import hashlib
+from pathlib import Path
+
+# ---------------------------------------------------------------------------
+# Synthetic audio libraries and a stand-in fpcalc
+#
+# Files are real enough for mutagen and the scanner: an ID3v2.3 tag (or an
+# ID3v1 block, or nothing) in front of a run of MPEG-1 Layer III frames with
+# random payloads. FLAC, Ogg Vorbis and M4A files wrap the same frames in
+# their container (after the metadata blocks, in Ogg pages, in an mdat atom
+# at the end) and carry their tags in the container's own format. The fake
+# fpcalc derives its fingerprint from the audio frames, so it is stable when
+# the tags are rewritten. Its fingerprints are in Chromaprint's compressed
+# format, with a few bits flipped per file name, so copies of the same audio
+# come out near-identical as real re-rips do.
+# ---------------------------------------------------------------------------
+
+ROOT = Path(__file__).resolve().parent.parent
+FINGERPRINT_ITEMS = 960  # ~120 s at Chromaprint's 8 sub-fingerprints per second
+ALBUM_MARKER = b"ALBM"    # album tracks end with a frame: marker, album, track, count
+ALBUM_MAGIC = 0xA1B0A1B0  # ...which shows up as the fingerprint's first three items
+
+FRAME_HEADER = b"\xff\xfb\x90\x64"  # MPEG-1 Layer III, 128 kbit/s, 44.1 kHz
+FRAME_SIZE = 417
+FORMATS = ("mp3", "flac", "ogg", "m4a")
+OGG_FRAMES_PER_PAGE = 8  # whole frames per page, so the album frame is never split
+
+FAKE_FPCALC = """#!{python}
+import os, sys, time
+sys.path.insert(0, {root!r})
+from bench.library import fake_fingerprint
+delay = float(os.environ.get("FAKE_FPCALC_DELAY") or 0)
+if delay:
+    time.sleep(delay)
+with open(sys.argv[-1], "rb") as f:
+    f.seek(0, os.SEEK_END)
+    f.seek(max(0, f.tell() - 4096))
+    tail = f.read()
+print("DURATION=180.0")
+print("FINGERPRINT=" + fake_fingerprint(tail, os.path.basename(sys.argv[-1])))
+"""
+
+
+def compress_fingerprint(values, algorithm=1):
+    """Chromaprint's compressed, base64 form of 32-bit sub-fingerprints (as fpcalc prints)."""
+    import base64
+
+    bits = []
+    previous = 0
+    for value in values:
+        delta, previous = value ^ previous, value
+        last_bit, bit = 0, 1
+        while delta:
+            if delta & 1:
+                bits.append(bit - last_bit)
+                last_bit = bit
+            delta >>= 1
+            bit += 1
+        bits.append(0)
+
+    def pack(items, width):
+        packed = 0
+        for k, item in enumerate(items):
+            packed |= item << (width * k)
+        return packed.to_bytes((len(items) * width + 7) // 8, "little")
+
+    raw = (
+        bytes([algorithm]) + len(values).to_bytes(3, "big")
+        + pack([min(b, 7) for b in bits], 3)
+        + pack([b - 7 for b in bits if b >= 7], 5)
+    )
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode("ascii")
+
+
+def fake_fingerprint(audio, name, noise=0.03):
+    """A compressed fingerprint seeded by `audio`, with `noise` of its items
+    perturbed by one bit depending on `name`. Album tracks (see album_frame)
+    get ALBUM_MAGIC, album and track << 16 | count as their first items."""
+    rng = random.Random(hashlib.md5(audio).digest())
+    value, values = rng.getrandbits(32), []
+    for _ in range(FINGERPRINT_ITEMS):
+        value ^= 1 << rng.randrange(32)  # neighbouring frames differ in a bit or two
+        values.append(value)
+    jitter = random.Random(name)
+    values = [v ^ (1 << jitter.randrange(32)) if jitter.random() < noise else v for v in values]
+    marker = audio.rfind(FRAME_HEADER + ALBUM_MARKER)
+    if marker >= 0:
+        start = marker + len(FRAME_HEADER) + len(ALBUM_MARKER)
+        fields = audio[start:start + 8]
+        album = int.from_bytes(fields[:4], "big")
+        track = int.from_bytes(fields[4:6], "big")
+        count = int.from_bytes(fields[6:8], "big")
+        values[:3] = [ALBUM_MAGIC, album, track << 16 | count]
+    return compress_fingerprint(values)
+
+
+def album_frame(album, track, count):
+    """A last MPEG frame identifying an album track to the fake fpcalc."""
+    payload = (
+        ALBUM_MARKER + album.to_bytes(4, "big") + track.to_bytes(2, "big") + count.to_bytes(2, "big")
+    )
+    return FRAME_HEADER + payload.ljust(FRAME_SIZE - len(FRAME_HEADER), b"\x00")
+
+
+class LibrarySpec:
+    """Size and tag mix of a synthetic library (fractions of `files`).
+
+    tagged   : artist + title in ID3v2
+    partial  : artist only (counts as untagged)
+    v1_only  : artist + title in an ID3v1 block only
+    cover    : of the ID3v2-tagged files, how many carry `cover_kb` of APIC art
+    duplicates: of the untagged files, how many are copies of another one's audio
+    album_size: if set, files are laid out as albums of this many tracks, one
+                folder each, which the fake services know as releases
+    formats  : containers used in turn ("mp3", "flac", "ogg", "m4a"); formats
+               without ID3v1 get their usual tags instead of v1_only ones
+    named    : of the untagged files, how many are named "Artist NNN - Title
+               NNNNN" (in their artist's folder, unless laid out as albums)
+    The rest have no tags at all.
+    """
+
+    def __init__(self, files=200, tagged=0.5, partial=0.05, v1_only=0.05, cover=0.3,
+                 cover_kb=200, audio_kb=64, folders=10, seed=0, duplicates=0.0, album_size=0,
+                 formats=("mp3",), named=0.0):
+        self.files = files
+        self.tagged = tagged
+        self.partial = partial
+        self.v1_only = v1_only
+        self.cover = cover
+        self.cover_kb = cover_kb
+        self.audio_kb = audio_kb
+        self.folders = folders
+        self.seed = seed
+        self.duplicates = duplicates
+        self.album_size = album_size
+        self.formats = tuple(formats)
+        self.named = named
+
+    def as_dict(self):
+        return dict(vars(self))
+
+
+def audio_frames(rng, kib):
+    """`kib` KiB of MPEG frames with random payloads."""
+    count = max(1, kib * 1024 // FRAME_SIZE)
+    return b"".join(
+        FRAME_HEADER + rng.randbytes(FRAME_SIZE - len(FRAME_HEADER)) for _ in range(count)
+    )
+
+
+def id3v1_block(artist, title):
+    def field(text, size):
+        return text.encode("latin-1")[:size].ljust(size, b"\x00")
+    return b"TAG" + field(title, 30) + field(artist, 30) + b"\x00" * 30 + b"\x00" * 34 + b"\xff"
+
+
+def write_mp3(path, rng, spec, kind, cover=False, audio=None):
+    """Write one synthetic MP3 of the given kind (tagged/partial/v1_only/untagged)."""
+    from mutagen.id3 import ID3, TPE1, TIT2, APIC
+
+    name = Path(path).stem
+    audio = audio or audio_frames(rng, spec.audio_kb)
+    with open(path, "wb") as f:
+        f.write(audio)
+        if kind == "v1_only":
+            f.write(id3v1_block(f"Artist {name}", f"Title {name}"))
+    if kind in ("tagged", "partial"):
+        tags = ID3()
+        tags.add(TPE1(encoding=3, text=[f"Artist {name}"]))
+        if kind == "tagged":
+            tags.add(TIT2(encoding=3, text=[f"Title {name}"]))
+        if cover:
+            tags.add(APIC(encoding=3, mime="image/jpeg", type=3, desc="cover",
+                          data=rng.randbytes(spec.cover_kb * 1024)))
+        tags.save(path, v2_version=3)
+
+
+def flac_stream(audio):
+    """A FLAC file: STREAMINFO (44.1 kHz stereo, 180 s) followed by `audio`."""
+    info = (
+        struct.pack(">HH", 4096, 4096) + (0).to_bytes(3, "big") * 2
+        + ((44100 << 44) | (1 << 41) | (15 << 36) | (44100 * 180)).to_bytes(8, "big")
+        + bytes(16)
+    )
+    return b"fLaC" + bytes([0x80]) + len(info).to_bytes(3, "big") + info + audio
+
+
+def ogg_stream(audio):
+    """An Ogg Vorbis file: identification, (empty) comment and setup headers,
+    then `audio` in pages of OGG_FRAMES_PER_PAGE frames."""
+    from mutagen.ogg import OggPage
+
+    ident = b"\x01vorbis" + struct.pack("<IBIiiiBB", 0, 2, 44100, 0, 128000, 0, 0xB8, 1)
+    comment = b"\x03vorbis" + struct.pack("<I", 5) + b"bench" + struct.pack("<I", 0) + b"\x01"
+    setup = b"\x05vorbis" + bytes(32)
+    chunk = OGG_FRAMES_PER_PAGE * FRAME_SIZE
+    bodies = [[ident], [comment, setup]] + [
+        [audio[i:i + chunk]] for i in range(0, len(audio), chunk)
+    ]
+    pages = []
+    for sequence, packets in enumerate(bodies):
+        page = OggPage()
+        page.serial, page.sequence, page.packets = 0x4D46, sequence, packets
+        page.first = sequence == 0
+        page.last = sequence == len(bodies) - 1
+        page.position = max(0, sequence - 1) * 44100
+        pages.append(page)
+    return b"".join(page.write() for page in pages)
+
+
+def m4a_stream(audio):
+    """An M4A file without tags: ftyp, moov (mvhd only) and `audio` in mdat, last."""
+    def atom(kind, body):
+        return struct.pack(">I", 8 + len(body)) + kind + body
+    mvhd = atom(b"mvhd", bytes(4) + struct.pack(">IIII", 0, 0, 1000, 180000) + bytes(80))
+    return (
+        atom(b"ftyp", b"M4A " + bytes(4) + b"M4A mp42isom")
+        + atom(b"moov", mvhd)
+        + atom(b"mdat", audio)
+    )
+
+
+def write_container(path, rng, spec, kind, cover=False, audio=None):
+    """Write one synthetic FLAC/Ogg/M4A file of the given kind, tagged with mutagen."""
+    import mutagen
+    from mutagen.flac import Picture
+
+    path = Path(path)
+    name = path.stem
+    audio = audio or audio_frames(rng, spec.audio_kb)
+    stream = {".flac": flac_stream, ".ogg": ogg_stream, ".m4a": m4a_stream}[path.suffix]
+    path.write_bytes(stream(audio))
+    if kind not in ("tagged", "partial", "v1_only"):
+        return
+    song = mutagen.File(path)
+    if song.tags is None:
+        song.add_tags()
+    artist, title = f"Artist {name}", f"Title {name}"
+    art = rng.randbytes(spec.cover_kb * 1024) if cover else None
+    if path.suffix == ".m4a":
+        from mutagen.mp4 import MP4Cover
+        song.tags["\xa9ART"] = [artist]
+        if kind != "partial":
+            song.tags["\xa9nam"] = [title]
+        if art:
+            song.tags["covr"] = [MP4Cover(art, MP4Cover.FORMAT_JPEG)]
+    else:
+        song.tags["artist"] = [artist]
+        if kind != "partial":
+            song.tags["title"] = [title]
+        if art:
+            picture = Picture()
+            picture.type, picture.mime, picture.data = 3, "image/jpeg", art
+            if path.suffix == ".flac":
+                song.add_picture(picture)
+            else:
+                import base64
+                song.tags["metadata_block_picture"] = [base64.b64encode(picture.write()).decode()]
+    song.save()
+
+
+def make_library(root, spec):
+    """Create `spec.files` audio files under `root`. Returns {kind: count}."""
+    rng = random.Random(spec.seed)
+    root = Path(root)
+    kinds = (
+        ["tagged"] * round(spec.files * spec.tagged)
+        + ["partial"] * round(spec.files * spec.partial)
+        + ["v1_only"] * round(spec.files * spec.v1_only)
+    )
+    kinds = (kinds + ["untagged"] * spec.files)[:spec.files]
+    rng.shuffle(kinds)
+    counts = {}
+    originals = []  # audio of untagged files, for duplicates to copy
+    for i, kind in enumerate(kinds):
+        if spec.album_size:
+            album, track = divmod(i, spec.album_size)
+            count = min(spec.album_size, spec.files - album * spec.album_size)
+            folder = root / f"Album {album:04d}"
+        else:
+            folder = root / f"Artist {i % max(1, spec.folders):03d}"
+        folder.mkdir(parents=True, exist_ok=True)
+        cover = kind in ("tagged", "partial") and rng.random() < spec.cover
+        audio = None
+        if kind == "untagged":
+            if originals and rng.random() < spec.duplicates:
+                audio, kind = rng.choice(originals), "duplicate"
+            else:
+                audio = audio_frames(rng, spec.audio_kb)
+                if spec.album_size:
+                    audio += album_frame(album, track + 1, count)
+                originals.append(audio)
+        extension = spec.formats[i % len(spec.formats)]
+        path = folder / f"track{i:05d}.{extension}"
+        if kind == "untagged" and spec.named and rng.random() < spec.named:
+            path = folder / f"Artist {i % max(1, spec.folders):03d} - Title {i:05d}.{extension}"
+            kind = "named"
+        if extension == "mp3":
+            write_mp3(path, rng, spec, kind, cover, audio)
+        else:
+            write_container(path, rng, spec, kind, cover, audio)
+        counts[kind] = counts.get(kind, 0) + 1
+    return counts
+
+
+def install_fake_fpcalc(folder):
+    """Write the fake fpcalc into `folder` and put it first on PATH (POSIX only)."""
+    folder = Path(folder)
+    folder.mkdir(parents=True, exist_ok=True)
+    script = folder / "fpcalc"
+    script.write_text(FAKE_FPCALC.format(python=sys.executable, root=str(ROOT)))
+    script.chmod(0o755)
+    os.environ["PATH"] = str(folder) + os.pathsep + os.environ.get("PATH", "")
+    os.environ["FPCALC"] = str(script)
+    os.environ["TAGGER_FINGERPRINT"] = "fpcalc"  # the stand-in replaces fpcalc only
+    return script
+
+
+def library_digest(root):
+    """Short hash of every file's relative path and content, for checking runs used the same input."""
+    h = hashlib.sha1()
+    for path in sorted(p for p in Path(root).rglob("*") if p.is_file()):
+        h.update(str(path.relative_to(root)).encode())
+        h.update(path.read_bytes())
+    return h.hexdigest()[:12]
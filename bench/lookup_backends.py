@@ -0,0 +1,107 @@
+import os
+import sys
+import time
+import logging
+import argparse
+import tempfile
+from pathlib import Path
+
+from bench.fake_services import FakeServiceConfig, start_server, point_clients_at
+from core import tagger
+from core.ratelimit import ACOUSTID, MUSICBRAINZ
+
+# ---------------------------------------------------------------------------
+# Compare the blocking ("threads") and asyncio lookup backends of run_tagger
+# against the local fake services.
+#
+#   python -m bench.lookup_backends --files 40 --latency 0.4
+#   python -m bench.lookup_backends --files 40 --latency 0.4 --server-acoustid-rate 2
+#   python -m bench.lookup_backends --backends threads:1,threads:10,async
+#
+# "threads:N" runs the threads backend with N fingerprints per AcoustID
+# request (1 = unbatched).
+#
+# Files are random bytes and fpcalc is replaced by a stub script, so only the
+# lookup path is measured. Runs are dry runs: nothing is written.
+# ---------------------------------------------------------------------------
+
+FAKE_FPCALC = """#!/bin/sh
+echo "DURATION=180.0"
+echo "FINGERPRINT=$(basename "$3" .mp3)"
+"""
+
+
+def make_library(folder, count):
+    files = []
+    for i in range(count):
+        path = Path(folder) / f"track{i:05d}.mp3"
+        path.write_bytes(os.urandom(512))
+        files.append(path)
+    return files
+
+
+def install_fake_fpcalc(folder):
+    script = Path(folder) / "fpcalc"
+    script.write_text(FAKE_FPCALC)
+    script.chmod(0o755)
+    os.environ["FPCALC"] = str(script)
+    os.environ["TAGGER_FINGERPRINT"] = "fpcalc"  # the stand-in replaces fpcalc only
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the lookup backends.")
+    parser.add_argument("--files", type=int, default=30)
+    parser.add_argument("--latency", type=float, default=0.3, help="fake server latency (s)")
+    parser.add_argument("--jitter", type=float, default=0.1)
+    parser.add_argument("--rate", type=float, default=10.0,
+                        help="bucket rate for both services during the benchmark (req/s)")
+    parser.add_argument("--server-acoustid-rate", type=float, default=None,
+                        help="server-side limit, default = --rate (lower it to force 503s)")
+    parser.add_argument("--server-musicbrainz-rate", type=float, default=None)
+    parser.add_argument("--backends", default="threads:1,threads:10,async")
+    args = parser.parse_args(argv)
+
+    if os.name == "nt":
+        print("The fpcalc stub is a shell script; run this benchmark on Linux/macOS.")
+        return 1
+
+    config = FakeServiceConfig(
+        latency=args.latency, jitter=args.jitter,
+        acoustid_rate=args.server_acoustid_rate or args.rate,
+        musicbrainz_rate=args.server_musicbrainz_rate or args.rate,
+    )
+    server, url = start_server(config)
+    point_clients_at(url)
+    for limiter in (ACOUSTID, MUSICBRAINZ):
+        limiter.bucket.rate = args.rate
+
+    logger = logging.getLogger("bench")
+    logger.addHandler(logging.NullHandler())
+    logger.propagate = False
+
+    with tempfile.TemporaryDirectory() as tmp:
+        install_fake_fpcalc(tmp)
+        files = make_library(tmp, args.files)
+        for spec in args.backends.split(","):
+            backend, _, batch = spec.partition(":")
+            tagger.RECORDINGS = type(tagger.RECORDINGS)()  # cold memo per backend
+            for limiter in (ACOUSTID, MUSICBRAINZ):
+                limiter.reset_stats()
+            server.state.counts.clear()
+            start = time.perf_counter()
+            success, total = tagger.run_tagger(
+                tmp, "bench-key", logger, files=files, workers=4,
+                dry_run=True, backend=backend, batch_size=int(batch or 1),
+            )
+            elapsed = time.perf_counter() - start
+            print(f"{spec:11s} {total / elapsed:6.2f} files/s  ({success}/{total} matched, "
+                  f"{elapsed:.1f}s)")
+            for limiter in (ACOUSTID, MUSICBRAINZ):
+                print(f"            {limiter.summary()}")
+            print(f"            server: {dict(server.state.counts)}")
+    server.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
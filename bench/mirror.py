@@ -0,0 +1,176 @@
+import sys
+import gzip
+import json
+import time
+import random
+import argparse
+import tempfile
+import uuid
+from pathlib import Path
+
+from core.mirror import LOCAL, MusicBrainzMirror
+from core.albums import release_tracks
+from core import tagger
+
+# ---------------------------------------------------------------------------
+# Local MusicBrainz mirror: fixture check and lookup benchmark
+#
+#   python -m bench.mirror
+#   python -m bench.mirror --releases 20000 --lookups 50000
+#
+# First imports bench/fixtures/musicbrainz_dump_sample.jsonl (a few releases
+# in the JSON dump format, a standalone recording and an artist line that
+# must be skipped) and checks every lookup against the dump itself. Then it
+# imports a synthetic gzipped dump of --releases releases and times random
+# recording lookups, straight from the mirror and through
+# tagger.fetch_recording as a run makes them.
+# ---------------------------------------------------------------------------
+
+FIXTURE = Path(__file__).resolve().parent / "fixtures" / "musicbrainz_dump_sample.jsonl"
+
+
+def _names(credits):
+    return [c.get("name") or c["artist"]["name"] for c in credits or []]
+
+
+def check_fixture(mirror):
+    """Import the fixture and compare the mirror's answers with it; returns problems."""
+    entities = [json.loads(line) for line in FIXTURE.read_text(encoding="utf-8").splitlines()]
+    counts = mirror.import_dump(FIXTURE)
+    problems = []
+    if counts != {"releases": 3, "recordings": 1, "skipped": 1}:
+        problems.append(f"import counts {counts}")
+
+    on_releases = {}  # recording id -> {release ids}
+    for entity in entities:
+        if "media" not in entity:
+            continue
+        payload = mirror.get_release_by_id(entity["id"])
+        release = payload["release"] if payload else {}
+        if release.get("title") != entity["title"] or release.get("date") != entity["date"]:
+            problems.append(f"release {entity['id']}: {release.get('title')!r} {release.get('date')!r}")
+        if _names(release.get("artist-credit")) != _names(entity["artist-credit"]):
+            problems.append(f"release {entity['id']}: credit {release.get('artist-credit')}")
+        got = [
+            (m["position"], t["position"], t["title"], t["recording"]["id"], _names(t.get("artist-credit")
+                                                                                  or t["recording"]["artist-credit"]))
+            for m in release.get("medium-list", []) for t in m["track-list"]
+        ]
+        want = [
+            (str(m["position"]), str(t["position"]), t["title"], t["recording"]["id"], _names(t["artist-credit"]))
+            for m in entity["media"] for t in m["tracks"]
+        ]
+        if got != want:
+            problems.append(f"release {entity['id']}: tracklist differs\n  {got}\n  {want}")
+        if len(release_tracks(release)) != len({w[3] for w in want}):
+            problems.append(f"release {entity['id']}: release_tracks() lost tracks")
+        for medium in entity["media"]:
+            for track in medium["tracks"]:
+                on_releases.setdefault(track["recording"]["id"], set()).add(entity["id"])
+                recording = track["recording"]
+                payload = mirror.get_recording_by_id(recording["id"])
+                info = payload["recording"] if payload else {}
+                if info.get("title") != recording["title"]:
+                    problems.append(f"recording {recording['id']}: title {info.get('title')!r}")
+                if _names(info.get("artist-credit")) != _names(recording["artist-credit"]):
+                    problems.append(f"recording {recording['id']}: credit {info.get('artist-credit')}")
+
+    for rid, releases in on_releases.items():
+        listed = {r["id"] for r in mirror.get_recording_by_id(rid)["recording"]["release-list"]}
+        if listed != releases:
+            problems.append(f"recording {rid}: on {sorted(listed)}, expected {sorted(releases)}")
+
+    standalone = next(e for e in entities if "video" in e and e["id"] not in on_releases)
+    payload = mirror.get_recording_by_id(standalone["id"])
+    if not payload or payload["recording"]["release-list"]:
+        problems.append(f"standalone recording: {payload}")
+    tags = tagger.tags_from_recording(payload["recording"]) if payload else {}
+    if tags.get("title") != standalone["title"] or not tags.get("artist"):
+        problems.append(f"standalone recording tags: {tags}")
+    if mirror.get_recording_by_id(str(uuid.uuid4())) is not None:
+        problems.append("unknown MBID answered")
+    if mirror.get_recording_by_id("not-an-mbid") is not None:
+        problems.append("malformed MBID answered")
+    return problems
+
+
+def synthetic_release(rng, n, tracks):
+    def credit(name):
+        return [{"name": name, "joinphrase": "",
+                 "artist": {"id": str(uuid.UUID(int=rng.getrandbits(128))), "name": name}}]
+    artist = credit(f"Artist {n % 997}")
+    return {
+        "id": str(uuid.UUID(int=rng.getrandbits(128))),
+        "title": f"Release {n}",
+        "status": "Official",
+        "date": f"{1960 + n % 60}-01-01",
+        "artist-credit": artist,
+        "media": [{
+            "position": 1,
+            "track-count": tracks,
+            "tracks": [{
+                "id": str(uuid.UUID(int=rng.getrandbits(128))),
+                "position": i, "number": str(i), "title": f"Track {n}.{i}", "artist-credit": artist,
+                "recording": {"id": str(uuid.UUID(int=rng.getrandbits(128))), "title": f"Track {n}.{i}",
+                              "length": 200000, "video": False, "artist-credit": artist},
+            } for i in range(1, tracks + 1)],
+        }],
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check and benchmark the local MusicBrainz mirror.")
+    parser.add_argument("--releases", type=int, default=5000)
+    parser.add_argument("--tracks", type=int, default=12, help="tracks per synthetic release")
+    parser.add_argument("--lookups", type=int, default=20000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    rng = random.Random(args.seed)
+
+    with tempfile.TemporaryDirectory(prefix="mirror-bench-") as work:
+        work = Path(work)
+        mirror = MusicBrainzMirror(work / "fixture.sqlite3")
+        problems = check_fixture(mirror)
+        mirror.close()
+        for problem in problems:
+            print(f"FIXTURE: {problem}")
+        print(f"Fixture: {'OK' if not problems else f'{len(problems)} problems'}")
+
+        dump = work / "release.jsonl.gz"
+        rids = []
+        with gzip.open(dump, "wt", encoding="utf-8") as f:
+            for n in range(args.releases):
+                release = synthetic_release(rng, n, args.tracks)
+                rids.extend(t["recording"]["id"] for t in release["media"][0]["tracks"])
+                f.write(json.dumps(release) + "\n")
+        mirror = MusicBrainzMirror(work / "mirror.sqlite3")
+        start = time.perf_counter()
+        counts = mirror.import_dump(dump)
+        elapsed = time.perf_counter() - start
+        size = mirror.stats()["size_bytes"]
+        print(f"Import: {counts['releases']} releases / {len(rids)} recordings in {elapsed:.1f}s "
+              f"({counts['releases'] / elapsed:.0f} releases/s), "
+              f"{size / 1024 / 1024:.1f} MiB ({size / len(rids):.0f} bytes per recording)")
+
+        sample = [rng.choice(rids) for _ in range(args.lookups)]
+        start = time.perf_counter()
+        missing = sum(mirror.get_recording_by_id(rid) is None for rid in sample)
+        elapsed = time.perf_counter() - start
+        print(f"Mirror lookups: {args.lookups / elapsed:,.0f}/s ({missing} missing)")
+
+        LOCAL.use(mirror)
+        try:
+            start = time.perf_counter()
+            for rid in sample:
+                tagger.fetch_recording(rid)
+            elapsed = time.perf_counter() - start
+        finally:
+            LOCAL.use(None)
+        print(f"tagger.fetch_recording: {args.lookups / elapsed:,.0f}/s "
+              f"(MusicBrainz allows 1/s)")
+        mirror.close()
+    return 1 if problems or missing else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,194 @@
+import os
+import sys
+import time
+import shutil
+import logging
+import argparse
+import tempfile
+import multiprocessing
+from pathlib import Path
+
+from bench.library import LibrarySpec, make_library, install_fake_fpcalc, library_digest
+
+# ---------------------------------------------------------------------------
+# Sharded run vs single node
+#
+#   python -m bench.shards
+#   python -m bench.shards --files 600 --shards 8 --album-size 10 --shared
+#
+# Builds a synthetic library and one fake AcoustID/MusicBrainz server, then
+# resolves the library with core.shard twice:
+#
+#   single   one node, shard 0/1
+#   sharded  --shards nodes at once, each a spawned process with its own
+#            cache and tag index, writing one JSONL store each (merged
+#            afterwards), or all one SQLite store with --shared
+#
+# and checks that both give the same result for every file (status, MBID,
+# score, tags) and that applying each to a copy of the library leaves
+# identical files. Prints the wall time of both resolves. Exits with status 1
+# if anything differs.
+#
+# --duplicates is 0 by default: the fake fpcalc perturbs fingerprints by file
+# name, so byte-identical copies get different fingerprints, and which copy's
+# fingerprint the lookup cache keeps depends on which one a node reaches
+# first. Real fpcalc gives identical files identical fingerprints.
+# ---------------------------------------------------------------------------
+
+COMPARED = ("key", "status", "mbid", "score", "tags")
+
+
+def _node(work, library, shard, count, out, url, options):
+    """Resolve one shard (in a spawned process)."""
+    os.makedirs(work, exist_ok=True)
+    os.chdir(work)
+    os.environ.update(
+        ACOUSTID_API_KEY="bench-key",
+        TAGGER_CACHE=str(Path(work) / "lookup_cache.sqlite3"),
+        TAGGER_INDEX=str(Path(work) / "tag_index.sqlite3"),
+        TAGGER_JOURNAL=str(Path(work) / "run_journal.sqlite3"),
+        FAKE_FPCALC_DELAY=str(options["fpcalc_delay"]),
+    )
+    install_fake_fpcalc(Path(work) / "bin")
+    logging.getLogger().addHandler(logging.NullHandler())
+
+    from bench.fake_services import point_clients_at
+    from core.cache import open_default_cache
+    from core.ratelimit import ACOUSTID, MUSICBRAINZ
+    from core.shard import resolve_shard
+
+    point_clients_at(url)
+    for limiter in (ACOUSTID, MUSICBRAINZ):
+        limiter.bucket.rate = options["rate"]
+    cache = open_default_cache()
+    try:
+        resolve_shard(library, shard, count, out, "bench-key", logging.getLogger("bench"),
+                      workers=options["workers"], cache=cache, album_mode=options["album_mode"])
+    finally:
+        cache.close()
+
+
+def resolve(work, library, count, outs, url, options):
+    """Run `count` nodes at once; node i writes to outs[i]. Returns seconds."""
+    ctx = multiprocessing.get_context("spawn")
+    procs = [
+        ctx.Process(target=_node, args=(str(Path(work) / f"node{i}"), str(library), i, count,
+                                        str(outs[i]), url, options))
+        for i in range(count)
+    ]
+    start = time.perf_counter()
+    for proc in procs:
+        proc.start()
+    for proc in procs:
+        proc.join()
+    seconds = time.perf_counter() - start
+    failed = [i for i, proc in enumerate(procs) if proc.exitcode != 0]
+    if failed:
+        raise RuntimeError(f"nodes {failed} failed")
+    return seconds
+
+
+def load(store):
+    from core.shard import open_results
+    results = open_results(store)
+    try:
+        return {r["path"]: tuple(r[field] for field in COMPARED) for r in results.results()}
+    finally:
+        results.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check that a sharded run matches a single node.")
+    parser.add_argument("--files", type=int, default=300)
+    parser.add_argument("--tagged", type=float, default=0.3, help="fraction already tagged")
+    parser.add_argument("--named", type=float, default=0.3,
+                        help="fraction of untagged files named \"Artist - Title\"")
+    parser.add_argument("--duplicates", type=float, default=0.0,
+                        help="fraction of untagged files that copy another file's audio")
+    parser.add_argument("--album-size", type=int, default=0,
+                        help="lay the library out as albums (and resolve in album mode)")
+    parser.add_argument("--folders", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--shards", type=int, default=4)
+    parser.add_argument("--shared", action="store_true",
+                        help="all shards write one SQLite store instead of a JSONL file each")
+    parser.add_argument("--workers", type=int, default=2, help="fingerprint workers per node")
+    parser.add_argument("--latency", type=float, default=0.02, help="fake server latency (s)")
+    parser.add_argument("--unknown-rate", type=float, default=0.1,
+                        help="fraction of fingerprints with no match")
+    parser.add_argument("--rate", type=float, default=50.0, help="request rate per node (req/s)")
+    parser.add_argument("--fpcalc-delay", type=float, default=0.02, help="seconds per fake fpcalc run")
+    args = parser.parse_args(argv)
+
+    if os.name == "nt":
+        print("The fake fpcalc is a script; run the benchmark on Linux/macOS.")
+        return 1
+    if args.shards < 2:
+        parser.error("--shards must be at least 2")
+
+    from bench.fake_services import FakeServiceConfig, start_server
+    from core.shard import apply_results, merge_results
+
+    spec = LibrarySpec(files=args.files, tagged=args.tagged, named=args.named,
+                       duplicates=args.duplicates, album_size=args.album_size,
+                       folders=args.folders, seed=args.seed)
+    options = {"workers": args.workers, "rate": args.rate, "fpcalc_delay": args.fpcalc_delay,
+               "album_mode": bool(args.album_size)}
+    # Errors would make the two runs differ by chance; the server allows
+    # every node its full rate.
+    config = FakeServiceConfig(latency=args.latency, unknown_rate=args.unknown_rate,
+                               acoustid_rate=args.rate * args.shards,
+                               musicbrainz_rate=args.rate * args.shards)
+    server, url = start_server(config)
+    logger = logging.getLogger("bench")
+    logger.addHandler(logging.NullHandler())
+    logger.propagate = False
+
+    problems = []
+    with tempfile.TemporaryDirectory(prefix="shard-bench-") as work:
+        work = Path(work)
+        library = work / "library"
+        mix = make_library(library, spec)
+        print(f"Library: {args.files} files {mix}")
+
+        single = work / "single.jsonl"
+        seconds = resolve(work / "single", library, 1, [single], url, options)
+        print(f"single   1 node    {seconds:7.2f}s")
+
+        if args.shared:
+            merged = work / "shared.sqlite3"
+            outs = [merged] * args.shards
+        else:
+            outs = [work / "shards" / f"{i}.jsonl" for i in range(args.shards)]
+        seconds = resolve(work / "sharded", library, args.shards, outs, url, options)
+        print(f"sharded  {args.shards} nodes  {seconds:7.2f}s")
+        if not args.shared:
+            merged = work / "merged.sqlite3"
+            merge_results([work / "shards"], merged)
+
+        expected, got = load(single), load(merged)
+        print(f"Results: {len(expected)} files single, {len(got)} sharded")
+        for path in sorted(set(expected) | set(got)):
+            if expected.get(path) != got.get(path):
+                problems.append(f"{path}: {expected.get(path)} != {got.get(path)}")
+
+        digests = []
+        for name, store in (("single", single), ("sharded", merged)):
+            copy = work / f"apply-{name}"
+            shutil.copytree(library, copy)
+            counts = apply_results(store, copy, logger)
+            print(f"apply    {name:8s} " + ", ".join(f"{n} {k}" for k, n in counts.items()))
+            digests.append(library_digest(copy))
+        if digests[0] != digests[1]:
+            problems.append(f"applied libraries differ: {digests[0]} != {digests[1]}")
+    server.shutdown()
+
+    for problem in problems[:20]:
+        print(f"FAIL {problem}")
+    if not problems:
+        print("Sharded results match the single node.")
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,114 @@
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+from pathlib import Path
+
+# ---------------------------------------------------------------------------
+# Start-up (import time) benchmark
+#
+#   python -m bench.startup
+#   python -m bench.startup --runs 20 --out startup.json
+#
+# Starts a fresh interpreter per run and times how long each entry point's
+# imports take (interpreter start-up itself is not counted). It also lists
+# the slowest imports and which heavy modules an entry point pulls in
+# before it has any work to do. The run fails if a budget is exceeded or a
+# deferred module shows up.
+# ---------------------------------------------------------------------------
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# name -> (code run in the child, budget in ms)
+ENTRY_POINTS = {
+    "cli --help": ("import fix_metadata; fix_metadata.build_parser()", 60),
+    "core.file_utils": ("import core.file_utils", 80),
+    "gui": ("import gui_metadata_fixer", 400),  # customtkinter/Tk dominate
+}
+
+# Needed only once a run starts, never at import time.
+DEFERRED = ("requests", "acoustid", "musicbrainzngs", "mutagen", "asyncio", "dotenv", "tqdm")
+
+PROBE = (
+    "import sys, json, time; t = time.perf_counter(); {code}; "
+    "print(json.dumps([time.perf_counter() - t, sorted(sys.modules)]))"
+)
+
+
+def run_child(code):
+    """(seconds spent in `code`, modules loaded) in a fresh interpreter, or None."""
+    proc = subprocess.run(
+        [sys.executable, "-c", PROBE.format(code=code)],
+        cwd=ROOT, capture_output=True, text=True,
+        env=dict(os.environ, PYTHONDONTWRITEBYTECODE="1"),
+    )
+    if proc.returncode:
+        return None
+    seconds, modules = json.loads(proc.stdout.strip().splitlines()[-1])
+    return seconds, modules
+
+
+def import_times(code):
+    """{module: cumulative microseconds} from -X importtime."""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=ROOT, capture_output=True, text=True,
+    )
+    times = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:"):].split("|")
+        if len(fields) == 3 and fields[1].strip().isdigit():  # skip the header
+            times[fields[2].strip()] = int(fields[1])
+    return times
+
+
+def top_imports(code, count, startup):
+    """The `count` slowest imports of `code`, leaving out interpreter start-up (`startup`)."""
+    rows = [(us, name) for name, us in import_times(code).items() if name not in startup]
+    return sorted(rows, reverse=True)[:count]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure start-up import time.")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--top", type=int, default=8, help="slowest imports to list per entry")
+    parser.add_argument("--entries", default=",".join(ENTRY_POINTS))
+    parser.add_argument("--out", metavar="PATH", help="write the results as JSON")
+    args = parser.parse_args(argv)
+
+    entries = [e for e in args.entries.split(",") if e]
+    startup = set(import_times("pass"))
+    print(f"Python {sys.version.split()[0]}, {args.runs} runs each\n")
+
+    results, failed = {}, False
+    for name in entries:
+        code, budget = ENTRY_POINTS[name]
+        samples = [run_child(code) for _ in range(args.runs)]
+        if any(s is None for s in samples):
+            print(f"{name:16s} skipped (import failed, missing dependency?)")
+            continue
+        ms = statistics.median(s[0] for s in samples) * 1000
+        loaded = [m for m in DEFERRED if m in samples[0][1]]
+        over = ms > budget
+        failed = failed or over or bool(loaded)
+        flags = ("  OVER BUDGET" if over else "") + (f"  loads {', '.join(loaded)}" if loaded else "")
+        print(f"{name:16s} {ms:7.1f} ms (budget {budget} ms){flags}")
+        slowest = top_imports(code, args.top, startup)
+        for cumulative_us, module in slowest:
+            print(f"    {cumulative_us / 1000:7.1f} ms  {module}")
+        results[name] = {
+            "ms": round(ms, 2), "budget_ms": budget, "deferred_loaded": loaded,
+            "slowest": [[m, round(us / 1000, 2)] for us, m in slowest],
+        }
+
+    if args.out:
+        Path(args.out).write_text(json.dumps({"python": sys.version, "results": results}, indent=2))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,342 @@
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import platform
+import tempfile
+import subprocess
+import multiprocessing
+from datetime import datetime
+from pathlib import Path
+
+from bench.library import FORMATS, LibrarySpec, make_library, install_fake_fpcalc, library_digest
+from core.formats import is_audio_file
+
+# ---------------------------------------------------------------------------
+# Offline benchmark suite
+#
+#   python -m bench.suite --files 500 --latency 0.05 --out results.json
+#   python -m bench.suite --files 500 --compare results.json   # regression check
+#
+# Builds a synthetic library (bench.library) once, then runs each target in
+# a fresh process against a fresh copy of it, with the fake fpcalc and the
+# fake AcoustID/MusicBrainz server (bench.fake_services) standing in for the
+# real things:
+#
+#   scan_cold  scan_for_untagged with an empty tag index
+#   scan_warm  scan_for_untagged with the index already filled
+#   run_tagger core.tagger.run_tagger over the untagged files
+#   pipeline   core.file_utils.run_auto_tag_pipeline end to end
+#
+# Each target reports files/sec (files scanned, or files tagged), per-stage
+# latency percentiles, the process's peak RSS and, for the tagging targets,
+# how many bytes the tag writes cost. Stage latencies come from
+# the per-file records, i.e. how long the tagging loop waited on each stage;
+# work the pools finished ahead of time shows up as ~0. Results are written
+# as JSON; --compare flags targets whose files/sec dropped by more than
+# --tolerance and exits with status 1.
+# ---------------------------------------------------------------------------
+
+TARGETS = ("scan_cold", "scan_warm", "run_tagger", "pipeline")
+STAGES = ("fingerprint", "acoustid", "musicbrainz", "write", "total")
+PERCENTILES = (50, 90, 99)
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a non-empty list."""
+    ordered = sorted(values)
+    rank = max(1, -(-pct * len(ordered) // 100))
+    return ordered[rank - 1]
+
+
+def summarize(samples):
+    """{stage: [seconds]} -> {stage: {count, mean, p50, p90, p99, max}}."""
+    out = {}
+    for stage, values in samples.items():
+        if not values:
+            continue
+        out[stage] = {"count": len(values), "mean": round(sum(values) / len(values), 6)}
+        for pct in PERCENTILES:
+            out[stage][f"p{pct}"] = round(percentile(values, pct), 6)
+        out[stage]["max"] = round(max(values), 6)
+    return out
+
+
+def peak_rss_bytes():
+    """Peak resident set size of this process, or None where unsupported."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+# ---------------------------------------------------------------------------
+# One target, run in a child process
+# ---------------------------------------------------------------------------
+def _prepare(work, library, options):
+    """Fresh library copy, state files, fake services and fpcalc for one target."""
+    lib = Path(work) / "lib"
+    shutil.copytree(library, lib)
+    os.chdir(work)  # logs/ and anything else relative lands here
+    os.environ.update(
+        ACOUSTID_API_KEY="bench-key",
+        TAGGER_CACHE=str(Path(work) / "lookup_cache.sqlite3"),
+        TAGGER_INDEX=str(Path(work) / "tag_index.sqlite3"),
+        TAGGER_JOURNAL=str(Path(work) / "run_journal.sqlite3"),
+        FAKE_FPCALC_DELAY=str(options["fpcalc_delay"]),
+    )
+    if options.get("backend"):
+        os.environ["TAGGER_BACKEND"] = options["backend"]
+    install_fake_fpcalc(Path(work) / "bin")
+
+    # Keep the pipeline's logging quiet: basicConfig() is a no-op once the
+    # root logger has a handler.
+    logging.getLogger().addHandler(logging.NullHandler())
+
+    from bench.fake_services import FakeServiceConfig, start_server, point_clients_at
+    from core.ratelimit import ACOUSTID, MUSICBRAINZ
+
+    config = FakeServiceConfig(
+        latency=options["latency"], jitter=options["jitter"],
+        error_rate=options["error_rate"], unknown_rate=options["unknown_rate"],
+        acoustid_rate=options["rate"], musicbrainz_rate=options["rate"],
+    )
+    server, url = start_server(config)
+    point_clients_at(url)
+    for limiter in (ACOUSTID, MUSICBRAINZ):
+        limiter.bucket.rate = options["rate"]
+    return lib, server
+
+
+def run_target(target, library, options):
+    """Run one target and return its result dict (call in a fresh process)."""
+    with tempfile.TemporaryDirectory(prefix=f"bench-{target}-") as work:
+        lib, server = _prepare(work, library, options)
+        from core.file_utils import scan_for_untagged, run_auto_tag_pipeline
+        from core.tagger import run_tagger
+        from core.tagwriter import WRITER
+
+        files = sum(1 for p in lib.rglob("*") if is_audio_file(p))
+        samples = {stage: [] for stage in STAGES}
+        first_result = []
+
+        def on_result(record):
+            if not first_result:
+                first_result.append(time.perf_counter())
+            for stage in STAGES:
+                if stage in record["timings"]:
+                    samples[stage].append(record["timings"][stage])
+
+        if target == "scan_warm":
+            scan_for_untagged(lib)  # fill the index
+        untagged = scan_for_untagged(lib) if target == "run_tagger" else None
+        rss_before = peak_rss_bytes()
+
+        repeats = options["scan_repeat"] if target.startswith("scan") else 1
+        runs = []
+        for n in range(repeats):
+            if target == "scan_cold" and n:
+                os.environ["TAGGER_INDEX"] = str(Path(work) / f"tag_index{n}.sqlite3")
+            start = time.perf_counter()
+            if target.startswith("scan"):
+                scan_for_untagged(lib)
+                found = files
+            elif target == "run_tagger":
+                logger = logging.getLogger("bench")
+                run_tagger(lib, "bench-key", logger, files=untagged, workers=options["workers"],
+                           on_result=on_result)
+                found = len(untagged)
+            else:
+                run_auto_tag_pipeline(str(lib), workers=options["workers"], on_result=on_result)
+                found = len(samples["total"])
+            runs.append(time.perf_counter() - start)
+
+        if target.startswith("scan"):
+            samples = {"scan": runs}
+        seconds = percentile(runs, 50)
+        result = {
+            "files": files,
+            "processed": found,
+            "seconds": round(seconds, 4),
+            "files_per_sec": round(found / seconds, 2) if seconds else None,
+            "first_result_seconds": round(first_result[0] - start, 4) if first_result else None,
+            "stages": summarize(samples),
+            "peak_rss_bytes": peak_rss_bytes(),
+            "setup_rss_bytes": rss_before,
+            "services": dict(server.state.counts),
+            "tag_writes": dict(WRITER.stats),
+        }
+        server.shutdown()
+        os.chdir(tempfile.gettempdir())
+        return result
+
+
+def _child(target, library, options, queue):
+    try:
+        queue.put(("ok", run_target(target, library, options)))
+    except Exception as e:
+        queue.put(("error", repr(e)))
+
+
+def run_isolated(target, library, options):
+    """run_target() in a spawned process, so peak RSS is per target."""
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue()
+    proc = ctx.Process(target=_child, args=(target, str(library), options, queue))
+    proc.start()
+    status, payload = queue.get()
+    proc.join()
+    if status != "ok":
+        raise RuntimeError(f"{target} failed: {payload}")
+    return payload
+
+
+# ---------------------------------------------------------------------------
+# Reporting
+# ---------------------------------------------------------------------------
+def git_revision():
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+            cwd=Path(__file__).resolve().parent.parent,
+        )
+        return out.stdout.strip() or None
+    except OSError:
+        return None
+
+
+def print_result(target, result):
+    rss = result["peak_rss_bytes"]
+    rss = f"{rss / 2**20:.0f} MiB" if rss else "n/a"
+    first = result.get("first_result_seconds")
+    first = f"  first file after {first:.2f}s" if first is not None else ""
+    print(f"{target:11s} {result['files_per_sec'] or 0:9.1f} files/s  "
+          f"{result['seconds']:8.3f}s  peak RSS {rss}{first}")
+    writes = result.get("tag_writes") or {}
+    if writes.get("in_place") or writes.get("rewrite"):
+        print(f"            tag writes   {writes['in_place']} in place, {writes['rewrite']} rewritten, "
+              f"{writes['bytes_written'] / 2**20:.1f} MiB written")
+    for stage, s in result["stages"].items():
+        print(f"            {stage:12s} p50 {s['p50'] * 1000:8.1f} ms  "
+              f"p90 {s['p90'] * 1000:8.1f} ms  p99 {s['p99'] * 1000:8.1f} ms")
+
+
+def compare(current, baseline, tolerance):
+    """Print files/sec changes against `baseline`. Returns the regressed targets."""
+    regressed = []
+    print(f"\nAgainst {baseline['meta'].get('revision') or 'baseline'} "
+          f"({baseline['meta'].get('timestamp', '?')}):")
+    for target, result in current["results"].items():
+        old = baseline["results"].get(target)
+        if not old or not old.get("files_per_sec") or not result.get("files_per_sec"):
+            continue
+        change = result["files_per_sec"] / old["files_per_sec"] - 1
+        flag = ""
+        if change < -tolerance:
+            flag = "  <-- regression"
+            regressed.append(target)
+        print(f"  {target:11s} {old['files_per_sec']:9.1f} -> {result['files_per_sec']:9.1f} "
+              f"files/s ({change:+.1%}){flag}")
+    return regressed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmark suite.")
+    parser.add_argument("--files", type=int, default=200)
+    parser.add_argument("--tagged", type=float, default=0.5, help="fraction already tagged")
+    parser.add_argument("--partial", type=float, default=0.05, help="fraction with artist only")
+    parser.add_argument("--v1-only", type=float, default=0.05, help="fraction tagged in ID3v1 only")
+    parser.add_argument("--cover", type=float, default=0.3, help="fraction of tagged files with cover art")
+    parser.add_argument("--cover-kb", type=int, default=200)
+    parser.add_argument("--audio-kb", type=int, default=64)
+    parser.add_argument("--duplicates", type=float, default=0.0,
+                        help="fraction of untagged files that copy another file's audio")
+    parser.add_argument("--album-size", type=int, default=0,
+                        help="lay the library out as albums of this many tracks (0 = no albums)")
+    parser.add_argument("--named", type=float, default=0.0,
+                        help="fraction of untagged files named \"Artist - Title\"")
+    parser.add_argument("--formats", default="mp3",
+                        help=f"containers to mix, comma-separated ({','.join(FORMATS)})")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--targets", default=",".join(TARGETS))
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--backend", choices=("threads", "async"), default=None)
+    parser.add_argument("--latency", type=float, default=0.02, help="fake server latency (s)")
+    parser.add_argument("--jitter", type=float, default=0.01)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of 502s")
+    parser.add_argument("--unknown-rate", type=float, default=0.1,
+                        help="fraction of fingerprints with no match")
+    parser.add_argument("--rate", type=float, default=50.0,
+                        help="request rate allowed by the server and our buckets (req/s)")
+    parser.add_argument("--fpcalc-delay", type=float, default=0.02, help="seconds per fake fpcalc run")
+    parser.add_argument("--scan-repeat", type=int, default=5)
+    parser.add_argument("--out", metavar="PATH", help="write the results as JSON")
+    parser.add_argument("--compare", metavar="PATH", help="baseline JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.10,
+                        help="allowed files/sec drop before --compare fails (default 10%%)")
+    args = parser.parse_args(argv)
+
+    if os.name == "nt":
+        print("The fake fpcalc is a script; run the benchmark suite on Linux/macOS.")
+        return 1
+
+    targets = [t for t in args.targets.split(",") if t]
+    unknown = set(targets) - set(TARGETS)
+    if unknown:
+        parser.error(f"unknown targets: {', '.join(sorted(unknown))}")
+    formats = [f for f in args.formats.split(",") if f]
+    if not formats or set(formats) - set(FORMATS):
+        parser.error(f"--formats takes a comma-separated subset of {','.join(FORMATS)}")
+
+    spec = LibrarySpec(
+        files=args.files, tagged=args.tagged, partial=args.partial, v1_only=args.v1_only,
+        cover=args.cover, cover_kb=args.cover_kb, audio_kb=args.audio_kb, seed=args.seed,
+        duplicates=args.duplicates, album_size=args.album_size,
+        formats=formats, named=args.named,
+    )
+    options = {
+        "workers": args.workers, "backend": args.backend, "latency": args.latency,
+        "jitter": args.jitter, "error_rate": args.error_rate,
+        "unknown_rate": args.unknown_rate, "rate": args.rate,
+        "fpcalc_delay": args.fpcalc_delay, "scan_repeat": args.scan_repeat,
+    }
+
+    with tempfile.TemporaryDirectory(prefix="bench-library-") as tmp:
+        started = time.perf_counter()
+        mix = make_library(tmp, spec)
+        print(f"Library: {args.files} files {mix} in {time.perf_counter() - started:.1f}s")
+        report = {
+            "meta": {
+                "timestamp": datetime.now().isoformat(timespec="seconds"),
+                "revision": git_revision(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "library": dict(spec.as_dict(), mix=mix, digest=library_digest(tmp)),
+                "options": options,
+            },
+            "results": {},
+        }
+        for target in targets:
+            result = run_isolated(target, tmp, options)
+            report["results"][target] = result
+            print_result(target, result)
+
+    if args.out:
+        Path(args.out).write_text(json.dumps(report, indent=2))
+        print(f"\nResults written to {args.out}")
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text())
+        if baseline["meta"].get("library", {}).get("digest") != report["meta"]["library"]["digest"]:
+            print("Note: the baseline was measured on a different library.")
+        if compare(report, baseline, args.tolerance):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
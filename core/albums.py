@@ -0,0 +1,192 @@
+import os
+import re
+from collections import OrderedDict
+from pathlib import Path
+
+from core import services
+from core.cache import RecordingMemo
+from core.mirror import LOCAL
+from core.ratelimit import MUSICBRAINZ
+
+# ---------------------------------------------------------------------------
+# Album-level resolution
+#
+# Per-file tagging fetches one recording per track and takes whichever
+# release MusicBrainz lists first, so an album costs a request per track and
+# its tracks can end up on different releases. In album mode the first
+# track resolved in a folder also fetches its likeliest release (named like
+# the folder, else official, else earliest) with the full tracklist. Later
+# files in the same folder whose AcoustID candidates are on one of the
+# folder's releases are tagged straight from it, taking the best-scoring
+# such candidate: no recording lookup, and every track gets the same album,
+# date and album artist plus its own track (and disc) number. Releases
+# fetched for other folders are not used, so a loose single never picks up
+# a compilation's tracklist.
+# ---------------------------------------------------------------------------
+
+RELEASE_INCLUDES = ["recordings", "artist-credits"]
+RECENT_RELEASES = 16         # tracklists kept for matching
+MAX_RELEASES_PER_FOLDER = 3  # release fetches before a folder counts as mixed
+
+RELEASES = RecordingMemo(maxsize=256, name="Release")
+
+
+def default_album_mode():
+    """TAGGER_ALBUM_MODE=1 in .env turns album-level resolution on."""
+    return (os.getenv("TAGGER_ALBUM_MODE") or "").strip().lower() in {"1", "true", "yes", "on"}
+
+
+def credit_names(credits):
+    """"A, B" from a musicbrainzngs artist-credit list."""
+    names = []
+    for a in credits or []:
+        if isinstance(a, dict) and "artist" in a:
+            names.append(a["artist"].get("name", ""))
+        elif isinstance(a, str):
+            names.append(a)
+    return ", ".join(filter(None, names))
+
+
+def _fetch_release_remote(release_id):
+    return MUSICBRAINZ.call(services.get_release_by_id, release_id, includes=RELEASE_INCLUDES)
+
+
+def fetch_release(release_id, cache=None):
+    """Fetch a release with its tracklist: from the local mirror if it has
+    it, else memoized like recordings."""
+    payload = LOCAL.release(release_id, RELEASE_INCLUDES)
+    if payload is not None:
+        return payload
+    return RELEASES.get(release_id, _fetch_release_remote, cache)
+
+
+def release_tracks(release):
+    """{recording id: EasyID3 tags} for every track of a release (the "release" dict)."""
+    album_artist = credit_names(release.get("artist-credit"))
+    media = release.get("medium-list", [])
+    tracks = {}
+    for medium in media:
+        track_list = medium.get("track-list", [])
+        count = medium.get("track-count") or len(track_list)
+        for track in track_list:
+            recording = track.get("recording", {})
+            rid = recording.get("id")
+            if not rid or rid in tracks:
+                continue
+            artist = credit_names(track.get("artist-credit") or recording.get("artist-credit"))
+            tags = {
+                "title": track.get("title") or recording.get("title", ""),
+                "artist": artist or album_artist,
+                "album": release.get("title", ""),
+                "albumartist": album_artist,
+                "date": release.get("date", ""),
+                "tracknumber": f"{track.get('position') or track.get('number')}/{count}",
+            }
+            if len(media) > 1:
+                tags["discnumber"] = f"{medium.get('position', 1)}/{len(media)}"
+            tracks[rid] = {k: v for k, v in tags.items() if v or k == "title"}
+    return tracks
+
+
+def _normalize(text):
+    return re.sub(r"[^0-9a-z]+", "", text.lower())
+
+
+def pick_release(releases, folder_name=""):
+    """The release a track most likely belongs to: the one named like its
+    folder, else an official one, else the earliest."""
+    folder = _normalize(folder_name)
+
+    def rank(release):
+        title = _normalize(release.get("title", ""))
+        return (
+            not (title and title in folder),
+            release.get("status") != "Official",
+            release.get("date") or "9999",
+        )
+
+    candidates = [r for r in releases if r.get("id")]
+    return min(candidates, key=rank) if candidates else None
+
+
+class AlbumResolver:
+    """Tags files from whole releases, fetching each release once.
+
+    Used from the tagging thread only (run_tagger), so it takes no locks.
+    """
+
+    def __init__(self, cache=None):
+        self.cache = cache
+        self._recent = OrderedDict()   # release id -> {recording id: tags}
+        self._folders = OrderedDict()  # folder -> release ids learned for it
+        self._fetched = OrderedDict()  # folder -> releases fetched for it
+        self.stats = {"hits": 0, "releases": 0}
+
+    def match(self, results, threshold, path):
+        """(score, rid, tags) for the best-scoring AcoustID candidate above
+        `threshold` that is on a release fetched for the folder of `path`,
+        or None."""
+        releases = [
+            self._recent[release_id]
+            for release_id in reversed(self._folders.get(Path(path).parent, ()))
+            if release_id in self._recent
+        ]
+        best = None
+        for score, rid, *_ in results:
+            if score <= threshold or (best is not None and score <= best[0]):
+                continue
+            for tracks in releases:
+                if rid in tracks:
+                    best = score, rid, tracks[rid]
+                    break
+        if best is not None:
+            self.stats["hits"] += 1
+        return best
+
+    def learn(self, recording, path):
+        """Fetch the likeliest release of `recording` (a resolved recording dict)
+        and return the tags of its track there.
+
+        Returns None if the recording lists no release or the folder has used
+        up its release fetches (a mixed folder, not an album). Network errors
+        propagate.
+        """
+        folder = Path(path).parent
+        # musicbrainzngs calls the list "release-list".
+        release = pick_release(
+            recording.get("release-list") or recording.get("releases") or [], folder.name
+        )
+        if release is None:
+            return None
+        tracks = self._recent.get(release["id"])
+        if tracks is None:
+            # Counted per folder, so interleaved folders (streamed or
+            # ranked runs) each get their own allowance.
+            fetched = self._fetched.get(folder, 0)
+            if fetched >= MAX_RELEASES_PER_FOLDER:
+                return None
+            self._fetched[folder] = fetched + 1
+            self._fetched.move_to_end(folder)
+            if len(self._fetched) > RECENT_RELEASES:
+                self._fetched.popitem(last=False)
+            payload = fetch_release(release["id"], self.cache)
+            tracks = release_tracks(payload.get("release", {}))
+            self.stats["releases"] += 1
+        self._recent[release["id"]] = tracks
+        self._recent.move_to_end(release["id"])
+        if len(self._recent) > RECENT_RELEASES:
+            self._recent.popitem(last=False)
+        learned = self._folders.setdefault(folder, [])
+        if release["id"] not in learned:
+            learned.append(release["id"])
+        self._folders.move_to_end(folder)
+        if len(self._folders) > RECENT_RELEASES:
+            self._folders.popitem(last=False)
+        return tracks.get(recording.get("id"))
+
+    def summary(self):
+        s = self.stats
+        return (
+            f"Album mode: {s['hits']} files tagged from {s['releases']} release tracklists "
+            f"without a recording lookup"
+        )
@@ -0,0 +1,263 @@
+import gzip
+import asyncio
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import acoustid
+
+from core import services
+from core.cache import content_key
+from core.ratelimit import ACOUSTID, MUSICBRAINZ, TransientError
+
+# ---------------------------------------------------------------------------
+# Asyncio lookup backend
+#
+# Keeps many AcoustID / MusicBrainz requests in flight over pooled keep-alive
+# connections, paced by the same per-service buckets as the blocking path
+# (core.ratelimit). It runs on its own event loop thread and plugs into
+# run_tagger(backend="async"). For each file it fingerprints (worker pool),
+# looks the fingerprint up, and prefetches the best recording into
+# core.tagger.RECORDINGS, so tag_file finds everything ready.
+# ---------------------------------------------------------------------------
+
+MAX_IN_FLIGHT = 32
+MAX_CONNECTIONS_PER_HOST = 4
+
+
+class AsyncHTTPPool:
+    """Minimal HTTP/1.1 client with a keep-alive connection pool per host."""
+
+    def __init__(self, max_connections=MAX_CONNECTIONS_PER_HOST, timeout=services.TIMEOUT):
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self._idle = {}
+        self._limits = {}
+        self.stats = {"requests": 0, "connections_opened": 0}
+
+    async def _connect(self, scheme, host, port):
+        ssl = scheme == "https" or None
+        reader, writer = await asyncio.open_connection(host, port, ssl=ssl)
+        self.stats["connections_opened"] += 1
+        return reader, writer
+
+    async def request(self, method, url, headers=None, body=None):
+        """Send a request. Returns (status, headers, body); header names are lower-case."""
+        parts = urlsplit(url)
+        scheme = parts.scheme or "http"
+        port = parts.port or (443 if scheme == "https" else 80)
+        key = (scheme, parts.hostname, port)
+        target = parts.path or "/"
+        if parts.query:
+            target += "?" + parts.query
+
+        lines = [f"{method} {target} HTTP/1.1", f"Host: {parts.netloc}",
+                 "Connection: keep-alive", "Accept-Encoding: gzip"]
+        for name, value in (headers or {}).items():
+            lines.append(f"{name}: {value}")
+        if body is not None:
+            lines.append(f"Content-Length: {len(body)}")
+        raw = ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + (body or b"")
+
+        limit = self._limits.setdefault(key, asyncio.Semaphore(self.max_connections))
+        async with limit:
+            idle = self._idle.setdefault(key, [])
+            # A pooled connection may have been closed by the server while
+            # idle; in that case retry once on a fresh one.
+            for attempt in range(2):
+                reused = bool(idle)
+                try:
+                    # Connecting counts against the timeout, too.
+                    conn, (status, resp_headers, data, keep) = await asyncio.wait_for(
+                        self._exchange(idle.pop() if reused else None, key, raw), self.timeout
+                    )
+                except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError, ValueError) as e:
+                    if reused and attempt == 0:
+                        continue
+                    raise TransientError(f"HTTP request to {parts.netloc} failed: {e!r}")
+                self.stats["requests"] += 1
+                if keep:
+                    idle.append(conn)
+                else:
+                    conn[1].close()
+                return status, resp_headers, data
+
+    async def _exchange(self, conn, key, raw):
+        """One round trip on `conn`, or on a new connection if it is None.
+        Returns (conn, response); the connection is closed if anything fails."""
+        if conn is None:
+            conn = await self._connect(*key)
+        try:
+            return conn, await self._roundtrip(conn, raw)
+        except BaseException:  # including the cancellation by wait_for
+            conn[1].close()
+            raise
+
+    async def _roundtrip(self, conn, raw):
+        reader, writer = conn
+        writer.write(raw)
+        await writer.drain()
+
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionResetError("connection closed")
+        status = int(status_line.split()[1])
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        keep = headers.get("connection", "").lower() != "close"
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b";")[0], 16)
+                if size == 0:
+                    await reader.readline()
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readline()
+            data = b"".join(chunks)
+        elif "content-length" in headers:
+            data = await reader.readexactly(int(headers["content-length"]))
+        else:
+            data = await reader.read()
+            keep = False
+        if headers.get("content-encoding", "").lower() == "gzip":
+            data = gzip.decompress(data)
+        return status, headers, data, keep
+
+    async def close(self):
+        for connections in self._idle.values():
+            for _, writer in connections:
+                writer.close()
+        self._idle.clear()
+
+
+# ---------------------------------------------------------------------------
+# Service calls (same parsing as core.services)
+# ---------------------------------------------------------------------------
+async def acoustid_lookup(http, api_key, fingerprint, duration):
+    body = gzip.compress(services.acoustid_lookup_body(api_key, fingerprint, duration))
+    status, headers, data = await http.request(
+        "POST", services.acoustid_lookup_url(), services.ACOUSTID_POST_HEADERS, body
+    )
+    return services.parse_acoustid_response(status, headers.get("retry-after"), data)
+
+
+async def get_recording_by_id(http, rid, includes=("artists", "releases")):
+    status, headers, data = await http.request(
+        "GET", services.recording_url(rid, includes), {"User-Agent": services.user_agent()}
+    )
+    return services.parse_recording_response(status, headers.get("retry-after"), data, rid)
+
+
+# ---------------------------------------------------------------------------
+# Engine
+# ---------------------------------------------------------------------------
+class AsyncLookupEngine:
+    """Event loop thread + fingerprint pool + pooled HTTP client."""
+
+    def __init__(self, api_key, workers, cache=None, max_in_flight=MAX_IN_FLIGHT,
+                 prefetch_recordings=True, journal=None):
+        self.api_key = api_key
+        self.prefetch_recordings = prefetch_recordings
+        self.cache = cache
+        self.journal = journal
+        self.max_in_flight = max_in_flight
+        self.fingerprint_pool = ThreadPoolExecutor(max_workers=max(1, workers),
+                                                   thread_name_prefix="fpcalc")
+        self.loop = asyncio.new_event_loop()
+        self.http = AsyncHTTPPool()
+        self._thread = threading.Thread(target=self.loop.run_forever, daemon=True,
+                                        name="async-lookup")
+        self._thread.start()
+
+    async def resolve(self, path):
+        """Fingerprint + AcoustID lookup for one file, prefetching its best recording.
+
+        Returns the AcoustID results, or None if tag_file will not need them
+        (file already tagged or results cached).
+        """
+        # Imported here: core.tagger imports this module lazily for backend="async".
+        from core.tagger import RECORDINGS, _fingerprint_stage, MATCH_THRESHOLD
+
+        loop = asyncio.get_running_loop()
+        fp = await loop.run_in_executor(self.fingerprint_pool, self._fingerprint, path,
+                                        _fingerprint_stage)
+        if fp is None:
+            return None
+        duration, fingerprint = fp
+        response = await ACOUSTID.call_async(
+            acoustid_lookup, self.http, self.api_key, fingerprint, duration
+        )
+        results = list(acoustid.parse_lookup_result(response))
+        if self.cache:
+            # Stored straight away so an interrupted run doesn't repeat it.
+            self.cache.put_lookup(content_key(path), results)
+
+        for score, rid, _, _ in results:
+            if score > MATCH_THRESHOLD and self.prefetch_recordings:
+                try:
+                    await RECORDINGS.get_async(rid, self._fetch_recording, self.cache)
+                except Exception:
+                    pass  # tag_file fetches (and reports) it itself
+                break
+        return results
+
+    def _fingerprint(self, path, stage):
+        """The fingerprint stage (on a pool thread), journaled as in tag_file."""
+        fp = stage(path, self.cache)
+        if fp is not None and self.journal:
+            self.journal.mark(path, "fingerprinted")
+        return fp
+
+    async def _fetch_recording(self, rid):
+        return await MUSICBRAINZ.call_async(get_recording_by_id, self.http, rid)
+
+    def submit(self, path):
+        return asyncio.run_coroutine_threadsafe(self.resolve(path), self.loop)
+
+    def close(self):
+        asyncio.run_coroutine_threadsafe(self.http.close(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self.loop.close()
+        self.fingerprint_pool.shutdown(wait=True)
+
+
+def iter_async_lookups(paths, api_key, workers, cache=None, max_in_flight=MAX_IN_FLIGHT,
+                       logger=None, prefetch_recordings=True, journal=None):
+    """Yield (path, lookup) pairs in input order, resolving up to `max_in_flight` ahead.
+
+    `lookup` is a zero-argument callable returning the AcoustID results (or
+    raising the lookup error), suitable for tag_file(lookup=...). Without
+    `prefetch_recordings` (album mode), recordings are left to tag_file.
+    Files are marked fingerprinted in `journal`, if given.
+    """
+    engine = AsyncLookupEngine(api_key, workers, cache, max_in_flight, prefetch_recordings,
+                               journal)
+    pending = deque()
+    try:
+        for path in paths:
+            pending.append((path, engine.submit(str(path))))
+            if len(pending) >= max_in_flight:
+                done_path, future = pending.popleft()
+                yield done_path, future.result
+        while pending:
+            done_path, future = pending.popleft()
+            yield done_path, future.result
+    finally:
+        for _, future in pending:
+            future.cancel()
+        if logger:
+            s = engine.http.stats
+            logger.info(
+                f"Async lookups: {s['requests']} HTTP requests over "
+                f"{s['connections_opened']} connections"
+            )
+        engine.close()
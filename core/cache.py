@@ -0,0 +1,424 @@
+import os
+import sys
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+# ---------------------------------------------------------------------------
+# Persistent fingerprint / lookup cache
+#
+#   fingerprints : content key -> (duration, chromaprint fingerprint)
+#   lookups      : content key -> AcoustID results [(score, rid, title, artist)]
+#   recordings   : MusicBrainz recording (or release) id -> lookup payload
+#   retries      : content key -> failed runs so far, when to try again
+#                  (core.scheduler)
+#
+# Every row carries an expiry timestamp; expired rows are ignored on read and
+# removed by prune(). An empty lookup result (a file AcoustID did not know)
+# is cached too, with a shorter TTL, so hopeless files are not re-queried
+# every night.
+# ---------------------------------------------------------------------------
+
+DAY = 24 * 60 * 60
+DEFAULT_CACHE_PATH = Path("cache") / "lookup_cache.sqlite3"
+HASH_CHUNK = 64 * 1024
+KEY_MEMO_SIZE = 8192  # content keys remembered (see content_key)
+
+TABLES = ("fingerprints", "lookups", "recordings", "retries")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS fingerprints (
+    key TEXT PRIMARY KEY,
+    duration REAL NOT NULL,
+    fingerprint BLOB NOT NULL,
+    created REAL NOT NULL,
+    expires REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS lookups (
+    key TEXT PRIMARY KEY,
+    results TEXT NOT NULL,
+    created REAL NOT NULL,
+    expires REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS recordings (
+    key TEXT PRIMARY KEY,
+    payload TEXT NOT NULL,
+    created REAL NOT NULL,
+    expires REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS retries (
+    key TEXT PRIMARY KEY,
+    failures INTEGER NOT NULL,
+    next_try REAL NOT NULL,
+    created REAL NOT NULL,
+    expires REAL NOT NULL
+);
+"""
+
+_KEYS = OrderedDict()  # (path, size, mtime_ns) -> content key
+_KEYS_LOCK = threading.Lock()
+
+
+def content_key(path):
+    """Key a file by its size and the first/last 64 KiB of its content.
+
+    Stable across moves and copies (unlike inode/mtime), and cheap compared
+    with hashing whole files. Changing the tags changes the key, which is
+    what we want: the cached lookup belonged to the old file state.
+
+    Keys are memoized by path, size and mtime (as the tag index trusts
+    them), so the stages of one run that each need a file's key (scheduler,
+    fingerprinting, lookups, tag_file) read it only once.
+    """
+    st = os.stat(path)
+    memo = (os.fspath(path), st.st_size, st.st_mtime_ns)
+    with _KEYS_LOCK:
+        key = _KEYS.get(memo)
+        if key is not None:
+            _KEYS.move_to_end(memo)
+            return key
+    digest = hashlib.sha1(str(st.st_size).encode())
+    with open(path, "rb") as f:
+        digest.update(f.read(HASH_CHUNK))
+        if st.st_size > 2 * HASH_CHUNK:
+            f.seek(-HASH_CHUNK, os.SEEK_END)
+            digest.update(f.read(HASH_CHUNK))
+    key = digest.hexdigest()
+    with _KEYS_LOCK:
+        _KEYS[memo] = key
+        if len(_KEYS) > KEY_MEMO_SIZE:
+            _KEYS.popitem(last=False)
+    return key
+
+
+def default_cache_path():
+    """Cache location: TAGGER_CACHE from .env, else cache/lookup_cache.sqlite3."""
+    return Path(os.getenv("TAGGER_CACHE") or DEFAULT_CACHE_PATH)
+
+
+def open_default_cache():
+    """Open the cache configured in .env, or None if TAGGER_CACHE=off."""
+    if (os.getenv("TAGGER_CACHE") or "").strip().lower() in {"off", "none", "0"}:
+        return None
+    return LookupCache(default_cache_path())
+
+
+class LookupCache:
+    """SQLite-backed cache shared by the fingerprint workers and the lookup stage."""
+
+    def __init__(
+        self,
+        path=DEFAULT_CACHE_PATH,
+        fingerprint_ttl=365 * DAY,
+        lookup_ttl=30 * DAY,
+        failure_ttl=7 * DAY,
+        recording_ttl=90 * DAY,
+        retry_ttl=180 * DAY,
+        max_entries=500_000,
+    ):
+        self.path = Path(path)
+        self.fingerprint_ttl = fingerprint_ttl
+        self.lookup_ttl = lookup_ttl
+        self.failure_ttl = failure_ttl
+        self.recording_ttl = recording_ttl
+        self.retry_ttl = retry_ttl
+        self.max_entries = max_entries
+
+        if str(path) != ":memory:":
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(path), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+        self._db.commit()
+
+    # -- low level ----------------------------------------------------------
+    def _get(self, table, columns, key):
+        with self._lock:
+            return self._db.execute(
+                f"SELECT {columns} FROM {table} WHERE key = ? AND expires > ?",
+                (key, time.time()),
+            ).fetchone()
+
+    def _put(self, table, columns, key, values, ttl):
+        now = time.time()
+        placeholders = ", ".join("?" for _ in range(len(values) + 3))
+        with self._lock:
+            self._db.execute(
+                f"INSERT OR REPLACE INTO {table} (key, {columns}, created, expires) "
+                f"VALUES ({placeholders})",
+                (key, *values, now, now + ttl),
+            )
+            self._db.commit()
+
+    # -- fingerprints -------------------------------------------------------
+    def get_fingerprint(self, key):
+        """Return (duration, fingerprint) or None."""
+        row = self._get("fingerprints", "duration, fingerprint", key)
+        return (row[0], bytes(row[1])) if row else None
+
+    def put_fingerprint(self, key, duration, fingerprint):
+        if isinstance(fingerprint, str):
+            fingerprint = fingerprint.encode()
+        self._put(
+            "fingerprints", "duration, fingerprint", key,
+            (duration, fingerprint), self.fingerprint_ttl,
+        )
+
+    # -- AcoustID results ---------------------------------------------------
+    def get_lookup(self, key):
+        """Return the cached AcoustID results as a list of tuples, or None."""
+        row = self._get("lookups", "results", key)
+        return [tuple(r) for r in json.loads(row[0])] if row else None
+
+    def put_lookup(self, key, results):
+        ttl = self.lookup_ttl if results else self.failure_ttl
+        self._put("lookups", "results", key, (json.dumps(list(results)),), ttl)
+
+    # -- MusicBrainz recordings ---------------------------------------------
+    def get_recording(self, mbid):
+        """Return a cached get_recording_by_id payload, or None."""
+        row = self._get("recordings", "payload", mbid)
+        return json.loads(row[0]) if row else None
+
+    def put_recording(self, mbid, payload):
+        self._put("recordings", "payload", mbid, (json.dumps(payload),), self.recording_ttl)
+
+    # -- failure history (core.scheduler) ------------------------------------
+    def get_retry(self, key):
+        """Return (failures, next_try) for a file that failed before, or None."""
+        return self._get("retries", "failures, next_try", key)
+
+    def put_retry(self, key, failures, next_try):
+        self._put("retries", "failures, next_try", key, (failures, next_try), self.retry_ttl)
+
+    def clear_retry(self, key):
+        with self._lock:
+            self._db.execute("DELETE FROM retries WHERE key = ?", (key,))
+            self._db.commit()
+
+    # -- maintenance --------------------------------------------------------
+    def stats(self):
+        """Row counts per table (live and expired) plus the database size."""
+        now = time.time()
+        result = {}
+        with self._lock:
+            for table in TABLES:
+                total, expired = self._db.execute(
+                    f"SELECT COUNT(*), COALESCE(SUM(expires <= ?), 0) FROM {table}",
+                    (now,),
+                ).fetchone()
+                result[table] = {"live": total - expired, "expired": expired}
+        result["size_bytes"] = self.path.stat().st_size if self.path.exists() else 0
+        return result
+
+    def prune(self, older_than=None):
+        """Delete expired rows (or rows created more than `older_than` seconds ago)
+        and trim each table to `max_entries`, oldest first. Returns rows removed."""
+        now = time.time()
+        removed = 0
+        with self._lock:
+            for table in TABLES:
+                if older_than is None:
+                    cur = self._db.execute(f"DELETE FROM {table} WHERE expires <= ?", (now,))
+                else:
+                    cur = self._db.execute(
+                        f"DELETE FROM {table} WHERE created <= ?", (now - older_than,)
+                    )
+                removed += cur.rowcount
+                cur = self._db.execute(
+                    f"DELETE FROM {table} WHERE key IN ("
+                    f"SELECT key FROM {table} ORDER BY created DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,),
+                )
+                removed += cur.rowcount
+            self._db.commit()
+        return removed
+
+    def clear(self):
+        with self._lock:
+            for table in TABLES:
+                self._db.execute(f"DELETE FROM {table}")
+            self._db.commit()
+            self._db.execute("VACUUM")
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class RecordingMemo:
+    """In-process LRU of MusicBrainz recordings (or releases) keyed by MBID.
+
+    Concurrent requests for the same MBID share one fetch: the first caller
+    loads it, the others wait for its result. Misses fall through to the
+    persistent cache (if any) before going to the network. get_async() is
+    the same for coroutines on one event loop (the async backend).
+    """
+
+    def __init__(self, maxsize=4096, name="Recording"):
+        self.maxsize = maxsize
+        self.name = name
+        self._items = OrderedDict()
+        self._inflight = {}
+        self._inflight_async = {}  # mbid -> asyncio.Future, touched on the loop thread only
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.stats = {"hits": 0, "disk_hits": 0, "misses": 0}
+
+    def __contains__(self, mbid):
+        with self._lock:
+            return mbid in self._items
+
+    def put(self, mbid, payload, cache=None):
+        """Store a recording fetched elsewhere (e.g. by the async backend)."""
+        if cache:
+            cache.put_recording(mbid, payload)
+        with self._lock:
+            self.stats["misses"] += 1
+            self._items[mbid] = payload
+            self._items.move_to_end(mbid)
+            if len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def get(self, mbid, fetch, cache=None):
+        """Return the recording for `mbid`, calling `fetch(mbid)` only if nobody has it."""
+        with self._lock:
+            if mbid in self._items:
+                self._items.move_to_end(mbid)
+                self.stats["hits"] += 1
+                return self._items[mbid]
+            event = self._inflight.get(mbid)
+            owner = event is None
+            if owner:
+                event = self._inflight[mbid] = threading.Event()
+
+        if not owner:
+            event.wait()
+            with self._lock:
+                if mbid in self._items:
+                    self.stats["hits"] += 1
+                    return self._items[mbid]
+            # The owner's fetch failed; try ourselves.
+            return self.get(mbid, fetch, cache)
+
+        try:
+            payload = cache.get_recording(mbid) if cache else None
+            counter = "disk_hits" if payload is not None else "misses"
+            if payload is None:
+                payload = fetch(mbid)
+                if cache:
+                    cache.put_recording(mbid, payload)
+            with self._lock:
+                self.stats[counter] += 1
+                self._items[mbid] = payload
+                if len(self._items) > self.maxsize:
+                    self._items.popitem(last=False)
+            return payload
+        finally:
+            with self._lock:
+                del self._inflight[mbid]
+            event.set()
+
+    async def get_async(self, mbid, fetch, cache=None):
+        """Like get(), with `fetch(mbid)` a coroutine function. Coroutines
+        asking for the same MBID share one fetch."""
+        import asyncio
+        with self._lock:
+            if mbid in self._items:
+                self._items.move_to_end(mbid)
+                self.stats["hits"] += 1
+                return self._items[mbid]
+        future = self._inflight_async.get(mbid)
+        if future is not None:
+            with self._lock:
+                self.stats["hits"] += 1
+            return await asyncio.shield(future)
+
+        future = self._inflight_async[mbid] = asyncio.get_running_loop().create_future()
+        try:
+            payload = cache.get_recording(mbid) if cache else None
+            counter = "disk_hits" if payload is not None else "misses"
+            if payload is None:
+                payload = await fetch(mbid)
+                if cache:
+                    cache.put_recording(mbid, payload)
+            with self._lock:
+                self.stats[counter] += 1
+                self._items[mbid] = payload
+                if len(self._items) > self.maxsize:
+                    self._items.popitem(last=False)
+            future.set_result(payload)
+            return payload
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()  # retrieved: nobody may be waiting on it
+            raise
+        finally:
+            del self._inflight_async[mbid]
+
+    def summary(self):
+        s = self.stats
+        return (
+            f"{self.name} memo: {s['hits']} hits, {s['disk_hits']} cache hits, "
+            f"{s['misses']} MusicBrainz fetches"
+        )
+
+
+# ---------------------------------------------------------------------------
+# CLI:  python -m core.cache [--db PATH] stats | prune [--older-than DAYS] | clear
+# ---------------------------------------------------------------------------
+def main(argv=None):
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    import argparse
+    parser = argparse.ArgumentParser(
+        prog="python -m core.cache",
+        description="Inspect and prune the MetadataFixer lookup cache.",
+    )
+    parser.add_argument("--db", default=None, help="cache database (default: %(default)s)")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("stats", help="show entry counts and database size")
+    prune = sub.add_parser("prune", help="remove expired entries")
+    prune.add_argument(
+        "--older-than", type=float, metavar="DAYS",
+        help="remove entries created more than DAYS ago, expired or not",
+    )
+    sub.add_parser("clear", help="remove every entry")
+    args = parser.parse_args(argv)
+
+    path = Path(args.db) if args.db else default_cache_path()
+    if not path.exists():
+        print(f"[MetadataFixer] No cache at {path}")
+        return 1
+
+    cache = LookupCache(path)
+    try:
+        if args.command == "stats":
+            print(f"Cache: {path}")
+            for table, counts in cache.stats().items():
+                if table == "size_bytes":
+                    print(f"  size: {counts / 1024:.1f} KiB")
+                else:
+                    print(f"  {table}: {counts['live']} live, {counts['expired']} expired")
+        elif args.command == "prune":
+            older_than = args.older_than * DAY if args.older_than is not None else None
+            print(f"Removed {cache.prune(older_than)} entries.")
+        elif args.command == "clear":
+            cache.clear()
+            print("Cache cleared.")
+    finally:
+        cache.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
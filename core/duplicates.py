@@ -0,0 +1,318 @@
+import os
+import sys
+import json
+import base64
+import threading
+from array import array
+from collections import Counter, OrderedDict, defaultdict
+from pathlib import Path
+
+# ---------------------------------------------------------------------------
+# Duplicate-audio detection from Chromaprint fingerprints
+#
+# fpcalc prints compressed fingerprints (base64 of Chromaprint's bit-packed
+# format). decode_fingerprint() turns one back into its 32-bit sub-
+# fingerprints in pure Python. DuplicateIndex keeps the first MAX_ITEMS of
+# them (~30 s) per file and an inverted index on the top 20 bits of every
+# KEY_STEP-th one (a cheap LSH: near-identical audio shares most of them).
+# It verifies candidates by the bit error rate at the best alignment.
+#
+# run_tagger uses it to send only one file per group of duplicates to
+# AcoustID, keeping the MAX_LEADERS most recently seen groups in memory.
+# `python -m core.duplicates ROOT` reports the groups found among
+# fingerprints in the lookup cache.
+# ---------------------------------------------------------------------------
+
+DEFAULT_REPORT_PATH = Path("logs") / "duplicates.json"
+MAX_ITEMS = 240          # sub-fingerprints kept per file (8 per second)
+KEY_SHIFT = 12           # index key = top 20 bits of a sub-fingerprint
+KEY_STEP = 4             # index every 4th sub-fingerprint; queries use all
+MIN_SHARED_KEYS = 10     # candidates must share at least this many keys...
+MIN_SHARED_RATIO = 0.3   # ...and this fraction of their indexed keys
+MAX_POSTINGS = 200       # ignore keys this common (silence, noise floors)
+MAX_CANDIDATES = 5
+MAX_DURATION_DIFF = 7.0  # seconds
+MATCH_THRESHOLD = 0.9    # 1 - bit error rate
+MAX_LEADERS = 5000       # leaders kept in memory during a run (~1 KiB each)
+
+
+class FingerprintError(ValueError):
+    """Not a valid compressed Chromaprint fingerprint."""
+
+
+# ---------------------------------------------------------------------------
+# Decoding
+# ---------------------------------------------------------------------------
+def _unpack(data, width):
+    """Little-endian bit-packed `width`-bit values (3 or 5) from `data`."""
+    chunk_bytes = width  # `width` bytes hold exactly 8 values
+    mask = (1 << width) - 1
+    shifts = [width * k for k in range(8)]
+    values = []
+    for start in range(0, len(data), chunk_bytes):
+        chunk = int.from_bytes(data[start:start + chunk_bytes], "little")
+        values.extend((chunk >> s) & mask for s in shifts)
+    # A trailing partial chunk yields padding values; callers know the count.
+    return values
+
+
+def decode_fingerprint(fingerprint):
+    """Decode a compressed fingerprint (str/bytes, as printed by fpcalc).
+
+    Returns (algorithm, [sub-fingerprints as unsigned 32-bit ints]).
+    """
+    if isinstance(fingerprint, str):
+        fingerprint = fingerprint.encode("ascii")
+    try:
+        raw = base64.urlsafe_b64decode(fingerprint + b"=" * (-len(fingerprint) % 4))
+    except ValueError as e:
+        raise FingerprintError(f"not base64: {e}")
+    if len(raw) < 4:
+        raise FingerprintError("fingerprint too short")
+    algorithm = raw[0]
+    count = int.from_bytes(raw[1:4], "big")
+
+    # Each sub-fingerprint is XOR-ed with the previous one; the set bits of
+    # the result are stored as 3-bit gaps between bit positions, 0 ending an
+    # item. Gaps of 7 or more store 7 here plus the rest as a 5-bit value
+    # after the 3-bit array.
+    bits = _unpack(raw[4:], 3)
+    found = exceptional = 0
+    for end, bit in enumerate(bits):
+        if bit == 0:
+            found += 1
+            if found == count:
+                break
+        elif bit == 7:
+            exceptional += 1
+    if found != count:
+        raise FingerprintError("truncated fingerprint")
+    bits = bits[:end + 1] if count else []
+
+    if exceptional:
+        offset = 4 + (len(bits) * 3 + 7) // 8
+        extra = _unpack(raw[offset:], 5)
+        if offset + (exceptional * 5 + 7) // 8 > len(raw):
+            raise FingerprintError("truncated exceptional bits")
+        extra = iter(extra)
+        bits = [b + next(extra) if b == 7 else b for b in bits]
+
+    values = []
+    value = last_bit = 0
+    for bit in bits:
+        if bit == 0:
+            values.append(value ^ values[-1] if values else value)
+            value = last_bit = 0
+            continue
+        last_bit += bit
+        value |= 1 << (last_bit - 1)
+    return algorithm, values
+
+
+# ---------------------------------------------------------------------------
+# Similarity
+# ---------------------------------------------------------------------------
+def _popcount(x):
+    return bin(x).count("1")
+
+
+def best_offset(a, b):
+    """Most common alignment (index in b - index in a) among identical sub-fingerprints."""
+    positions = defaultdict(list)
+    for i, v in enumerate(a):
+        positions[v].append(i)
+    offsets = Counter(j - i for j, v in enumerate(b) for i in positions.get(v, ()))
+    return offsets.most_common(1)[0][0] if offsets else 0
+
+
+def similarity(a, b, offset=None):
+    """1 - bit error rate of `a` against `b` at the best alignment (0..1)."""
+    if offset is None:
+        offset = best_offset(a, b)
+    start = max(0, -offset)
+    stop = min(len(a), len(b) - offset)
+    overlap = stop - start
+    if overlap <= 0 or overlap < 0.5 * min(len(a), len(b)):
+        return 0.0
+    errors = sum(_popcount(a[i] ^ b[i + offset]) for i in range(start, stop))
+    return 1.0 - errors / (32.0 * overlap)
+
+
+# ---------------------------------------------------------------------------
+# Index
+# ---------------------------------------------------------------------------
+class DuplicateIndex:
+    """In-memory inverted index of fingerprints; thread-safe.
+
+    Files are added with a label (usually the path). add() returns the label
+    of the file it duplicates, if any, and groups() lists all groups found.
+    Only the first file of each group (its leader) is indexed, and with
+    `max_leaders` only that many recent leaders are kept, so memory stays
+    bounded on large libraries: a duplicate is found if its leader was
+    matched or added within the last `max_leaders` distinct files.
+    """
+
+    def __init__(self, threshold=MATCH_THRESHOLD, max_leaders=None):
+        self.threshold = threshold
+        self.max_leaders = max_leaders
+        self._lock = threading.Lock()
+        self._postings = defaultdict(set)  # key -> {leader id}
+        self._leaders = OrderedDict()      # leader id -> (label, duration, values, indexed keys)
+        self._groups = {}                  # leader id -> [leader label, duplicate labels...]
+        self._next_id = 0
+        self.stats = {"added": 0, "duplicates": 0, "undecodable": 0}
+
+    def _candidates(self, keys):
+        counts = Counter()
+        for key in keys:
+            ids = self._postings.get(key, ())
+            if len(ids) <= MAX_POSTINGS:
+                counts.update(ids)
+        return [
+            i for i, shared in counts.most_common(MAX_CANDIDATES)
+            if shared >= MIN_SHARED_KEYS
+            and shared >= MIN_SHARED_RATIO * len(self._leaders[i][3])
+        ]
+
+    def _evict(self):
+        while self.max_leaders is not None and len(self._leaders) > self.max_leaders:
+            leader, (_, _, _, indexed) = self._leaders.popitem(last=False)
+            for key in indexed:
+                ids = self._postings[key]
+                ids.discard(leader)
+                if not ids:
+                    del self._postings[key]
+
+    def add(self, label, duration, fingerprint):
+        """Index a file. Returns (label, similarity) of the file it duplicates, or None.
+
+        `fingerprint` is fpcalc's compressed fingerprint or a decoded list.
+        Undecodable fingerprints are counted and skipped.
+        """
+        values = fingerprint
+        if isinstance(fingerprint, (str, bytes)):
+            try:
+                _, values = decode_fingerprint(fingerprint)
+            except FingerprintError:
+                with self._lock:
+                    self.stats["undecodable"] += 1
+                return None
+        values = array("I", values[:MAX_ITEMS])
+        keys = {v >> KEY_SHIFT for v in values}
+
+        with self._lock:
+            self.stats["added"] += 1
+            match = None
+            for i in self._candidates(keys):
+                _, other_duration, other_values, _ = self._leaders[i]
+                if abs(other_duration - duration) > MAX_DURATION_DIFF:
+                    continue
+                score = similarity(values, other_values)
+                if score >= self.threshold and (match is None or score > match[1]):
+                    match = (i, score)
+
+            if match is not None:
+                leader, score = match
+                self._leaders.move_to_end(leader)
+                leader_label = self._leaders[leader][0]
+                self._groups.setdefault(leader, [leader_label]).append(label)
+                self.stats["duplicates"] += 1
+                return leader_label, score
+
+            leader, self._next_id = self._next_id, self._next_id + 1
+            indexed = frozenset(v >> KEY_SHIFT for v in values[::KEY_STEP])
+            self._leaders[leader] = (label, duration, values, indexed)
+            for key in indexed:
+                self._postings[key].add(leader)
+            self._evict()
+            return None
+
+    def groups(self):
+        """Groups of duplicate labels (leader first), largest groups first."""
+        with self._lock:
+            groups = [list(g) for _, g in sorted(self._groups.items())]
+        return sorted(groups, key=len, reverse=True)
+
+
+def write_report(groups, path):
+    """Write duplicate groups as JSON: [{"keep": first, "duplicates": [...]}]."""
+    report = [{"keep": str(g[0]), "duplicates": [str(p) for p in g[1:]]} for g in groups]
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    Path(path).write_text(json.dumps(report, indent=2, ensure_ascii=False), encoding="utf-8")
+    return report
+
+
+def default_duplicates_report():
+    """Report path: TAGGER_DUPLICATES from .env, else logs/duplicates.json.
+
+    "off" turns duplicate detection off during runs (returns None).
+    """
+    value = (os.getenv("TAGGER_DUPLICATES") or "").strip()
+    if value.lower() in {"off", "none", "0"}:
+        return None
+    return Path(value or DEFAULT_REPORT_PATH)
+
+
+# ---------------------------------------------------------------------------
+# CLI: report duplicates among cached fingerprints
+# ---------------------------------------------------------------------------
+def main(argv=None):
+    import argparse
+    from dotenv import load_dotenv
+    from core.cache import LookupCache, content_key, default_cache_path
+    from core.scanner import iter_audio_entries
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(
+        prog="python -m core.duplicates",
+        description="Group duplicate audio files using cached fingerprints.",
+    )
+    parser.add_argument("root", help="music folder")
+    parser.add_argument("--db", default=None, help="cache file (default: TAGGER_CACHE or cache/)")
+    parser.add_argument("--fingerprint-missing", action="store_true",
+                        help="fingerprint files without a cached fingerprint")
+    parser.add_argument("--threshold", type=float, default=MATCH_THRESHOLD,
+                        help=f"minimum similarity, 0..1 (default {MATCH_THRESHOLD})")
+    parser.add_argument("--json-out", metavar="PATH", help="also write the groups as JSON")
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(args.root):
+        print(f"[MetadataFixer] Folder not found: {args.root}", file=sys.stderr)
+        return 1
+
+    cache = LookupCache(args.db or default_cache_path())
+    index = DuplicateIndex(args.threshold)
+    missing = 0
+    try:
+        for entry in iter_audio_entries(args.root):
+            key = content_key(entry.path)
+            cached = cache.get_fingerprint(key)
+            if cached is None and args.fingerprint_missing:
+                from core.fingerprint import fingerprint_file
+                try:
+                    cached = fingerprint_file(entry.path)
+                    cache.put_fingerprint(key, *cached)
+                except Exception as e:
+                    print(f"Fingerprinting failed for {entry.path}: {e}", file=sys.stderr)
+            if cached is None:
+                missing += 1
+                continue
+            index.add(entry.path, *cached)
+    finally:
+        cache.close()
+
+    groups = index.groups()
+    for group in groups:
+        print(f"{group[0]}")
+        for path in group[1:]:
+            print(f"  = {path}")
+    s = index.stats
+    print(f"\n{len(groups)} groups, {s['duplicates']} duplicate files among {s['added']} "
+          f"fingerprinted ({missing} without a cached fingerprint, {s['undecodable']} undecodable)")
+    if args.json_out:
+        write_report(groups, args.json_out)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,12 +1,18 @@
 import os
+import time
 import shutil
 import logging
+from itertools import chain
 from pathlib import Path
-from tkinter import messagebox
-from dotenv import load_dotenv, set_key
-from mutagen.easyid3 import EasyID3
 
-from core.tagger import run_tagger
+from core.cache import open_default_cache
+from core.journal import open_default_journal
+from core.metrics import METRICS, default_metrics_path
+from core.scanner import (
+    ScanProgress, iter_audio_entries, iter_scan, open_default_index, scan_with_default_index,
+)
+from core.stream import prefetch
+from core.formats import is_audio_file
 
 # Global flag to prevent multiple wizards
 _wizard_open = False
@@ -22,6 +28,8 @@ def ensure_env_setup(selected_folder=None):
     """
     import webbrowser
     import customtkinter as ctk
+    from tkinter import messagebox
+    from dotenv import load_dotenv, set_key
     global _wizard_open
 
     env_path = ".env"
@@ -131,12 +139,12 @@ def ensure_env_setup(selected_folder=None):
     return False
 
 
-def find_mp3_files(root_folder):
-    """Find all MP3 files in the given folder and its subfolders."""
-    root_path = Path(root_folder)
-    if not root_path.exists():
-        raise ValueError(f"Folder not found: {root_folder}")
-    return [str(p) for p in root_path.rglob("*.mp3")]
+def find_audio_files(root_folder):
+    """Find all audio files (core.formats.AUDIO_EXTENSIONS) in the given folder and its subfolders."""
+    return [state.path for state in scan_with_default_index(root_folder)]
+
+
+find_mp3_files = find_audio_files  # old name
 
 
 # ---------------------------------------------------------------------------
@@ -160,7 +168,11 @@ def setup_logger():
 # ---------------------------------------------------------------------------
 # Utilities
 # ---------------------------------------------------------------------------
-def check_fpcalc():
+def check_fpcalc(required=False):
+    """Point FPCALC at the bundled or installed fpcalc. A missing fpcalc is
+    only an error if it is `required` or the in-process Chromaprint engine
+    will not be used (core.fingerprint)."""
+    from core.fingerprint import default_engine, native_available
     fpcalc = "fpcalc.exe" if os.name == "nt" else "fpcalc"
     here = Path(__file__).resolve().parent.parent
     local = here / fpcalc
@@ -169,71 +181,154 @@ def check_fpcalc():
         return
     path = shutil.which(fpcalc)
     if not path:
+        if not required and default_engine() != "fpcalc" and native_available():
+            return
         raise FileNotFoundError("fpcalc.exe not found. Place it in the project folder.")
     os.environ["FPCALC"] = path
 
 
-def scan_for_untagged(source_folder):
-    """Find mp3s missing artist/title, excluding _temp_untagged folder."""
-    untagged = []
-    for p in Path(source_folder).rglob("*.mp3"):
-        if "_temp_untagged" in p.parts:
-            continue
-        try:
-            tags = EasyID3(p)
-            if not (
-                "artist" in tags and tags["artist"]
-                and "title" in tags and tags["title"]
-            ):
-                untagged.append(p)
-        except Exception:
-            untagged.append(p)
-    return untagged
+def iter_untagged(source_folder, since=None, progress=None, exclude=()):
+    """Yield audio files missing artist/title (as Path) while the library is scanned.
+
+    Uses the incremental tag index (core.scanner), so only files that changed
+    since the last scan have their tags read; the directory walk runs ahead
+    on its own thread. `since` (epoch seconds) keeps only files modified at
+    or after that time. `progress` (core.scanner.ScanProgress) is kept up to
+    date for estimates. Paths in `exclude` (strings) are left out.
+    _temp_untagged is not scanned.
+    """
+    since_ns = int(since * 1e9) if since is not None else None
+    index = open_default_index()
+    entries = prefetch(iter_audio_entries(source_folder), name="walk")
+    try:
+        for state in iter_scan(source_folder, index, progress=progress, entries=entries):
+            if state.tagged or state.path in exclude:
+                continue
+            if since_ns is None or state.mtime_ns >= since_ns:
+                if progress:
+                    progress.matched += 1
+                yield Path(state.path)
+        if progress:
+            progress.finished = True
+    finally:
+        entries.close()
+        index.close()
+
+
+def scan_for_untagged(source_folder, since=None):
+    """Find audio files missing artist/title, excluding _temp_untagged folder (see iter_untagged)."""
+    return list(iter_untagged(source_folder, since))
 
 
 def safe_move(src, dst, retries=5, delay=0.5):
     """Move files safely, retrying briefly if the source is still locked."""
-    import time
-    for attempt in range(retries):
+    with METRICS.timer("tagger_stage_seconds", stage="move"):
+        for attempt in range(retries):
+            try:
+                shutil.move(src, dst)
+                return
+            except FileNotFoundError:
+                if not os.path.exists(src):
+                    raise
+                METRICS.inc("tagger_move_retries_total")
+                time.sleep(delay)
+            except Exception:
+                METRICS.inc("tagger_move_retries_total")
+                time.sleep(delay)
         try:
             shutil.move(src, dst)
-            return
-        except FileNotFoundError:
-            if not os.path.exists(src):
-                raise
-            time.sleep(delay)
-        except Exception:
-            time.sleep(delay)
-    try:
-        shutil.move(src, dst)
-    except Exception as e:
-        print(f"[safe_move] Final move failed for {src}: {e}")
+        except Exception as e:
+            print(f"[safe_move] Final move failed for {src}: {e}")
 
 
-def move_files(files, dest):
+def move_files(files, dest, root=None):
+    """Move files into `dest`. With `root`, keep their path relative to it
+    (so same-named files in different folders don't collide)."""
     dest.mkdir(exist_ok=True)
     moved = []
     for f in files:
-        target = dest / f.name
+        target = dest / (Path(f).relative_to(root) if root else Path(f).name)
+        target.parent.mkdir(parents=True, exist_ok=True)
         safe_move(str(f), str(target))
         moved.append(target)
     return moved
 
 
 def move_back_all(src, dest):
-    for f in Path(src).glob("*.mp3"):
-        safe_move(str(f), str(Path(dest) / f.name))
+    """Move everything under `src` back to the same relative path under `dest`."""
+    src = Path(src)
+    for f in [p for p in src.rglob("*") if is_audio_file(p)]:
+        target = Path(dest) / f.relative_to(src)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        safe_move(str(f), str(target))
+    # Remove the (now empty) folder tree, deepest first.
+    for d in sorted((p for p in src.rglob("*") if p.is_dir()), key=lambda p: len(p.parts), reverse=True):
+        try:
+            d.rmdir()
+        except OSError:
+            pass
     try:
-        Path(src).rmdir()
+        src.rmdir()
     except OSError:
         pass
 
 
+def recover_stranded(source_folder, logger):
+    """Move files an interrupted run left in _temp_untagged back into the library.
+
+    Returns how many were moved.
+    """
+    temp_folder = Path(source_folder) / "_temp_untagged"
+    stranded = [p for p in temp_folder.rglob("*") if is_audio_file(p)] if temp_folder.is_dir() else []
+    if stranded:
+        move_back_all(temp_folder, source_folder)
+        logger.info(f"Recovered {len(stranded)} files left in {temp_folder} by an interrupted run.")
+    return len(stranded)
+
+
+def use_temp_folder_default():
+    """TAGGER_USE_TEMP_FOLDER=1 in .env restores the old move-to-temp behaviour."""
+    return (os.getenv("TAGGER_USE_TEMP_FOLDER") or "").strip().lower() in {"1", "true", "yes", "on"}
+
+
 # ---------------------------------------------------------------------------
 # Main automatic pipeline
 # ---------------------------------------------------------------------------
-def run_auto_tag_pipeline(source_folder=None, progress_callback=None):
-    """Automatically handle move-to-temp, tag, and move-back."""
+def run_auto_tag_pipeline(source_folder=None, progress_callback=None, workers=None,
+                          use_temp_folder=None, since=None, dry_run=False, on_result=None,
+                          backend=None, batch_size=None, metrics_out=None, album_mode=None,
+                          budget=None):
+    """Find untagged files and tag them. Returns (success, total), or None if
+    the pipeline could not start.
+
+    The scan streams into the tagger: each untagged file is tagged as soon
+    as the scan gets to it, and progress uses a running estimate of the
+    total. Files are tagged where they are. With `use_temp_folder` (or
+    TAGGER_USE_TEMP_FOLDER=1) each is first moved to _temp_untagged, keeping
+    its relative path, and everything is moved back at the end. `workers` is the number
+    of parallel fpcalc processes (see run_tagger). Fingerprints and lookups
+    are cached between runs (see core.cache).
+
+    `since` (epoch seconds) limits the run to files modified since then,
+    `dry_run` resolves matches without writing anything, and `on_result`
+    receives each file's result record (see core.tagger.tag_file).
+    `backend` picks the lookup engine ("threads" or "async", see run_tagger)
+    and `batch_size` the fingerprints per AcoustID request. `album_mode`
+    (default: TAGGER_ALBUM_MODE) tags albums from one release lookup each.
+    `budget` (a core.scheduler.Budget; default: TAGGER_BUDGET_MINUTES /
+    TAGGER_BUDGET_REQUESTS) caps the run's time or AcoustID requests.
+
+    Progress is journaled per file (core.journal). If the previous run over
+    `source_folder` was interrupted, files it left in _temp_untagged are
+    moved back and the run resumes with the files it had not finished, then
+    scans for the files it had not reached.
+
+    Stage timings, cache and retry counters (core.metrics) are logged as a
+    summary at the end and written in Prometheus text format to
+    `metrics_out` (default: TAGGER_METRICS, else logs/metrics.prom).
+    """
+    from dotenv import load_dotenv
+    from core.tagger import run_tagger
     load_dotenv()
     api_key = os.getenv("ACOUSTID_API_KEY")
 
@@ -251,25 +346,119 @@ def run_auto_tag_pipeline(source_folder=None, progress_callback=None):
     check_fpcalc()
     logger = setup_logger()
     logger.info(f"Starting auto tag pipeline for {source_folder}")
+    METRICS.reset()
+
+    if use_temp_folder is None:
+        use_temp_folder = use_temp_folder_default()
+    if dry_run:
+        logger.info("Dry run: no tags will be written and no files moved.")
+        use_temp_folder = False
+        if (Path(source_folder) / "_temp_untagged").is_dir():
+            logger.warning("Files left in _temp_untagged are not recovered in a dry run.")
+    else:
+        recover_stranded(source_folder, logger)
+
+    root = Path(os.path.abspath(source_folder))
+    temp_folder = root / "_temp_untagged"
+    scan = ScanProgress()
+    journal = open_default_journal()
+    try:
+        resumed = journal.unfinished(source_folder, dry_run) if journal else None
+        if resumed:
+            run_id, started = resumed
+            done, pending = journal.resume(run_id)
+            journaled = journal.origins()
+            pending = [Path(p) for p in pending if os.path.exists(p)]
+            logger.info(
+                f"Resuming interrupted run from {time.ctime(started)}: "
+                f"{done} files already done, {len(pending)} left over; scanning for the rest."
+            )
+            # Leftovers first, then whatever the interrupted scan had not reached.
+            untagged = chain(pending, iter_untagged(source_folder, since, scan, exclude=journaled))
+        else:
+            pending, journaled = [], set()
+            untagged = iter_untagged(source_folder, since, scan)
+
+        # discover -> check tags run ahead of tagging, through a bounded queue.
+        untagged = prefetch(untagged, name="scan")
+        first = next(untagged, None)
+        if first is None:
+            if resumed:
+                journal.finish()
+            logger.info("No untagged songs found. Everything is up-to-date.")
+            if progress_callback:
+                progress_callback(1, 1)
+            _write_metrics(logger, metrics_out)
+            return 0, 0
+
+        if use_temp_folder:
+            logger.info(f"Tagging untagged files as they are found, via {temp_folder}")
+            tag_folder = temp_folder
+        else:
+            logger.info("Tagging untagged files in place as they are found.")
+            tag_folder = root
+        if journal and not resumed:
+            journal.start(source_folder, (), dry_run, use_temp_folder)
+
+        def staged(origins):
+            """Journal each file, then (temp-folder mode) move it, right before it is
+            tagged; run_tagger calls this after the scheduler has admitted the file."""
+            for origin in origins:
+                path = temp_folder / origin.relative_to(root) if use_temp_folder else origin
+                # Journal first, then move: a crash in between leaves nothing unaccounted for.
+                if journal and str(origin) in journaled:
+                    journal.relocate({str(origin): path})
+                elif journal:
+                    journal.add(path, origin)
+                if use_temp_folder:
+                    move_files([origin], temp_folder, root)
+                yield origin, path
+
+        # Run tagger
+        cache = open_default_cache()
+        try:
+            if cache:
+                cache.prune()
+            with METRICS.timer("tagger_phase_seconds", phase="tag"):
+                success, total = run_tagger(
+                    tag_folder, api_key, logger, progress_callback, workers, cache,
+                    files=chain([first], untagged), stage=staged, on_result=on_result,
+                    dry_run=dry_run, backend=backend, batch_size=batch_size, journal=journal,
+                    expected=lambda: len(pending) + scan.estimate(), album_mode=album_mode,
+                    budget=budget,
+                )
+        finally:
+            if cache:
+                cache.close()
+            untagged.close()
+        logger.info(f"Scan: {scan.scanned} files checked, {scan.matched} untagged.")
+
+        if use_temp_folder:
+            with METRICS.timer("tagger_phase_seconds", phase="move_back"):
+                move_back_all(temp_folder, source_folder)
+            if journal:
+                journal.mark_all("moved_back", "written")
+            logger.info(f"Moved all files back to {source_folder}")
+        if journal:
+            journal.finish()
+    finally:
+        if journal:
+            journal.close()
 
-    temp_folder = Path(source_folder) / "_temp_untagged"
-    temp_folder.mkdir(exist_ok=True)
-
-    # Move untagged
-    untagged = scan_for_untagged(source_folder)
-    if not untagged:
-        logger.info("No untagged songs found. Everything is up-to-date.")
-        if progress_callback:
-            progress_callback(1, 1)
-        return
-
-    logger.info(f"Found {len(untagged)} untagged files. Moving to {temp_folder}")
-    move_files(untagged, temp_folder)
-
-    # Run tagger
-    success, total = run_tagger(temp_folder, api_key, logger, progress_callback)
-
-    move_back_all(temp_folder, source_folder)
-    logger.info(f"Moved all files back to {source_folder}")
     logger.info("Auto tagging pipeline completed.")
     logger.info(f"Summary: {success}/{total} tagged successfully.")
+    for line in METRICS.summary():
+        logger.info(line)
+    _write_metrics(logger, metrics_out)
+    return success, total
+
+
+def _write_metrics(logger, metrics_out=None):
+    """Write the run's metrics to `metrics_out` (default: TAGGER_METRICS)."""
+    metrics_path = metrics_out or default_metrics_path()
+    if metrics_path:
+        try:
+            METRICS.write_prometheus(metrics_path)
+            logger.info(f"Metrics written to {metrics_path}")
+        except OSError as e:
+            logger.warning(f"Could not write metrics to {metrics_path}: {e}")
@@ -0,0 +1,223 @@
+import os
+import sys
+import threading
+import subprocess
+
+from core.metrics import METRICS
+
+# ---------------------------------------------------------------------------
+# Chromaprint fingerprints: in process or through fpcalc
+#
+#   native  audioread decodes the file and the PCM blocks go straight into
+#           libchromaprint (pyacoustid's ctypes bindings), stopping after
+#           MAX_AUDIO_LENGTH seconds. No fpcalc process per file. Each
+#           thread keeps one Chromaprint context and restarts it for every
+#           file. ctypes drops the GIL while Chromaprint works, so the
+#           fingerprint pool runs in parallel.
+#   fpcalc  the Chromaprint command line tool, one process per file.
+#
+# TAGGER_FINGERPRINT picks the engine:
+#   auto    (default) native if libchromaprint and audioread load, else
+#           fpcalc. A file audioread cannot decode also goes to fpcalc.
+#   native  or fpcalc, to force one.
+#
+# How much of the decoding is in process depends on audioread's backend:
+# WAV/AIFF (built in), MAD and GStreamer decode in process; the ffmpeg
+# backend still runs ffmpeg, but it is stopped after the first two minutes.
+#
+# `python -m core.fingerprint FILE...` runs both engines and compares them.
+# ---------------------------------------------------------------------------
+
+# Seconds of audio analysed (acoustid.MAX_AUDIO_LENGTH, fpcalc -length).
+MAX_AUDIO_LENGTH = 120
+ENGINES = ("auto", "native", "fpcalc")
+
+_local = threading.local()
+_native = None  # (chromaprint, audioread) once loaded, False if unavailable
+_native_lock = threading.Lock()
+
+
+def default_engine():
+    """TAGGER_FINGERPRINT from .env: "auto" (default), "native" or "fpcalc"."""
+    value = (os.getenv("TAGGER_FINGERPRINT") or "").strip().lower()
+    return value if value in ENGINES else "auto"
+
+
+def _load_native():
+    global _native
+    with _native_lock:
+        if _native is None:
+            try:
+                import chromaprint  # raises ImportError without libchromaprint
+                import audioread
+                _native = (chromaprint, audioread)
+            except (ImportError, OSError):
+                _native = False
+    return _native
+
+
+def native_available():
+    """True if libchromaprint and audioread can be loaded."""
+    return bool(_load_native())
+
+
+def _silent_popen_kwargs():
+    """Popen arguments that hide fpcalc.exe console windows on Windows."""
+    if not hasattr(subprocess, "STARTF_USESHOWWINDOW"):
+        return {}
+    startupinfo = subprocess.STARTUPINFO()
+    startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+    return {"startupinfo": startupinfo, "creationflags": subprocess.CREATE_NO_WINDOW}
+
+
+def fingerprint_file_silent(path, maxlength=MAX_AUDIO_LENGTH):
+    """Run fpcalc on a file without a console window. Returns (duration, fingerprint).
+
+    Mirrors acoustid's fpcalc backend, but passes the window flags per call
+    instead of patching subprocess.Popen, so it is safe to run from many threads.
+    """
+    import acoustid
+    fpcalc = os.environ.get(acoustid.FPCALC_ENVVAR, acoustid.FPCALC_COMMAND)
+    command = [fpcalc, "-length", str(maxlength), os.path.abspath(path)]
+    try:
+        with METRICS.timer("tagger_stage_seconds", stage="fpcalc"):
+            proc = subprocess.run(
+                command,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+                **_silent_popen_kwargs()
+            )
+    except OSError as e:
+        raise acoustid.FingerprintGenerationError(f"fpcalc invocation failed: {e}")
+    if proc.returncode:
+        raise acoustid.FingerprintGenerationError(
+            f"fpcalc exited with status {proc.returncode}"
+        )
+
+    duration = fp = None
+    for line in proc.stdout.splitlines():
+        key, _, value = line.partition(b"=")
+        if key == b"DURATION":
+            try:
+                duration = float(value)
+            except ValueError:
+                raise acoustid.FingerprintGenerationError("fpcalc duration not numeric")
+        elif key == b"FINGERPRINT":
+            fp = value
+    if duration is None or fp is None:
+        raise acoustid.FingerprintGenerationError("missing fpcalc output")
+    return duration, fp
+
+
+def _fingerprinter(chromaprint):
+    """This thread's Chromaprint context (created on first use)."""
+    fingerprinter = getattr(_local, "fingerprinter", None)
+    if fingerprinter is None:
+        fingerprinter = _local.fingerprinter = chromaprint.Fingerprinter()
+    return fingerprinter
+
+
+def fingerprint_native(path, maxlength=MAX_AUDIO_LENGTH):
+    """Fingerprint a file in process. Returns (duration, fingerprint) like
+    fingerprint_file_silent(): whole seconds, fpcalc's compressed base64 form."""
+    import acoustid
+    native = _load_native()
+    if not native:
+        raise acoustid.NoBackendError("libchromaprint or audioread not available")
+    chromaprint, audioread = native
+
+    fingerprinter = _fingerprinter(chromaprint)
+    try:
+        with METRICS.timer("tagger_stage_seconds", stage="chromaprint"):
+            with audioread.audio_open(os.path.abspath(path)) as f:
+                duration = f.duration
+                remaining = f.samplerate * f.channels * maxlength * 2  # 16-bit PCM bytes
+                fingerprinter.start(f.samplerate, f.channels)
+                for block in f:
+                    if len(block) >= remaining:
+                        fingerprinter.feed(block[:remaining])
+                        break
+                    fingerprinter.feed(block)
+                    remaining -= len(block)
+                fp = fingerprinter.finish()
+    except audioread.DecodeError as e:
+        raise acoustid.FingerprintGenerationError(f"audio could not be decoded: {e}")
+    except chromaprint.FingerprintError:
+        raise acoustid.FingerprintGenerationError("fingerprint calculation failed")
+    # fpcalc prints the duration in whole seconds; cached and looked-up
+    # fingerprints stay the same whichever engine made them.
+    return float(int(duration)), fp
+
+
+def fingerprint_file(path, maxlength=MAX_AUDIO_LENGTH, engine=None):
+    """Fingerprint a file with the configured engine (see default_engine())."""
+    engine = engine or default_engine()
+    if engine == "fpcalc" or (engine == "auto" and not native_available()):
+        return fingerprint_file_silent(path, maxlength)
+    if engine == "native":
+        return fingerprint_native(path, maxlength)
+    import acoustid
+    try:
+        return fingerprint_native(path, maxlength)
+    except acoustid.FingerprintGenerationError:
+        METRICS.inc("tagger_fingerprint_fallbacks_total")
+        return fingerprint_file_silent(path, maxlength)
+
+
+# ---------------------------------------------------------------------------
+# CLI:  python -m core.fingerprint FILE...   (native engine vs fpcalc)
+# ---------------------------------------------------------------------------
+def compare_engines(path, maxlength=MAX_AUDIO_LENGTH):
+    """Fingerprint `path` with both engines. Returns a dict with both durations,
+    whether the fingerprints are identical, and their similarity (1 - bit
+    error rate at the best alignment, as core.duplicates measures it)."""
+    from core.duplicates import decode_fingerprint, similarity
+    native_duration, native_fp = fingerprint_native(path, maxlength)
+    fpcalc_duration, fpcalc_fp = fingerprint_file_silent(path, maxlength)
+    _, a = decode_fingerprint(native_fp)
+    _, b = decode_fingerprint(fpcalc_fp)
+    return {
+        "native_duration": native_duration,
+        "fpcalc_duration": fpcalc_duration,
+        "identical": native_fp == fpcalc_fp,
+        "similarity": similarity(a, b),
+    }
+
+
+def main(argv=None):
+    import argparse
+    from core.file_utils import check_fpcalc
+
+    parser = argparse.ArgumentParser(
+        prog="python -m core.fingerprint",
+        description="Compare the in-process Chromaprint engine with fpcalc.",
+    )
+    parser.add_argument("files", nargs="+")
+    parser.add_argument("--min-similarity", type=float, default=0.99,
+                        help="fail below this similarity (default: 0.99)")
+    args = parser.parse_args(argv)
+
+    if not native_available():
+        print("libchromaprint / audioread not available: only fpcalc can be used.", file=sys.stderr)
+        return 2
+    check_fpcalc(required=True)
+    failed = 0
+    for path in args.files:
+        try:
+            result = compare_engines(path)
+        except Exception as e:
+            print(f"{path}: {e}")
+            failed += 1
+            continue
+        ok = result["similarity"] >= args.min_similarity and \
+            result["native_duration"] == result["fpcalc_duration"]
+        failed += not ok
+        print(f"{path}: {'identical' if result['identical'] else 'differs'}, "
+              f"similarity {result['similarity']:.4f}, duration "
+              f"{result['native_duration']:.0f}s / {result['fpcalc_duration']:.0f}s"
+              f"{'' if ok else '  MISMATCH'}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
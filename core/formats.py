@@ -0,0 +1,461 @@
+import os
+import re
+from io import BytesIO
+
+# ---------------------------------------------------------------------------
+# Audio formats: minimal tag-state reads and tag writes per container
+#
+#   .mp3         ID3v2 frame headers (bodies such as cover art skipped), then
+#                the 128-byte ID3v1 block at the end
+#   .flac        metadata block headers up to the VORBIS_COMMENT block
+#                (PICTURE blocks and audio are never read)
+#   .ogg / .opus the Vorbis/Opus comment packet, located from the page
+#                headers and read across pages
+#   .m4a / .mp4  atom headers down to moov.udta.meta.ilst, reading only the
+#                ©ART / ©nam values (mdat and covr are seeked over)
+#
+# read_tag_state() answers "does it have an artist and a title?" from those
+# bytes alone, seeking over comments it does not need (pictures embedded as
+# comments included); anything the fast readers do not understand
+# (unsynchronised ID3 tags, odd atoms, FLAC-in-Ogg) is handed to mutagen.
+# Writing tags is core.tagwriter's job.
+#
+# mutagen is imported only on the slow paths.
+# ---------------------------------------------------------------------------
+
+def _blank(text):
+    return not text.replace("\x00", "").strip()
+
+
+# ---------------------------------------------------------------------------
+# MP3 (ID3v2 / ID3v1)
+# ---------------------------------------------------------------------------
+
+# Frame ids for artist / title per ID3v2 major version.
+_FRAME_IDS = {
+    2: (b"TP1", b"TT2"),
+    3: (b"TPE1", b"TIT2"),
+    4: (b"TPE1", b"TIT2"),
+}
+
+
+def _syncsafe(data):
+    return (data[0] << 21) | (data[1] << 14) | (data[2] << 7) | data[3]
+
+
+def _text_present(payload):
+    """True if an ID3 text frame body holds any non-blank text."""
+    if len(payload) < 2:
+        return False
+    encoding, text = payload[0], payload[1:]
+    codec = {0: "latin-1", 1: "utf-16", 2: "utf-16-be", 3: "utf-8"}.get(encoding, "latin-1")
+    try:
+        return not _blank(text.decode(codec, "replace"))
+    except Exception:
+        return False
+
+
+def _read_id3v2_fast(f, major, flags, size):
+    """Walk frame headers, reading only artist/title bodies. None if we must fall back."""
+    if flags & 0x80:  # whole-tag unsynchronisation
+        return None
+    artist_id, title_id = _FRAME_IDS[major]
+    id_len, header_len = (3, 6) if major == 2 else (4, 10)
+    pos = 10
+    end = 10 + size
+    if major >= 3 and flags & 0x40:  # extended header
+        f.seek(10)
+        ext = f.read(4)
+        ext_size = _syncsafe(ext) if major == 4 else int.from_bytes(ext, "big") + 4
+        pos += ext_size
+    has_artist = has_title = False
+    while pos + header_len <= end:
+        f.seek(pos)
+        header = f.read(header_len)
+        frame_id = header[:id_len]
+        if len(header) < header_len or not frame_id.strip(b"\x00"):
+            break  # padding
+        raw_size = header[id_len:id_len + (3 if major == 2 else 4)]
+        frame_size = _syncsafe(raw_size) if major == 4 else int.from_bytes(raw_size, "big")
+        if major >= 3 and header[9] & (0xE0 if major == 3 else 0x4F):
+            # Compression, encryption, grouping, unsync or a data length
+            # indicator: let mutagen decode the frame.
+            return None
+        if frame_id in (artist_id, title_id):
+            present = _text_present(f.read(frame_size))
+            if frame_id == artist_id:
+                has_artist = has_artist or present
+            else:
+                has_title = has_title or present
+            if has_artist and has_title:
+                break
+        pos += header_len + frame_size
+    return has_artist, has_title
+
+
+def _read_id3v2_mutagen(f, size):
+    """Slow path: parse just the tag bytes with mutagen."""
+    from mutagen.id3 import ID3
+    f.seek(0)
+    tags = ID3(BytesIO(f.read(10 + size)), load_v1=False)
+    artist = tags.get("TPE1")
+    title = tags.get("TIT2")
+    return (
+        bool(artist and any(str(t).strip() for t in artist.text)),
+        bool(title and any(str(t).strip() for t in title.text)),
+    )
+
+
+def _read_id3v1(f):
+    """Artist/title presence from the ID3v1 block at the end of the file."""
+    try:
+        f.seek(-128, os.SEEK_END)
+    except OSError:
+        return False, False
+    block = f.read(128)
+    if block[:3] != b"TAG":
+        return False, False
+    title = block[3:33].replace(b"\x00", b"").strip()
+    artist = block[33:63].replace(b"\x00", b"").strip()
+    return bool(artist), bool(title)
+
+
+def _id3v2_size(header):
+    """Total size of the ID3v2 tag starting with `header` (10 bytes), or 0."""
+    if len(header) == 10 and header[:3] == b"ID3" and header[3] in _FRAME_IDS:
+        return 10 + _syncsafe(header[6:10])
+    return 0
+
+
+def _read_mp3(f):
+    """Matches what EasyID3 sees: ID3v2 frames first, ID3v1 filling the gaps."""
+    has_artist = has_title = False
+    header = f.read(10)
+    if _id3v2_size(header):
+        size = _syncsafe(header[6:10])
+        result = _read_id3v2_fast(f, header[3], header[5], size)
+        if result is None:
+            result = _read_id3v2_mutagen(f, size)
+        has_artist, has_title = result
+    if not (has_artist and has_title):
+        v1_artist, v1_title = _read_id3v1(f)
+        has_artist = has_artist or v1_artist
+        has_title = has_title or v1_title
+    return has_artist, has_title
+
+
+# ---------------------------------------------------------------------------
+# Vorbis comments (FLAC, Ogg Vorbis, Opus)
+# ---------------------------------------------------------------------------
+_PACKET_END = re.compile(rb"[\x00-\xfe]")
+READ_AHEAD = 4096    # comment bytes read at once when walking a large comment block
+HEAD_BYTES = 4096    # Ogg headers / FLAC comment blocks up to this size are parsed in memory
+
+
+class _Memory:
+    """The read()/skip() interface of _Spans over bytes already read."""
+
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+
+    def read(self, n):
+        chunk = self.data[self.pos:self.pos + n]
+        self.pos += n
+        return chunk
+
+    def skip(self, n):
+        self.pos += n
+        return self.pos <= len(self.data)
+
+
+class _Spans:
+    """Reads (offset, length) pieces of a file as one stream, seeking over
+    whatever is skipped (e.g. cover art stored as a comment). `spans` may be
+    a generator; it is only advanced as far as the reads go."""
+
+    def __init__(self, f, spans):
+        self.f = f
+        self.spans = iter(spans)
+        self.current = None
+        self.pos = 0
+        self.buffer, self.buffer_start = b"", 0  # bytes read ahead within a span
+
+    def _read_at(self, offset, n, span_end):
+        start = offset - self.buffer_start
+        if not (0 <= start and start + n <= len(self.buffer)):
+            self.f.seek(offset)
+            self.buffer = self.f.read(max(n, min(READ_AHEAD, span_end - offset)))
+            self.buffer_start, start = offset, 0
+        return self.buffer[start:start + n]
+
+    def _advance(self, n, read):
+        out = []
+        while n > 0:
+            if self.current is None or self.pos == self.current[1]:
+                self.current, self.pos = next(self.spans, None), 0
+                if self.current is None:
+                    break
+            offset, length = self.current
+            take = min(n, length - self.pos)
+            if read:
+                out.append(self._read_at(offset + self.pos, take, offset + length))
+            self.pos += take
+            n -= take
+        return b"".join(out) if read else n == 0
+
+    def read(self, n):
+        return self._advance(n, True)
+
+    def skip(self, n):
+        return self._advance(n, False)
+
+
+def _vorbis_comment_state(stream):
+    """(has_artist, has_title) from a Vorbis comment block read from `stream`
+    (_Memory or _Spans)."""
+    has_artist = has_title = False
+    vendor = stream.read(4)
+    if len(vendor) < 4 or not stream.skip(int.from_bytes(vendor, "little")):
+        return False, False
+    count = stream.read(4)
+    for _ in range(int.from_bytes(count, "little") if len(count) == 4 else 0):
+        header = stream.read(4)
+        if len(header) < 4:
+            break
+        length = int.from_bytes(header, "little")
+        start = stream.read(min(length, 7))  # "ARTIST=" / "TITLE="
+        key, separator, value = start.partition(b"=")
+        key = key.upper()
+        if key in (b"ARTIST", b"TITLE") and separator:
+            value += stream.read(length - len(start))
+            if not _blank(value.decode("utf-8", "replace")):
+                if key == b"ARTIST":
+                    has_artist = True
+                else:
+                    has_title = True
+                if has_artist and has_title:
+                    break
+        elif not stream.skip(length - len(start)):
+            break
+    return has_artist, has_title
+
+
+def _read_flac(f):
+    header = f.read(10)
+    start = _id3v2_size(header)  # a few taggers put ID3v2 in front of FLAC
+    f.seek(start)
+    if f.read(4) != b"fLaC":
+        return None
+    while True:
+        block = f.read(4)
+        if len(block) < 4:
+            return False, False
+        last, kind = block[0] & 0x80, block[0] & 0x7F
+        length = int.from_bytes(block[1:4], "big")
+        if kind == 4:  # VORBIS_COMMENT
+            if length <= HEAD_BYTES:
+                return _vorbis_comment_state(_Memory(f.read(length)))
+            return _vorbis_comment_state(_Spans(f, [(f.tell(), length)]))
+        if last:
+            return False, False
+        f.seek(length, os.SEEK_CUR)
+
+
+def _ogg_pieces(f):
+    """Yield (offset, length, ends packet) for the packet data in the pages of
+    the first logical stream of an Ogg file; only page headers are read."""
+    serial = None
+    pos = 0
+    while True:
+        f.seek(pos)
+        header = f.read(27)
+        if len(header) < 27 or header[:4] != b"OggS":
+            return
+        lacing = f.read(header[26])
+        offset = pos + 27 + len(lacing)
+        pos = offset + sum(lacing)
+        if serial is None:
+            serial = header[14:18]
+        if header[14:18] != serial:
+            continue
+        start = 0
+        for end in _PACKET_END.finditer(lacing):  # a lacing value below 255 ends a packet
+            length = sum(lacing[start:end.end()])
+            yield offset, length, True
+            offset += length
+            start = end.end()
+        if start < len(lacing):
+            yield offset, sum(lacing[start:]), False
+
+
+def _ogg_packet(pieces):
+    """Spans of the next packet from _ogg_pieces(), pulled as it is read."""
+    for offset, length, last in pieces:
+        yield offset, length
+        if last:
+            return
+
+
+def _ogg_head_packets(head, count=2):
+    """The first `count` packets of the first logical stream, as far as they
+    are within `head` (the first bytes of the file). Returns (packets,
+    complete); if not complete the last packet is cut short."""
+    packets, current = [], []
+    pos, serial = 0, head[14:18]
+    while pos + 27 <= len(head) and head[pos:pos + 4] == b"OggS":
+        page_serial = head[pos + 14:pos + 18]
+        lacing = head[pos + 27:pos + 27 + head[pos + 26]]
+        offset = pos + 27 + len(lacing)
+        pos = offset + sum(lacing)
+        if page_serial != serial:
+            continue
+        if pos > len(head):
+            current.append(head[offset:])  # the page runs past `head`
+            break
+        start = 0
+        for end in _PACKET_END.finditer(lacing):
+            length = sum(lacing[start:end.end()])
+            current.append(head[offset:offset + length])
+            offset += length
+            start = end.end()
+            packets.append(b"".join(current))
+            current = []
+            if len(packets) == count:
+                return packets, True
+        current.append(head[offset:pos])
+    return packets + [b"".join(current)], False
+
+
+def _read_ogg(f):
+    head = f.read(HEAD_BYTES)
+    packets, complete = _ogg_head_packets(head)
+    if len(packets) == 2:
+        # The common case: the comment header starts in the first few KiB.
+        # Cover art is stored as a comment after artist/title, so a comment
+        # packet cut short by `head` usually still answers the question.
+        state = _ogg_comment_state(packets[0][:8], _Memory(packets[1]))
+        if complete or state == (True, True):
+            return state
+    pieces = _ogg_pieces(f)
+    first = _ogg_packet(pieces)
+    magic = _Spans(f, first).read(8)
+    for _ in first:
+        pass  # the rest of the identification packet
+    return _ogg_comment_state(magic, _Spans(f, _ogg_packet(pieces)))
+
+
+def _ogg_comment_state(magic, comment):
+    if not (magic.startswith(b"\x01vorbis") or magic.startswith(b"OpusHead")):
+        return None  # FLAC, Speex, ... in Ogg: let mutagen handle it
+    if comment.read(8 if magic.startswith(b"OpusHead") else 7) not in (b"\x03vorbis", b"OpusTags"):
+        return None
+    return _vorbis_comment_state(comment)
+
+
+# ---------------------------------------------------------------------------
+# MP4 / M4A
+# ---------------------------------------------------------------------------
+_CONTAINERS = (b"moov", b"udta", b"meta", b"ilst")
+_ITEMS = {b"\xa9ART": "artist", b"\xa9nam": "title"}
+
+
+def _atoms(f, start, end):
+    """Yield (type, body start, body end) for the atoms between `start` and `end`."""
+    pos = start
+    while pos + 8 <= end:
+        f.seek(pos)
+        header = f.read(8)
+        if len(header) < 8:
+            return
+        size, kind = int.from_bytes(header[:4], "big"), header[4:8]
+        body = pos + 8
+        if size == 1:
+            size = int.from_bytes(f.read(8), "big")
+            body += 8
+        elif size == 0:
+            size = end - pos
+        if size < body - pos or pos + size > end:
+            raise ValueError(f"bad atom size for {kind!r}")
+        yield kind, body, pos + size
+        pos += size
+
+
+def _read_mp4(f):
+    f.seek(0, os.SEEK_END)
+    end = f.tell()
+    found = {}
+
+    def walk(start, stop, depth):
+        for kind, body, atom_end in _atoms(f, start, stop):
+            if depth < len(_CONTAINERS) and kind == _CONTAINERS[depth]:
+                if kind == b"meta":
+                    # Full atom (version + flags) in MP4; QuickTime's meta has none.
+                    f.seek(body + 4)
+                    if f.read(4) != b"hdlr":
+                        body += 4
+                walk(body, atom_end, depth + 1)
+                return
+            if depth == len(_CONTAINERS) and kind in _ITEMS:
+                for child, data_start, data_end in _atoms(f, body, atom_end):
+                    if child == b"data" and data_end - data_start > 8:
+                        f.seek(data_start + 8)  # type + locale
+                        value = f.read(data_end - data_start - 8).decode("utf-8", "replace")
+                        found[_ITEMS[kind]] = found.get(_ITEMS[kind]) or not _blank(value)
+                if found.get("artist") and found.get("title"):
+                    return
+
+    try:
+        walk(0, end, 0)
+    except ValueError:
+        return None
+    return found.get("artist", False), found.get("title", False)
+
+
+# ---------------------------------------------------------------------------
+# Dispatch
+# ---------------------------------------------------------------------------
+_READERS = {
+    ".mp3": _read_mp3,
+    ".flac": _read_flac,
+    ".ogg": _read_ogg,
+    ".oga": _read_ogg,
+    ".opus": _read_ogg,
+    ".m4a": _read_mp4,
+    ".mp4": _read_mp4,
+}
+
+AUDIO_EXTENSIONS = tuple(_READERS)
+
+
+def is_audio_file(path):
+    return str(path).lower().endswith(AUDIO_EXTENSIONS)
+
+
+def _read_mutagen(path):
+    """Slow path for anything the fast readers gave up on."""
+    import mutagen
+    audio = mutagen.File(path, easy=True)
+    if audio is None or audio.tags is None:
+        return False, False
+    return tuple(
+        any(str(v).strip() for v in (audio.tags.get(key) or []))
+        for key in ("artist", "title")
+    )
+
+
+def read_tag_state(path):
+    """Return (has_artist, has_title) for an audio file, reading as few bytes as possible.
+
+    Unreadable files and unknown extensions count as untagged.
+    """
+    reader = _READERS.get(os.path.splitext(str(path))[1].lower())
+    if reader is None:
+        return False, False
+    try:
+        with open(path, "rb") as f:
+            result = reader(f)
+        return result if result is not None else _read_mutagen(path)
+    except Exception:
+        return False, False
+
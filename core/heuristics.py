@@ -0,0 +1,238 @@
+import os
+import re
+import threading
+import unicodedata
+from pathlib import Path
+
+from core.formats import read_tag_state
+from core.metrics import METRICS
+
+# ---------------------------------------------------------------------------
+# Filename / folder heuristics: artist and title without fingerprinting
+#
+# guess_tags() reads a file's name, the folders above it and its partial
+# tags (an artist without a title) and returns the tags they suggest with
+# a confidence between 0 and 1:
+#
+#   Artist - Title.mp3                        0.60
+#   NN - Artist - Title / NN. Artist - Title  0.60 (+ track number)
+#   Artist/Album/NN Title.mp3                 0.80 (artist and album from the folders)
+#   Artist - Title in a folder of that artist +0.35
+#   partial tags: the tagged artist agrees    +0.30 (disagrees: -0.30)
+#   Artist-Title / Artist_Title               0.20 (the old fallback split)
+#
+# Names that are just "Track 01", "Unknown", numbers and the like give no
+# guess. run_tagger sends files at or above TAGGER_HEURISTIC (default 0.8,
+# "off" disables it) to one MusicBrainz search instead of fpcalc + AcoustID
+# (see core.tagger.tag_from_guess); fallback_tag_from_filename uses the same
+# guesses for files AcoustID could not match.
+# ---------------------------------------------------------------------------
+
+DEFAULT_THRESHOLD = 0.8
+DIRECT_CONFIDENCE = 0.95  # tag from the guess alone if MusicBrainz cannot confirm it
+SEARCH_MIN_SCORE = 90     # MusicBrainz search score (0-100) a confirmation needs
+
+_DASH = re.compile(r"\s+[-–—]\s+")
+_TRACK = re.compile(r"^(?P<track>\d{1,3})(?:\s*[.)\]_-]\s*|\s+)(?=\D)")
+_LOOSE = re.compile(r"^(?P<artist>[^-–_]+)[-–_](?P<title>.+)$")
+_NOISE = re.compile(
+    r"\s*[\(\[\{](?:official\s*(?:music\s*|lyric\s*)?(?:video|audio)|lyrics?|hq|hd|"
+    r"audio|explicit|free\s*download|\d{2,3}\s*kbps|\d{3}k)[\)\]\}]",
+    re.IGNORECASE,
+)
+_ALBUM_DIR = re.compile(
+    r"^(?:(?P<artist>.+?)\s+[-–—]\s+)?(?:(?P<year>(?:19|20)\d\d)\s*[-.]\s*)?"
+    r"(?P<album>.+?)(?:\s*[\(\[](?P<year2>(?:19|20)\d\d)[\)\]])?$"
+)
+_JUNK = re.compile(
+    r"^(?:track|audio|unknown|untitled|unknown artist|various artists|va|new recording|"
+    r"song|music|mp3|audiotrack|piste|pista)?\s*\d*$",
+    re.IGNORECASE,
+)
+GENERIC_FOLDERS = {
+    "music", "my music", "mp3", "mp3s", "audio", "downloads", "download", "new folder",
+    "misc", "various", "various artists", "va", "unknown", "unknown artist",
+    "unknown album", "singles", "compilations", "_temp_untagged", "itunes", "itunes media",
+}
+
+
+def default_threshold():
+    """TAGGER_HEURISTIC from .env: the confidence needed to skip fingerprinting
+    (default 0.8), or None if it is "off"/"none"/"0"."""
+    value = (os.getenv("TAGGER_HEURISTIC") or "").strip().lower()
+    if value in {"off", "none", "0"}:
+        return None
+    try:
+        return min(1.0, max(0.0, float(value)))
+    except ValueError:
+        return DEFAULT_THRESHOLD
+
+
+def normalize(text):
+    """Casefolded, accent- and punctuation-free form for comparing names."""
+    text = unicodedata.normalize("NFKD", text or "")
+    text = "".join(c for c in text if not unicodedata.combining(c)).casefold()
+    text = re.sub(r"^the\s+|\s*&\s*|\s+and\s+", " ", text)
+    return " ".join(re.findall(r"\w+", text))
+
+
+def _clean(name):
+    if " " not in name and "_" in name:
+        name = name.replace("_", " ")  # Artist_-_Title, 01_Title
+    name = _NOISE.sub("", name)
+    return re.sub(r"\s+", " ", name).strip(" .-_")
+
+
+def _junk(text):
+    return not text or len(text) < 2 or bool(_JUNK.match(text))
+
+
+def folder_hints(path, root=None):
+    """(artist, album) suggested by the folders above `path`; either may be
+    None. Folders at or above `root` (the library root) are not used."""
+    path = Path(path)
+    if root is not None:
+        # Compared as absolute paths: the scan, the watcher and the caller's
+        # root may not agree on relative vs absolute.
+        path, root = Path(os.path.abspath(path)), Path(os.path.abspath(root))
+    folders = []
+    for folder in (path.parent, path.parent.parent):
+        if folder == folder.parent:  # the filesystem root
+            break
+        if root is not None and (folder == root or not folder.is_relative_to(root)):
+            break
+        folders.append(folder.name)
+    if not folders or folders[0].casefold() in GENERIC_FOLDERS:
+        return None, None
+    match = _ALBUM_DIR.match(_clean(folders[0]))
+    album = match.group("album") if match else None
+    artist = match.group("artist") if match else None
+    if artist is None and len(folders) > 1 and folders[1].casefold() not in GENERIC_FOLDERS:
+        artist = _clean(folders[1])
+    return (None if _junk(artist or "") else artist), (None if _junk(album or "") else album)
+
+
+def _tagged_artist(path, has_artist=None):
+    """The artist already in the file's tags (partially tagged files), or None."""
+    if has_artist is None:
+        has_artist, _ = read_tag_state(path)
+    if not has_artist:
+        return None
+    try:
+        import mutagen
+        audio = mutagen.File(path, easy=True)
+        values = (audio or {}).get("artist") or []
+        return values[0].strip() or None if values else None
+    except Exception:
+        return None
+
+
+def _same(a, b):
+    return bool(a and b) and normalize(a) == normalize(b)
+
+
+def guess_tags(path, root=None, tagged_artist=None):
+    """(tags, confidence) suggested by the name, folders and partial tags of
+    `path`; (None, 0.0) if they suggest nothing usable. `tags` has artist and
+    title, and album / tracknumber when the folders or name give them."""
+    path = Path(path)
+    name = _clean(path.stem)
+    track = None
+    match = _TRACK.match(name)
+    if match:
+        track, name = str(int(match.group("track"))), name[match.end():]
+
+    parts = _DASH.split(name)
+    dir_artist, album = folder_hints(path, root)
+    if len(parts) == 2:
+        artist, title, confidence = parts[0], parts[1], 0.6
+    elif len(parts) == 3 and (parts[1].isdigit() or _same(parts[1], album)):
+        if parts[1].isdigit():
+            track = track or str(int(parts[1]))
+        artist, title, confidence = parts[0], parts[2], 0.6
+    elif len(parts) >= 3:
+        artist, title, confidence = parts[0], " - ".join(parts[1:]), 0.45
+    else:
+        artist, title, confidence = None, name, 0.0
+        loose = _LOOSE.match(_NOISE.sub("", path.stem))
+        if loose and not track:
+            artist, title, confidence = loose.group("artist").strip(), loose.group("title").strip(), 0.2
+
+    tagged_artist = tagged_artist if tagged_artist is not None else _tagged_artist(path)
+    if artist is None:
+        # "NN Title" (or just "Title"): the artist has to come from elsewhere.
+        if tagged_artist:
+            artist, confidence = tagged_artist, 0.5 + (0.2 if _same(tagged_artist, dir_artist) else 0.0)
+        elif dir_artist and album and track:
+            artist, confidence = dir_artist, 0.8
+        elif dir_artist and track:
+            artist, confidence = dir_artist, 0.6
+        else:
+            return None, 0.0
+    else:
+        if _same(artist, dir_artist) or _same(artist, path.parent.name):
+            confidence += 0.35  # Artist/Artist - Title, Artist/Album/Artist - Title
+        if tagged_artist:
+            confidence += 0.3 if _same(artist, tagged_artist) else -0.3
+
+    if _junk(artist) or _junk(title) or artist.isdigit():
+        return None, 0.0
+    tags = {"artist": artist.strip(), "title": title.strip()}
+    if album and not _same(album, artist) and (track or _same(artist, dir_artist)):
+        tags["album"] = album.strip()
+    if track:
+        tags["tracknumber"] = track
+    return tags, round(max(0.0, min(1.0, confidence)), 2)
+
+
+def best_search_hit(recordings, tags):
+    """The MusicBrainz search result (a "recording-list" entry) that confirms
+    `tags`: same title and artist once normalized, score >= SEARCH_MIN_SCORE."""
+    from core.albums import credit_names
+    for recording in recordings:
+        try:
+            score = int(recording.get("ext:score", 0))
+        except ValueError:
+            score = 0
+        if score < SEARCH_MIN_SCORE:
+            continue
+        if _same(recording.get("title"), tags["title"]) and \
+                _same(credit_names(recording.get("artist-credit")), tags["artist"]):
+            return recording
+    return None
+
+
+class FilenameMatcher:
+    """Heuristic pre-stage for a run: which files are confident enough to skip
+    fingerprinting. Thread-safe (guess() is called from the lookup stages)."""
+
+    def __init__(self, root=None, threshold=DEFAULT_THRESHOLD):
+        self.root = Path(root) if root is not None else None
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        self.stats = {"confident": 0, "confirmed": 0, "guessed": 0, "unconfirmed": 0}
+
+    def confident(self, path):
+        """(tags, confidence) if the guess for `path` reaches the threshold, else
+        None. Files that are already tagged are left to tag_file to skip."""
+        has_artist, has_title = read_tag_state(path)
+        if has_artist and has_title:
+            return None
+        tags, confidence = guess_tags(path, self.root, _tagged_artist(path, has_artist) or "")
+        if tags is None or confidence < self.threshold:
+            return None
+        self.count("confident")
+        return tags, confidence
+
+    def count(self, outcome):
+        with self._lock:
+            self.stats[outcome] += 1
+        METRICS.inc("tagger_heuristic_total", outcome=outcome)
+
+    def summary(self):
+        s = self.stats
+        return (
+            f"Name heuristics: {s['confident']} files skipped fingerprinting; "
+            f"{s['confirmed']} confirmed by MusicBrainz search, {s['guessed']} tagged "
+            f"from the name alone, {s['unconfirmed']} sent to AcoustID after all"
+        )
@@ -0,0 +1,177 @@
+import os
+import time
+import sqlite3
+import threading
+from pathlib import Path
+
+# ---------------------------------------------------------------------------
+# Write-ahead run journal
+#
+# Every file of a run gets a row as soon as the scan finds it (before it is
+# moved or touched), and the row is advanced as the file moves through the
+# pipeline:
+#
+#   scanned -> fingerprinted -> looked_up -> written -> moved_back
+#
+# "written" means tag_file has finished with the file (its status says how);
+# "moved_back" is only used in temp-folder mode. Each change is committed
+# with synchronous=FULL, so after a crash, a closed GUI or a reboot the next
+# run knows which files are finished; files the scan had not reached yet
+# are found by scanning again. Fingerprints and lookups themselves
+# live in the lookup cache (core.cache), so resumed files need no fpcalc or
+# network calls either.
+# ---------------------------------------------------------------------------
+
+DEFAULT_JOURNAL_PATH = Path("cache") / "run_journal.sqlite3"
+STATES = ("scanned", "fingerprinted", "looked_up", "written", "moved_back")
+FINISHED = ("written", "moved_back")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    root TEXT NOT NULL,
+    dry_run INTEGER NOT NULL,
+    temp_folder INTEGER NOT NULL,
+    started REAL NOT NULL,
+    finished REAL
+);
+CREATE TABLE IF NOT EXISTS files (
+    run_id INTEGER NOT NULL,
+    path TEXT NOT NULL,
+    origin TEXT NOT NULL,
+    state TEXT NOT NULL,
+    status TEXT,
+    updated REAL NOT NULL,
+    PRIMARY KEY (run_id, path)
+);
+"""
+
+
+class RunJournal:
+    """Per-file progress of tagging runs, stored in SQLite.
+
+    One run is "current" at a time (start() or resume() selects it); mark()
+    may be called from any thread.
+    """
+
+    def __init__(self, path=DEFAULT_JOURNAL_PATH):
+        self.path = Path(path)
+        if str(path) != ":memory:":
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(path), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=FULL")
+        self._db.executescript(SCHEMA)
+        self._db.commit()
+        self.run_id = None
+
+    def unfinished(self, root, dry_run=False):
+        """(run id, started) of the last interrupted run over `root`, or None."""
+        with self._lock:
+            return self._db.execute(
+                "SELECT id, started FROM runs WHERE root = ? AND dry_run = ? "
+                "AND finished IS NULL ORDER BY id DESC LIMIT 1",
+                (os.path.abspath(root), int(dry_run)),
+            ).fetchone()
+
+    def start(self, root, files=(), dry_run=False, temp_folder=False):
+        """Begin a run over `files`, (path, origin) pairs, all "scanned".
+
+        Streaming runs start empty and add() files as they are found."""
+        now = time.time()
+        with self._lock:
+            cur = self._db.execute(
+                "INSERT INTO runs (root, dry_run, temp_folder, started) VALUES (?, ?, ?, ?)",
+                (os.path.abspath(root), int(dry_run), int(temp_folder), now),
+            )
+            self.run_id = cur.lastrowid
+            self._db.executemany(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, 'scanned', NULL, ?)",
+                [(self.run_id, str(p), str(o), now) for p, o in files],
+            )
+            self._db.commit()
+        return self.run_id
+
+    def resume(self, run_id):
+        """Make an interrupted run current again. Returns (done, pending origins)."""
+        self.run_id = run_id
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT origin, state FROM files WHERE run_id = ? ORDER BY rowid", (run_id,)
+            ).fetchall()
+        done = sum(1 for _, state in rows if state in FINISHED)
+        return done, [origin for origin, state in rows if state not in FINISHED]
+
+    def add(self, path, origin):
+        """Add a newly found file to the current run as "scanned"."""
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, 'scanned', NULL, ?)",
+                (self.run_id, str(path), str(origin), time.time()),
+            )
+            self._db.commit()
+
+    def origins(self):
+        """Original paths of every file in the current run."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT origin FROM files WHERE run_id = ?", (self.run_id,)
+            ).fetchall()
+        return {row[0] for row in rows}
+
+    def relocate(self, moves):
+        """Record new working paths for pending files: {origin: path}."""
+        with self._lock:
+            self._db.executemany(
+                "UPDATE files SET path = ?, updated = ? WHERE run_id = ? AND origin = ?",
+                [(str(p), time.time(), self.run_id, str(o)) for o, p in moves.items()],
+            )
+            self._db.commit()
+
+    def mark(self, path, state, status=None):
+        """Advance `path` (its working path) to `state`."""
+        if self.run_id is None:
+            return
+        with self._lock:
+            self._db.execute(
+                "UPDATE files SET state = ?, status = COALESCE(?, status), updated = ? "
+                "WHERE run_id = ? AND path = ?",
+                (state, status, time.time(), self.run_id, str(path)),
+            )
+            self._db.commit()
+
+    def mark_all(self, state, from_state):
+        """Advance every file of the current run in `from_state` (e.g. after move_back_all)."""
+        with self._lock:
+            self._db.execute(
+                "UPDATE files SET state = ?, updated = ? WHERE run_id = ? AND state = ?",
+                (state, time.time(), self.run_id, from_state),
+            )
+            self._db.commit()
+
+    def finish(self):
+        with self._lock:
+            self._db.execute(
+                "UPDATE runs SET finished = ? WHERE id = ?", (time.time(), self.run_id)
+            )
+            # Keep only the finished run's summary row; its files are history.
+            self._db.execute("DELETE FROM files WHERE run_id = ?", (self.run_id,))
+            self._db.commit()
+        self.run_id = None
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def default_journal_path():
+    """Journal location: TAGGER_JOURNAL from .env, else cache/run_journal.sqlite3."""
+    return Path(os.getenv("TAGGER_JOURNAL") or DEFAULT_JOURNAL_PATH)
+
+
+def open_default_journal():
+    """The journal configured in .env, or None if TAGGER_JOURNAL=off."""
+    if (os.getenv("TAGGER_JOURNAL") or "").strip().lower() in {"off", "none", "0"}:
+        return None
+    return RunJournal(default_journal_path())
@@ -0,0 +1,232 @@
+import os
+import time
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+# ---------------------------------------------------------------------------
+# Run metrics: counters and latency histograms
+#
+# One process-wide registry (METRICS), written to from every thread. The
+# pipeline resets it at the start of a run and, at the end, logs a summary
+# and writes a Prometheus text-format file (logs/metrics.prom by default),
+# suitable for node_exporter's textfile collector.
+#
+#   tagger_stage_seconds{stage}        fpcalc, chromaprint, fingerprint, acoustid, musicbrainz, write, move, ...
+#   tagger_service_request_seconds{service}
+#   tagger_files_total{status}
+#   tagger_cache_hits_total{kind} / tagger_cache_misses_total{kind}
+#   tagger_tag_writes_total{mode} / tagger_tag_bytes_written_total{mode}
+#   tagger_heuristic_total{outcome}    confident, confirmed, guessed, unconfirmed
+#   tagger_schedule_files_total{tier}  untagged, likely, other, retry, deferred, left
+#   tagger_service_retries_total{service} ... (copied from core.ratelimit)
+# ---------------------------------------------------------------------------
+
+DEFAULT_METRICS_PATH = Path("logs") / "metrics.prom"
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+HELP = {
+    "tagger_stage_seconds": "Time spent per pipeline stage, per file or call.",
+    "tagger_phase_seconds": "Wall time per pipeline phase.",
+    "tagger_service_request_seconds": "Duration of single web service requests.",
+    "tagger_files_total": "Files processed, by outcome.",
+    "tagger_cache_hits_total": "Cache hits, by cache.",
+    "tagger_cache_misses_total": "Cache misses, by cache.",
+    "tagger_move_retries_total": "File move attempts that had to be retried.",
+    "tagger_duplicates_total": "Files that reused the lookup of a duplicate.",
+    "tagger_fingerprint_fallbacks_total": "Files fpcalc fingerprinted because the in-process engine could not decode them.",
+    "tagger_tag_writes_total": "Files whose tags were written, by mode (in_place, rewrite, unchanged).",
+    "tagger_tag_bytes_written_total": "Bytes written to audio files by tag writes, by mode.",
+    "tagger_schedule_files_total": "Files of the run per scheduler tier; deferred = retry not due, left = over budget.",
+    "tagger_heuristic_total": "Files whose names identified them well enough to skip fingerprinting, by outcome.",
+    "tagger_service_requests_total": "Web service requests sent (including retries).",
+    "tagger_service_retries_total": "Web service requests retried.",
+    "tagger_service_throttled_total": "Web service requests throttled (429/503).",
+    "tagger_service_failures_total": "Web service calls that ran out of retries.",
+    "tagger_service_wait_seconds_total": "Time spent waiting for a rate-limit token.",
+    "tagger_service_backoff_seconds_total": "Time spent backing off before retries.",
+}
+
+
+class Histogram:
+    __slots__ = ("counts", "sum", "count", "max")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)  # last slot: +Inf
+        self.sum = 0.0
+        self.count = 0
+        self.max = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                break
+        else:
+            i = len(BUCKETS)
+        self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        """Upper bucket bound holding the q-quantile (an upper estimate)."""
+        target = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= target and n:
+                return BUCKETS[i] if i < len(BUCKETS) else self.max
+        return self.max
+
+
+def _labels(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_value(value):
+    """Exact sample value: integers as such, floats with full precision."""
+    if isinstance(value, int) or (isinstance(value, float) and value.is_integer()):
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+class Metrics:
+    """Thread-safe counters and histograms keyed by name and labels."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.counters = {}
+            self.histograms = {}
+            self.started = time.time()
+
+    def inc(self, name, value=1, **labels):
+        key = _labels(labels)
+        with self._lock:
+            series = self.counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        """Set a counter outright (for totals kept elsewhere)."""
+        with self._lock:
+            self.counters.setdefault(name, {})[_labels(labels)] = value
+
+    def observe(self, name, value, **labels):
+        key = _labels(labels)
+        with self._lock:
+            series = self.histograms.setdefault(name, {})
+            hist = series.get(key)
+            if hist is None:
+                hist = series[key] = Histogram()
+            hist.observe(value)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """Observe the time spent in the block."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def to_prometheus(self):
+        """The registry in Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            for name in sorted(self.counters):
+                lines.append(f"# HELP {name} {HELP.get(name, name)}")
+                lines.append(f"# TYPE {name} counter")
+                for labels, value in sorted(self.counters[name].items()):
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+            for name in sorted(self.histograms):
+                lines.append(f"# HELP {name} {HELP.get(name, name)}")
+                lines.append(f"# TYPE {name} histogram")
+                for labels, hist in sorted(self.histograms[name].items()):
+                    cumulative = 0
+                    for bound, n in zip(BUCKETS + ("+Inf",), hist.counts):
+                        cumulative += n
+                        le = bound if isinstance(bound, str) else f"{bound:g}"
+                        lines.append(
+                            f"{name}_bucket{_format_labels(labels, [('le', le)])} {cumulative}"
+                        )
+                    lines.append(f"{name}_sum{_format_labels(labels)} {hist.sum:.6f}")
+                    lines.append(f"{name}_count{_format_labels(labels)} {hist.count}")
+        lines.append("# HELP tagger_run_start_timestamp_seconds When the run started.")
+        lines.append("# TYPE tagger_run_start_timestamp_seconds gauge")
+        lines.append(f"tagger_run_start_timestamp_seconds {self.started:.0f}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        """Write to_prometheus() to `path` atomically (temp file + rename)."""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(path.name + ".tmp")
+        tmp.write_text(self.to_prometheus(), encoding="utf-8")
+        os.replace(tmp, path)
+
+    def summary(self):
+        """Human-readable lines: phase wall times, time per stage (busiest first),
+        outcomes and cache hit rates. Stage times of pool workers overlap, so
+        they can add up to more than the run took."""
+        lines = []
+        with self._lock:
+            for labels, hist in sorted(self.histograms.get("tagger_phase_seconds", {}).items()):
+                lines.append(f"Phase {dict(labels).get('phase', '?'):11s}: {hist.sum:8.1f}s")
+            stages = sorted(
+                self.histograms.get("tagger_stage_seconds", {}).items(),
+                key=lambda item: item[1].sum, reverse=True,
+            )
+            for labels, hist in stages:
+                stage = dict(labels).get("stage", "?")
+                lines.append(
+                    f"Stage {stage:11s}: {hist.sum:8.1f}s over {hist.count} calls "
+                    f"(mean {hist.sum / hist.count:.3f}s, p90 <= {hist.quantile(0.9):g}s, "
+                    f"max {hist.max:.2f}s)"
+                )
+            requests = self.histograms.get("tagger_service_request_seconds", {})
+            for labels, hist in sorted(requests.items()):
+                lines.append(
+                    f"Requests {dict(labels).get('service', '?')}: {hist.count} "
+                    f"(mean {hist.sum / hist.count:.3f}s, p90 <= {hist.quantile(0.9):g}s)"
+                )
+            files = self.counters.get("tagger_files_total", {})
+            if files:
+                outcome = ", ".join(
+                    f"{dict(labels).get('status')}={int(n)}" for labels, n in sorted(files.items())
+                )
+                lines.append(f"Files: {outcome}")
+            hits = self.counters.get("tagger_cache_hits_total", {})
+            misses = self.counters.get("tagger_cache_misses_total", {})
+            for labels in sorted(set(hits) | set(misses)):
+                h, m = hits.get(labels, 0), misses.get(labels, 0)
+                if h + m:
+                    lines.append(
+                        f"Cache {dict(labels).get('kind')}: {int(h)} hits, {int(m)} misses "
+                        f"({h / (h + m):.0%} hit rate)"
+                    )
+        return lines
+
+
+METRICS = Metrics()
+
+
+def default_metrics_path():
+    """Prometheus file: TAGGER_METRICS from .env (or "off"), else logs/metrics.prom."""
+    value = (os.getenv("TAGGER_METRICS") or "").strip()
+    if value.lower() in {"off", "none", "0"}:
+        return None
+    return Path(value or DEFAULT_METRICS_PATH)
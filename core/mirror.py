@@ -0,0 +1,496 @@
+import os
+import sys
+import json
+import time
+import uuid
+import sqlite3
+import threading
+from pathlib import Path
+
+# ---------------------------------------------------------------------------
+# Local MusicBrainz mirror
+#
+# MusicBrainz allows one request per second, which caps every run. This
+# imports the MusicBrainz JSON data dumps (one JSON entity per line, as in
+# mbdump/release and mbdump/recording of the json-dumps archives) into a
+# compact SQLite file and answers get_recording_by_id / get_release_by_id
+# from it, in the same dict shape musicbrainzngs returns:
+#
+#   credit    : id -> [[artist mbid, credited name], ...]   (deduplicated)
+#   recording : mbid -> title, length, credit
+#   release   : mbid -> title, date, status, credit, medium count
+#   track     : (release, medium, position) -> recording, track count,
+#               title/credit only where they differ from the recording's
+#
+# MBIDs are stored as 16-byte blobs in WITHOUT ROWID tables, and
+# track(recording) is indexed for the recording -> releases direction. The
+# release dump alone fills every table (its tracks embed their recordings);
+# the recording dump adds standalone recordings.
+#
+# Runs use the mirror configured by TAGGER_MB_MIRROR before asking the web
+# service; MBIDs the mirror does not know still go to MusicBrainz.
+#
+#   python -m core.mirror import release.tar.xz [recording.tar.xz ...]
+#   python -m core.mirror stats
+#   python -m core.mirror get MBID [--release]
+# ---------------------------------------------------------------------------
+
+DEFAULT_MIRROR_PATH = Path("cache") / "musicbrainz_mirror.sqlite3"
+IMPORT_BATCH = 2000       # entities per transaction while importing
+CREDIT_MEMO_SIZE = 100_000
+MMAP_SIZE = 256 * 1024 * 1024  # reads go through mmap instead of read() calls
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS credit (
+    id INTEGER PRIMARY KEY,
+    names TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS recording (
+    gid BLOB PRIMARY KEY,
+    title TEXT NOT NULL,
+    length INTEGER,
+    credit INTEGER
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS release (
+    gid BLOB PRIMARY KEY,
+    title TEXT NOT NULL,
+    date TEXT,
+    status TEXT,
+    credit INTEGER,
+    media INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS track (
+    release BLOB NOT NULL,
+    medium INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    recording BLOB NOT NULL,
+    track_count INTEGER NOT NULL,
+    gid BLOB,
+    number TEXT,
+    title TEXT,
+    credit INTEGER,
+    PRIMARY KEY (release, medium, position)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS track_recording ON track (recording);
+"""
+
+TABLES = ("recording", "release", "track", "credit")
+
+
+def _gid(mbid):
+    """16-byte blob for an MBID string (raises ValueError if it is not one)."""
+    return uuid.UUID(mbid).bytes
+
+
+def _mbid(blob):
+    return str(uuid.UUID(bytes=bytes(blob)))
+
+
+def default_mirror_path():
+    """Mirror location: TAGGER_MB_MIRROR from .env, else cache/musicbrainz_mirror.sqlite3."""
+    return Path(os.getenv("TAGGER_MB_MIRROR") or DEFAULT_MIRROR_PATH)
+
+
+def open_default_mirror():
+    """Open the mirror configured in .env, or None.
+
+    Unlike the caches, the mirror is opt-in: without TAGGER_MB_MIRROR (or
+    with "off") nothing is opened, and a configured file that does not
+    exist yet is ignored with a warning.
+    """
+    value = (os.getenv("TAGGER_MB_MIRROR") or "").strip()
+    if not value or value.lower() in {"off", "none", "0"}:
+        return None
+    if not Path(value).exists():
+        print(f"[MetadataFixer] MusicBrainz mirror not found: {value} (using the web service)")
+        return None
+    return MusicBrainzMirror(value)
+
+
+# ---------------------------------------------------------------------------
+# Dump reading
+# ---------------------------------------------------------------------------
+def _open_compressed(path):
+    import bz2
+    import gzip
+    import lzma
+    opener = {".gz": gzip.open, ".xz": lzma.open, ".bz2": bz2.open}.get(Path(path).suffix, open)
+    return opener(path, "rb")
+
+
+def iter_dump(path):
+    """Yield the JSON entities of a dump: a json-dumps archive (release.tar.xz
+    etc., reading its mbdump/ members) or a JSON-lines file, optionally
+    .gz/.xz/.bz2 compressed."""
+    path = str(path)
+    if ".tar" in Path(path).name:
+        import tarfile
+        with tarfile.open(path, "r|*") as archive:
+            for member in archive:
+                if not member.isfile() or not member.name.startswith("mbdump/"):
+                    continue
+                with archive.extractfile(member) as f:
+                    for line in f:
+                        if line.strip():
+                            yield json.loads(line)
+        return
+    with _open_compressed(path) as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def _credit_names(credits):
+    """[[artist mbid, credited name], ...] from a JSON artist-credit list."""
+    return [
+        [c.get("artist", {}).get("id", ""), c.get("name") or c.get("artist", {}).get("name", "")]
+        for c in credits or []
+    ]
+
+
+# ---------------------------------------------------------------------------
+# Store
+# ---------------------------------------------------------------------------
+class MusicBrainzMirror:
+    """Read-mostly SQLite store of MusicBrainz recordings, releases and credits.
+
+    Thread-safe; lookups return None for MBIDs that are not in the mirror.
+    """
+
+    def __init__(self, path=DEFAULT_MIRROR_PATH):
+        self.path = Path(path)
+        if str(path) != ":memory:":
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(path), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(f"PRAGMA mmap_size={MMAP_SIZE}")
+        self._db.executescript(SCHEMA)
+        self._db.commit()
+        self._credit_names = {}  # credit id -> [[mbid, name], ...] (lookups)
+        self._credit_ids = {}    # names JSON -> credit id (imports)
+
+    # -- lookups ------------------------------------------------------------
+    def _credit(self, credit_id):
+        if credit_id is None:
+            return []
+        names = self._credit_names.get(credit_id)
+        if names is None:
+            row = self._db.execute("SELECT names FROM credit WHERE id = ?", (credit_id,)).fetchone()
+            names = json.loads(row[0]) if row else []
+            if len(self._credit_names) >= CREDIT_MEMO_SIZE:
+                self._credit_names.clear()
+            self._credit_names[credit_id] = names
+        return [{"artist": {"id": mbid, "name": name}} for mbid, name in names]
+
+    @staticmethod
+    def _credit_phrase(credits):
+        return ", ".join(c["artist"]["name"] for c in credits)
+
+    def _release_summary(self, gid, title, date, status):
+        release = {"id": _mbid(gid), "title": title}
+        if date:
+            release["date"] = date
+        if status:
+            release["status"] = status
+        return release
+
+    def get_recording_by_id(self, rid, includes=("artists", "releases")):
+        """The recording as musicbrainzngs.get_recording_by_id() would return it, or None."""
+        try:
+            gid = _gid(rid)
+        except ValueError:
+            return None
+        with self._lock:
+            row = self._db.execute(
+                "SELECT title, length, credit FROM recording WHERE gid = ?", (gid,)
+            ).fetchone()
+            if row is None:
+                return None
+            title, length, credit_id = row
+            recording = {"id": rid, "title": title}
+            if length:
+                recording["length"] = str(length)
+            if "artists" in includes or "artist-credits" in includes:
+                credits = self._credit(credit_id)
+                recording["artist-credit"] = credits
+                recording["artist-credit-phrase"] = self._credit_phrase(credits)
+            if "releases" in includes:
+                rows = self._db.execute(
+                    "SELECT DISTINCT r.gid, r.title, r.date, r.status FROM track t "
+                    "JOIN release r ON r.gid = t.release WHERE t.recording = ? "
+                    "ORDER BY r.date IS NULL, r.date, r.title",
+                    (gid,),
+                ).fetchall()
+                recording["release-list"] = [self._release_summary(*r) for r in rows]
+                recording["release-count"] = len(rows)
+        return {"recording": recording}
+
+    def get_release_by_id(self, release_id, includes=("recordings", "artist-credits")):
+        """The release (with its tracklist if "recordings" is included) as
+        musicbrainzngs.get_release_by_id() would return it, or None."""
+        try:
+            gid = _gid(release_id)
+        except ValueError:
+            return None
+        with self._lock:
+            row = self._db.execute(
+                "SELECT title, date, status, credit, media FROM release WHERE gid = ?", (gid,)
+            ).fetchone()
+            if row is None:
+                return None
+            title, date, status, credit_id, media = row
+            release = self._release_summary(gid, title, date, status)
+            credits = self._credit(credit_id)
+            release["artist-credit"] = credits
+            release["artist-credit-phrase"] = self._credit_phrase(credits)
+            release["medium-count"] = media
+            if "recordings" not in includes:
+                return {"release": release}
+            mediums = {}
+            for (medium, position, recording_gid, track_count, track_gid, number,
+                 track_title, track_credit, rec_title, rec_length, rec_credit) in self._db.execute(
+                "SELECT t.medium, t.position, t.recording, t.track_count, t.gid, t.number, "
+                "t.title, t.credit, r.title, r.length, r.credit FROM track t "
+                "JOIN recording r ON r.gid = t.recording WHERE t.release = ? "
+                "ORDER BY t.medium, t.position",
+                (gid,),
+            ):
+                entry = mediums.setdefault(medium, {
+                    "position": str(medium), "track-count": track_count, "track-list": [],
+                })
+                recording = {"id": _mbid(recording_gid), "title": rec_title,
+                             "artist-credit": self._credit(rec_credit)}
+                if rec_length:
+                    recording["length"] = str(rec_length)
+                track = {"position": str(position), "number": number or str(position),
+                         "title": track_title or rec_title, "recording": recording}
+                if track_gid:
+                    track["id"] = _mbid(track_gid)
+                if track_credit is not None:
+                    track["artist-credit"] = self._credit(track_credit)
+                entry["track-list"].append(track)
+            release["medium-list"] = [mediums[m] for m in sorted(mediums)]
+        return {"release": release}
+
+    # -- import -------------------------------------------------------------
+    def _credit_id(self, credits):
+        names = json.dumps(_credit_names(credits), ensure_ascii=False, separators=(",", ":"))
+        credit_id = self._credit_ids.get(names)
+        if credit_id is None:
+            self._db.execute("INSERT OR IGNORE INTO credit (names) VALUES (?)", (names,))
+            credit_id = self._db.execute(
+                "SELECT id FROM credit WHERE names = ?", (names,)
+            ).fetchone()[0]
+            if len(self._credit_ids) >= CREDIT_MEMO_SIZE:
+                self._credit_ids.clear()
+            self._credit_ids[names] = credit_id
+        return credit_id
+
+    def _put_recording(self, recording):
+        self._db.execute(
+            "INSERT OR REPLACE INTO recording (gid, title, length, credit) VALUES (?, ?, ?, ?)",
+            (_gid(recording["id"]), recording.get("title", ""), recording.get("length"),
+             self._credit_id(recording.get("artist-credit"))),
+        )
+
+    def _put_release(self, release):
+        gid = _gid(release["id"])
+        media = release.get("media") or []
+        self._db.execute(
+            "INSERT OR REPLACE INTO release (gid, title, date, status, credit, media) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (gid, release.get("title", ""), release.get("date") or None,
+             release.get("status") or None, self._credit_id(release.get("artist-credit")),
+             len(media)),
+        )
+        self._db.execute("DELETE FROM track WHERE release = ?", (gid,))
+        for n, medium in enumerate(media, start=1):
+            tracks = medium.get("tracks") or []
+            count = medium.get("track-count") or len(tracks)
+            for i, track in enumerate(tracks, start=1):
+                recording = track.get("recording") or {}
+                if not recording.get("id"):
+                    continue
+                self._put_recording(recording)
+                title = track.get("title")
+                credit = None
+                if track.get("artist-credit"):
+                    credit = self._credit_id(track["artist-credit"])
+                    if credit == self._credit_id(recording.get("artist-credit")):
+                        credit = None
+                self._db.execute(
+                    "INSERT OR REPLACE INTO track (release, medium, position, recording, "
+                    "track_count, gid, number, title, credit) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (gid, medium.get("position") or n, track.get("position") or i,
+                     _gid(recording["id"]), count,
+                     _gid(track["id"]) if track.get("id") else None,
+                     track.get("number") if track.get("number") != str(track.get("position")) else None,
+                     title if title != recording.get("title") else None,
+                     credit),
+                )
+
+    def import_entities(self, entities, progress=None):
+        """Import dump entities: releases (with "media") and recordings; other
+        entity types are skipped.
+
+        Commits every IMPORT_BATCH entities; `progress(count)` is called after
+        each commit. Returns {"releases": n, "recordings": n, "skipped": n}.
+        """
+        counts = {"releases": 0, "recordings": 0, "skipped": 0}
+        pending = 0
+        with self._lock:
+            self._credit_names.clear()
+            self._db.execute("PRAGMA synchronous=OFF")
+            try:
+                for entity in entities:
+                    try:
+                        if "media" in entity:
+                            self._put_release(entity)
+                            counts["releases"] += 1
+                        elif "video" in entity or "length" in entity:
+                            self._put_recording(entity)
+                            counts["recordings"] += 1
+                        else:
+                            counts["skipped"] += 1  # another entity type
+                    except (KeyError, ValueError, TypeError, AttributeError):
+                        counts["skipped"] += 1
+                    pending += 1
+                    if pending >= IMPORT_BATCH:
+                        self._db.commit()
+                        pending = 0
+                        if progress:
+                            progress(counts["releases"] + counts["recordings"])
+                self._db.commit()
+                self._db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            finally:
+                self._db.execute("PRAGMA synchronous=NORMAL")
+                self._credit_ids.clear()
+        return counts
+
+    def import_dump(self, path, progress=None):
+        """Import one dump file (see iter_dump)."""
+        return self.import_entities(iter_dump(path), progress)
+
+    # -- maintenance --------------------------------------------------------
+    def stats(self):
+        """Row counts per table plus the database size."""
+        with self._lock:
+            result = {
+                table: self._db.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                for table in TABLES
+            }
+        result["size_bytes"] = self.path.stat().st_size if self.path.exists() else 0
+        return result
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class LocalMetadata:
+    """The mirror a run answers MusicBrainz lookups from, if any.
+
+    core.tagger and core.albums ask it before the web service; a miss (or
+    no mirror) returns None and the lookup goes to MusicBrainz as before.
+    """
+
+    def __init__(self):
+        self.mirror = None
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.stats = {"hits": 0, "misses": 0}
+
+    def use(self, mirror):
+        self.mirror = mirror
+        self.reset_stats()
+
+    def _lookup(self, method, mbid, includes):
+        if self.mirror is None:
+            return None
+        payload = getattr(self.mirror, method)(mbid, includes)
+        self.stats["hits" if payload is not None else "misses"] += 1
+        return payload
+
+    def recording(self, rid, includes):
+        return self._lookup("get_recording_by_id", rid, includes)
+
+    def release(self, release_id, includes):
+        return self._lookup("get_release_by_id", release_id, includes)
+
+    def summary(self):
+        s = self.stats
+        return (
+            f"MusicBrainz mirror: {s['hits']} lookups answered locally, "
+            f"{s['misses']} not in the mirror"
+        )
+
+
+LOCAL = LocalMetadata()
+
+
+# ---------------------------------------------------------------------------
+# CLI:  python -m core.mirror [--db PATH] import DUMP... | stats | get MBID
+# ---------------------------------------------------------------------------
+def main(argv=None):
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    import argparse
+    parser = argparse.ArgumentParser(
+        prog="python -m core.mirror",
+        description="Build and query the local MusicBrainz mirror.",
+    )
+    parser.add_argument("--db", default=None,
+                        help="mirror database (default: TAGGER_MB_MIRROR or cache/)")
+    sub = parser.add_subparsers(dest="command", required=True)
+    load = sub.add_parser("import", help="import MusicBrainz JSON dumps")
+    load.add_argument("dumps", nargs="+", help="release/recording dump (.tar.xz or JSON lines)")
+    sub.add_parser("stats", help="show row counts and database size")
+    get = sub.add_parser("get", help="print a recording as a run would see it")
+    get.add_argument("mbid")
+    get.add_argument("--release", action="store_true", help="MBID is a release")
+    args = parser.parse_args(argv)
+
+    path = Path(args.db) if args.db else default_mirror_path()
+    if args.command != "import" and not path.exists():
+        print(f"[MetadataFixer] No mirror at {path}")
+        return 1
+
+    mirror = MusicBrainzMirror(path)
+    try:
+        if args.command == "import":
+            for dump in args.dumps:
+                if not os.path.exists(dump):
+                    print(f"[MetadataFixer] Dump not found: {dump}", file=sys.stderr)
+                    return 1
+                start = time.perf_counter()
+                counts = mirror.import_dump(
+                    dump, progress=lambda n: print(f"  {n} entities...", end="\r"),
+                )
+                print(f"{dump}: {counts['releases']} releases, {counts['recordings']} recordings "
+                      f"({counts['skipped']} skipped) in {time.perf_counter() - start:.1f}s")
+        elif args.command == "stats":
+            stats = mirror.stats()
+            print(f"Mirror: {path}")
+            for table in TABLES:
+                print(f"  {table}: {stats[table]}")
+            print(f"  size: {stats['size_bytes'] / 1024:.1f} KiB")
+        elif args.command == "get":
+            if args.release:
+                payload = mirror.get_release_by_id(args.mbid)
+            else:
+                payload = mirror.get_recording_by_id(args.mbid)
+            if payload is None:
+                print(f"[MetadataFixer] {args.mbid} is not in the mirror")
+                return 1
+            print(json.dumps(payload, indent=2, ensure_ascii=False))
+    finally:
+        mirror.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
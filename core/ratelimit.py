@@ -0,0 +1,196 @@
+import time
+import random
+import threading
+
+from core.metrics import METRICS
+
+# ---------------------------------------------------------------------------
+# Shared rate limiting for the web services
+#
+# One token bucket per service, shared by every thread in the process. A
+# request takes a token before it is sent, so time spent on the request
+# itself counts towards the interval (unlike a fixed sleep afterwards).
+# Throttling responses (429/503, optionally with Retry-After) pause the whole
+# bucket, and transient failures are retried with exponential backoff and
+# jitter.
+# ---------------------------------------------------------------------------
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class TransientError(Exception):
+    """A request failed in a way that is worth retrying (network error, 5xx)."""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class ThrottledError(TransientError):
+    """The service asked us to slow down (HTTP 429/503)."""
+
+
+def parse_retry_after(value):
+    """Seconds to wait from a Retry-After header (delta-seconds or HTTP date)."""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    from email.utils import parsedate_to_datetime
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """Thread-safe token bucket: `rate` tokens per second, at most `capacity` saved up.
+
+    Implemented as a schedule of send times (GCRA): reserve() books the next
+    free slot and says how long to wait for it, so blocking callers can
+    time.sleep() and asyncio callers can await asyncio.sleep() on the same
+    bucket.
+    """
+
+    def __init__(self, rate, capacity=1.0, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.capacity = capacity
+        self._clock = clock
+        self._sleep = sleep
+        self._next = clock()  # earliest time the next request may go out
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """Book a slot. Returns the seconds to wait before using it."""
+        interval = 1.0 / self.rate
+        with self._lock:
+            now = self._clock()
+            # Unused slots accumulate as burst credit, up to `capacity`.
+            slot = max(self._next, now - (self.capacity - 1) * interval)
+            self._next = slot + interval
+            return max(0.0, slot - now)
+
+    def acquire(self):
+        """Block until a token is available. Returns the seconds spent waiting."""
+        delay = self.reserve()
+        if delay:
+            self._sleep(delay)
+        return delay
+
+    def pause(self, seconds):
+        """Stop handing out tokens for `seconds` (e.g. after a Retry-After)."""
+        with self._lock:
+            self._next = max(self._next, self._clock() + seconds)
+
+
+class ServiceLimiter:
+    """Token bucket plus retry policy for one web service."""
+
+    def __init__(
+        self,
+        name,
+        rate,
+        capacity=1.0,
+        max_retries=4,
+        base_delay=1.0,
+        max_delay=60.0,
+        sleep=time.sleep,
+    ):
+        self.name = name
+        self.bucket = TokenBucket(rate, capacity, sleep=sleep)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+    def reset_stats(self):
+        with self._lock:
+            self.stats = {
+                "requests": 0,
+                "retries": 0,
+                "throttled": 0,
+                "failures": 0,
+                "wait_seconds": 0.0,
+                "backoff_seconds": 0.0,
+            }
+
+    def _count(self, **deltas):
+        with self._lock:
+            for key, value in deltas.items():
+                self.stats[key] += value
+
+    def backoff_delay(self, attempt):
+        """Exponential backoff with jitter: a random delay in [d/2, d], d = base * 2**attempt."""
+        delay = min(self.max_delay, self.base_delay * (2 ** attempt))
+        return random.uniform(delay / 2, delay)
+
+    def _retry_delay(self, e, attempt):
+        """Seconds to wait before retrying after `e`; re-raises if out of attempts."""
+        if attempt >= self.max_retries:
+            self._count(failures=1)
+            raise e
+        if isinstance(e, ThrottledError):
+            self._count(throttled=1)
+        delay = self.backoff_delay(attempt)
+        if e.retry_after is not None:
+            delay = min(self.max_delay, e.retry_after) + random.uniform(0, 0.25)
+            # Everyone waits, not just this request.
+            self.bucket.pause(delay)
+        self._count(retries=1, backoff_seconds=delay)
+        return delay
+
+    def call(self, func, *args, **kwargs):
+        """Call `func` once a token is available, retrying TransientErrors."""
+        attempt = 0
+        while True:
+            waited = self.bucket.acquire()
+            self._count(requests=1, wait_seconds=waited)
+            try:
+                with METRICS.timer("tagger_service_request_seconds", service=self.name):
+                    return func(*args, **kwargs)
+            except TransientError as e:
+                self._sleep(self._retry_delay(e, attempt))
+                attempt += 1
+
+    async def call_async(self, func, *args, **kwargs):
+        """Like call(), for a coroutine function; waits with asyncio.sleep.
+
+        Shares the bucket with blocking callers, so mixing both still keeps
+        the service's overall rate.
+        """
+        import asyncio
+        attempt = 0
+        while True:
+            waited = self.bucket.reserve()
+            self._count(requests=1, wait_seconds=waited)
+            if waited:
+                await asyncio.sleep(waited)
+            try:
+                with METRICS.timer("tagger_service_request_seconds", service=self.name):
+                    return await func(*args, **kwargs)
+            except TransientError as e:
+                await asyncio.sleep(self._retry_delay(e, attempt))
+                attempt += 1
+
+    def export_metrics(self, metrics=METRICS):
+        """Add the stats to `metrics` as tagger_service_*_total{service=...}.
+        run_tagger resets the stats per run, so the counters add up over runs
+        (watch mode tags many batches into one METRICS)."""
+        for key, value in self.stats.items():
+            metrics.inc(f"tagger_service_{key}_total", value, service=self.name)
+
+    def summary(self):
+        s = self.stats
+        return (
+            f"{self.name}: {s['requests']} requests, {s['retries']} retries "
+            f"({s['throttled']} throttled), {s['failures']} failed, "
+            f"{s['wait_seconds']:.1f}s rate-limit wait, {s['backoff_seconds']:.1f}s backoff (all threads)"
+        )
+
+
+# AcoustID allows 3 requests/second, MusicBrainz 1 request/second.
+ACOUSTID = ServiceLimiter("AcoustID", rate=3.0)
+MUSICBRAINZ = ServiceLimiter("MusicBrainz", rate=1.0)
@@ -0,0 +1,197 @@
+import os
+import sqlite3
+import threading
+from collections import namedtuple
+from pathlib import Path
+
+from core.formats import AUDIO_EXTENSIONS, read_tag_state
+
+# ---------------------------------------------------------------------------
+# Single-pass library scanner with an incremental tag-state index
+#
+# Walks the tree once with os.scandir and, for each audio file (MP3, FLAC,
+# Ogg, M4A), only reads the tag headers core.formats needs to tell whether
+# artist and title are set (cover art and audio are skipped). Results are
+# stored per path with the file's size and mtime, so later scans only
+# re-read files that changed. iter_scan() yields results as it goes, for
+# pipelines that start work before the walk is over.
+# ---------------------------------------------------------------------------
+
+DEFAULT_INDEX_PATH = Path("cache") / "tag_index.sqlite3"
+TEMP_FOLDER_NAME = "_temp_untagged"
+
+
+class TrackState(namedtuple("TrackState", "path size mtime_ns has_artist has_title")):
+    __slots__ = ()
+
+    @property
+    def tagged(self):
+        return self.has_artist and self.has_title
+
+
+# ---------------------------------------------------------------------------
+# Persistent index
+# ---------------------------------------------------------------------------
+class TagIndex:
+    """path -> (size, mtime_ns, has_artist, has_title), stored in SQLite."""
+
+    def __init__(self, path=DEFAULT_INDEX_PATH):
+        self.path = Path(path)
+        if str(path) != ":memory:":
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(path), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS tag_index ("
+            "path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, "
+            "has_artist INTEGER, has_title INTEGER)"
+        )
+        self._db.commit()
+
+    def load(self, root):
+        """All entries under `root`, as {path: TrackState}."""
+        prefix = os.path.join(os.path.abspath(root), "")
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT path, size, mtime_ns, has_artist, has_title FROM tag_index "
+                "WHERE substr(path, 1, ?) = ?",
+                (len(prefix), prefix),
+            ).fetchall()
+        return {
+            row[0]: TrackState(row[0], row[1], row[2], bool(row[3]), bool(row[4]))
+            for row in rows
+        }
+
+    def update(self, states, removed=()):
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO tag_index VALUES (?, ?, ?, ?, ?)",
+                [(s.path, s.size, s.mtime_ns, int(s.has_artist), int(s.has_title)) for s in states],
+            )
+            self._db.executemany("DELETE FROM tag_index WHERE path = ?", [(p,) for p in removed])
+            self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def default_index_path():
+    """Index location: TAGGER_INDEX from .env, else cache/tag_index.sqlite3."""
+    return Path(os.getenv("TAGGER_INDEX") or DEFAULT_INDEX_PATH)
+
+
+# ---------------------------------------------------------------------------
+# Scanner
+# ---------------------------------------------------------------------------
+def iter_audio_entries(root, skip_dirs=(TEMP_FOLDER_NAME,)):
+    """Yield os.DirEntry objects for audio files under `root` (os.scandir, no recursion limit)."""
+    stack = [os.path.abspath(root)]
+    while stack:
+        current = stack.pop()
+        try:
+            with os.scandir(current) as it:
+                entries = sorted(it, key=lambda e: e.name)
+        except OSError:
+            continue
+        subdirs = []
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.name not in skip_dirs:
+                        subdirs.append(entry.path)
+                elif entry.name.lower().endswith(AUDIO_EXTENSIONS) and entry.is_file():
+                    yield entry
+            except OSError:
+                continue
+        stack.extend(reversed(subdirs))
+
+
+class ScanProgress:
+    """Running counts of a streaming scan, for estimating how much work is ahead.
+
+    `expected` is how many files the index held for the root before the
+    scan (0 on a first scan); `matched` is maintained by whoever filters the
+    scanned files (e.g. to the untagged ones).
+    """
+
+    def __init__(self):
+        self.expected = 0
+        self.scanned = 0
+        self.matched = 0
+        self.finished = False
+
+    def estimate(self):
+        """Expected number of matches once the scan is through."""
+        if self.finished:
+            return self.matched
+        guess = self.matched
+        if self.scanned and self.expected > self.scanned:
+            guess = round(self.matched * self.expected / self.scanned)
+        return max(guess, self.matched + 1)
+
+
+def iter_scan(root, index=None, skip_dirs=(TEMP_FOLDER_NAME,), progress=None, entries=None,
+              chunk=500):
+    """Yield a TrackState per audio file under `root` as the walk goes.
+
+    Without an index every file's tags are read. With one, only files whose
+    size or mtime changed are read again; changes are written back every
+    `chunk` files, and entries for vanished files are dropped once the walk
+    is complete. `entries` replaces the walk (e.g. prefetch()-ed
+    iter_audio_entries), `progress` (ScanProgress) is kept up to date.
+    """
+    if not Path(root).exists():
+        raise ValueError(f"Folder not found: {root}")
+
+    known = index.load(root) if index else {}
+    if progress:
+        progress.expected = len(known)
+    changed = []
+    for entry in entries if entries is not None else iter_audio_entries(root, skip_dirs):
+        try:
+            st = entry.stat()
+        except OSError:
+            continue  # moved or deleted since the walk listed it
+        cached = known.pop(entry.path, None)
+        if cached and cached.size == st.st_size and cached.mtime_ns == st.st_mtime_ns:
+            state = cached
+        else:
+            has_artist, has_title = read_tag_state(entry.path)
+            state = TrackState(entry.path, st.st_size, st.st_mtime_ns, has_artist, has_title)
+            changed.append(state)
+            if index and len(changed) >= chunk:
+                index.update(changed)
+                changed = []
+        if progress:
+            progress.scanned += 1
+        yield state
+
+    if index:
+        # Whatever is left in `known` was not seen in this walk. Entries inside
+        # skipped folders (e.g. the temp folder) are kept for when files return.
+        removed = [
+            p for p in known
+            if not any(part in skip_dirs for part in Path(p).parts)
+        ]
+        index.update(changed, removed)
+
+
+def scan_library(root, index=None, skip_dirs=(TEMP_FOLDER_NAME,)):
+    """Scan `root` once and return a list of TrackState (see iter_scan)."""
+    return list(iter_scan(root, index, skip_dirs))
+
+
+def open_default_index():
+    return TagIndex(default_index_path())
+
+
+def scan_with_default_index(root):
+    """scan_library() using the index configured in .env."""
+    index = open_default_index()
+    try:
+        return scan_library(root, index)
+    finally:
+        index.close()
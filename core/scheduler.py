@@ -0,0 +1,261 @@
+import os
+import time
+from itertools import islice
+from pathlib import Path
+
+from core.cache import DAY, content_key
+from core.formats import read_tag_state
+from core.metrics import METRICS
+from core.ratelimit import ACOUSTID
+
+# ---------------------------------------------------------------------------
+# Run scheduler: the most fixable files first, within a budget
+#
+# order() ranks the files of a run by a cheap score (tag headers and the
+# lookup cache only; no fingerprints, no requests):
+#
+#   untagged  no tags at all
+#   likely    partial tags and a cached AcoustID result or fingerprint, its
+#             own or a folder sibling's (album mode tags the rest of a
+#             folder from the release one track resolves)
+#   other     partial tags, nothing cached
+#   retry     files that came back no_match, or could not be fingerprinted
+#             or decoded, in earlier runs and are due again, fewest failures
+#             first
+#
+# Ranking needs each file's content key; core.cache.content_key remembers it,
+# so the fingerprint and lookup stages do not read the file's head and tail
+# again.
+#
+# Within a tier, files with something cached come first; after that,
+# folders stay together in scan order, so album mode still sees whole
+# albums. A file that fails is retried after 1, 2, 4, ... days (at most
+# MAX_SPACING); until then it is left out of runs. Only failures that would
+# repeat count: no match, or a file fpcalc or the decoder rejects. Lookups
+# that failed on the network (timeouts, 5xx after retries) leave the file's
+# history alone, so an outage does not push files back. The failure history
+# is kept in the lookup cache by content key, so without a cache there are
+# no retry tiers.
+#
+# A streamed file list is ranked in windows of WINDOW files, so tagging
+# starts while the scan is still running; retries wait for the end of the
+# stream. A list is ranked as a whole. With a budget (TAGGER_BUDGET_MINUTES,
+# TAGGER_BUDGET_REQUESTS = AcoustID requests) each file is admitted as it
+# leaves order(), before run_tagger stages it (journal, temp-folder move),
+# and once the budget is spent no new file is handed on. Files already in
+# flight still finish, so a request budget can be overshot by a batch or
+# two.
+# ---------------------------------------------------------------------------
+
+TIERS = ("untagged", "likely", "other", "retry")
+WINDOW = 500
+BASE_SPACING = DAY
+MAX_SPACING = 64 * DAY
+FIXED = ("tagged", "guessed", "fallback")
+
+
+def default_schedule():
+    """TAGGER_SCHEDULE from .env: ranking is on unless it is "off"/"none"/"0"."""
+    return (os.getenv("TAGGER_SCHEDULE") or "").strip().lower() not in {"off", "none", "0"}
+
+
+def _env_number(name):
+    try:
+        value = float(os.getenv(name) or 0)
+    except ValueError:
+        return None
+    return value if value > 0 else None
+
+
+def default_budget():
+    """Budget from TAGGER_BUDGET_MINUTES / TAGGER_BUDGET_REQUESTS, or None."""
+    minutes = _env_number("TAGGER_BUDGET_MINUTES")
+    requests = _env_number("TAGGER_BUDGET_REQUESTS")
+    if minutes is None and requests is None:
+        return None
+    return Budget(minutes * 60 if minutes else None, int(requests) if requests else None)
+
+
+def retry_spacing(failures):
+    """Seconds to wait before trying a file again after `failures` failed runs."""
+    return min(MAX_SPACING, BASE_SPACING * 2 ** (max(1, failures) - 1))
+
+
+class Budget:
+    """Per-run limits: wall-clock seconds and AcoustID requests (either may be None).
+
+    The clock starts with start(); requests are read from ACOUSTID's stats,
+    which run_tagger resets at the start of a run.
+    """
+
+    def __init__(self, seconds=None, requests=None):
+        self.seconds = seconds
+        self.requests = requests
+        self.started = time.monotonic()
+
+    def start(self):
+        self.started = time.monotonic()
+
+    def spent(self):
+        """Why the budget is used up ("30 minutes", "500 AcoustID requests"), or None."""
+        if self.seconds is not None and time.monotonic() - self.started >= self.seconds:
+            return f"{self.seconds / 60:g} minutes"
+        if self.requests is not None and ACOUSTID.stats["requests"] >= self.requests:
+            return f"{self.requests} AcoustID requests"
+        return None
+
+    def __str__(self):
+        limits = []
+        if self.seconds is not None:
+            limits.append(f"{self.seconds / 60:g} minutes")
+        if self.requests is not None:
+            limits.append(f"{self.requests} AcoustID requests")
+        return " / ".join(limits) or "unlimited"
+
+
+class Scheduler:
+    """Orders the files of one run (see the module comment) and keeps the
+    failure history up to date with record()."""
+
+    def __init__(self, cache=None, budget=None, window=WINDOW, rank=True):
+        self.cache = cache
+        self.budget = budget
+        self.window = window
+        self.rank = rank  # False: keep the given order, only enforce the budget
+        self.now = time.time()
+        self.keys = {}      # path -> content key when ranked (the key changes once tagged)
+        self.failures = {}  # content key -> failed runs so far
+        self.stopped = None  # why the budget stopped the run
+        self.stats = dict.fromkeys(TIERS + ("deferred", "left"), 0)
+
+    def _score(self, path):
+        """(tier, cached) for one file, or None if it is not due for a retry yet."""
+        has_artist, has_title = read_tag_state(path)
+        if has_artist and has_title:
+            return "tagged", False  # tag_file skips it; costs nothing
+        if self.cache is None:
+            return ("other" if has_artist or has_title else "untagged"), False
+        key = self.keys[str(path)] = content_key(path)
+        retry = self.cache.get_retry(key)
+        if retry is not None:
+            failures, next_try = retry
+            if next_try > self.now:
+                return None
+            self.failures[key] = failures
+            return "retry", False
+        cached = bool(self.cache.get_lookup(key)) or self.cache.get_fingerprint(key) is not None
+        if not (has_artist or has_title):
+            return "untagged", cached
+        return ("likely" if cached else "other"), cached
+
+    def _rank(self, paths):
+        """(files in order, due retries) for one window of files."""
+        scored, folders, hinted = [], {}, set()
+        for index, path in enumerate(paths):
+            try:
+                score = self._score(path)
+            except OSError:
+                score = ("other", False)  # let tag_file report it
+            if score is None:
+                self.stats["deferred"] += 1
+                self.keys.pop(str(path), None)
+                continue
+            tier, cached = score
+            folder = folders.setdefault(Path(path).parent, len(folders))
+            if cached:
+                hinted.add(folder)
+            scored.append((tier, cached, folder, index, path))
+
+        ranked, retries = [], []
+        for tier, cached, folder, index, path in scored:
+            if tier == "other" and folder in hinted:
+                tier = "likely"  # a sibling's lookup will resolve the album
+            if tier == "retry":
+                key = self.keys[str(path)]
+                retries.append((self.failures[key], folder, index, path))
+            else:
+                order = TIERS.index(tier) if tier in TIERS else -1
+                ranked.append((order, not cached, folder, index, path))
+            if tier in TIERS:
+                self.stats[tier] += 1
+        ranked.sort(key=lambda item: item[:4])
+        return [item[-1] for item in ranked], retries
+
+    def _admit(self, remaining):
+        """False (and the run stops) once the budget is spent."""
+        if self.budget is None:
+            return True
+        reason = self.budget.spent()
+        if reason is None:
+            return True
+        self.stopped = reason
+        self.stats["left"] = remaining
+        return False
+
+    def order(self, paths):
+        """Yield `paths` most fixable first, leaving out files whose retry is
+        not due, until the budget is spent."""
+        if not self.rank:
+            for path in paths:
+                if not self._admit(None):
+                    return
+                yield path
+            return
+        whole = hasattr(paths, "__len__")
+        paths = iter(paths)
+        retries = []
+        while True:
+            window = list(paths if whole else islice(paths, self.window))
+            if not window:
+                break
+            ranked, due = self._rank(window)
+            retries.extend(due)
+            for i, path in enumerate(ranked):
+                # Streamed, the rest of the stream is still unknown.
+                if not self._admit(len(ranked) - i + len(retries) if whole else None):
+                    return
+                yield path
+            if whole:
+                break
+        retries.sort(key=lambda item: item[:3])
+        for i, (_, _, _, path) in enumerate(retries):
+            if not self._admit(len(retries) - i):
+                return
+            yield path
+
+    def relocate(self, path, new_path):
+        """`path` was moved to `new_path` (temp-folder runs) before it was tagged."""
+        key = self.keys.pop(str(path), None)
+        if key is not None:
+            self.keys[str(new_path)] = key
+
+    def record(self, record):
+        """Update the failure history with a file's result (see tag_file)."""
+        key = self.keys.pop(record["path"], None)
+        if key is None or self.cache is None:
+            return
+        if record["status"] == "no_match" or (record["status"] == "failed"
+                                             and record.get("undecodable")):
+            failures = self.failures.get(key, 0) + 1
+            self.cache.put_retry(key, failures, time.time() + retry_spacing(failures))
+        elif record["status"] in FIXED and key in self.failures:
+            self.cache.clear_retry(key)
+
+    def export_metrics(self, metrics=METRICS):
+        for tier, count in self.stats.items():
+            if count is not None:
+                metrics.inc("tagger_schedule_files_total", count, tier=tier)
+
+    def summary(self):
+        s = self.stats
+        line = (
+            f"Scheduler: {s['untagged']} untagged, {s['likely']} likely quick hits, "
+            f"{s['other']} other, {s['retry']} retries; {s['deferred']} failed before "
+            f"and not due yet"
+        )
+        if not self.rank:
+            line = "Scheduler: files taken in scan order"
+        if self.stopped:
+            left = "the remaining files" if s["left"] is None else f"{s['left']} files"
+            line += f". Budget of {self.stopped} reached: {left} left for the next run"
+        return line
@@ -0,0 +1,236 @@
+import gzip
+import json
+import threading
+from urllib.parse import urlencode
+
+from core.ratelimit import RETRY_STATUSES, ThrottledError, TransientError, parse_retry_after
+
+# ---------------------------------------------------------------------------
+# Thin HTTP clients for AcoustID and MusicBrainz
+#
+# pyacoustid and musicbrainzngs hide the HTTP status and headers (and
+# musicbrainzngs retries 503s on its own schedule), so the rate limiter could
+# not honor Retry-After. These make the same requests themselves and return
+# the same data structures, raising ThrottledError / TransientError for
+# responses worth retrying. Endpoints follow acoustid.set_base_url() and
+# musicbrainzngs.set_hostname(), so both can point at a local fake server.
+#
+# requests, acoustid and musicbrainzngs are imported on first use.
+# ---------------------------------------------------------------------------
+
+TIMEOUT = 30
+ACOUSTID_RATE_LIMIT_CODE = 14  # "too many requests"
+DEFAULT_META = ("recordings",)  # acoustid.DEFAULT_META
+
+_local = threading.local()
+
+
+def _session():
+    """One keep-alive requests.Session per thread."""
+    session = getattr(_local, "session", None)
+    if session is None:
+        import requests
+        session = _local.session = requests.Session()
+    return session
+
+
+def check_retry(status, retry_after, service):
+    """Raise ThrottledError / TransientError for responses worth retrying."""
+    if status in (429, 503):
+        raise ThrottledError(
+            f"{service} throttled (HTTP {status})", parse_retry_after(retry_after)
+        )
+    if status in RETRY_STATUSES:
+        raise TransientError(f"{service} HTTP {status}")
+
+
+# -- AcoustID -----------------------------------------------------------------
+def acoustid_lookup_url():
+    import acoustid
+    return acoustid.API_BASE_URL + "lookup"
+
+
+def acoustid_lookup_body(api_key, fingerprint, duration, meta=DEFAULT_META):
+    """Form body (uncompressed) for a single-fingerprint lookup."""
+    if isinstance(fingerprint, bytes):
+        fingerprint = fingerprint.decode("ascii")
+    return urlencode({
+        "format": "json",
+        "client": api_key,
+        "duration": int(duration),
+        "fingerprint": fingerprint,
+        "meta": " ".join(meta),
+    }).encode()
+
+
+ACOUSTID_POST_HEADERS = {
+    "Content-Type": "application/x-www-form-urlencoded",
+    "Content-Encoding": "gzip",
+}
+
+
+def parse_acoustid_response(status, retry_after, body):
+    """Turn an AcoustID HTTP response into parsed JSON, or raise."""
+    import acoustid
+    check_retry(status, retry_after, "AcoustID")
+    try:
+        data = json.loads(body)
+    except ValueError:
+        raise acoustid.WebServiceError("response is not valid JSON")
+    error = data.get("error") if isinstance(data, dict) else None
+    if isinstance(error, dict) and error.get("code") == ACOUSTID_RATE_LIMIT_CODE:
+        raise ThrottledError(f"AcoustID rate limit: {error.get('message')}")
+    return data
+
+
+def acoustid_lookup(api_key, fingerprint, duration, meta=DEFAULT_META):
+    """POST a fingerprint lookup; returns the parsed JSON like acoustid.lookup()."""
+    import requests
+    body = acoustid_lookup_body(api_key, fingerprint, duration, meta)
+    try:
+        response = _session().post(
+            acoustid_lookup_url(),
+            data=gzip.compress(body),
+            headers=ACOUSTID_POST_HEADERS,
+            timeout=TIMEOUT,
+        )
+    except requests.RequestException as e:
+        raise TransientError(f"AcoustID request failed: {e}")
+    return parse_acoustid_response(
+        response.status_code, response.headers.get("Retry-After"), response.content
+    )
+
+
+def acoustid_batch_body(api_key, items, meta=DEFAULT_META):
+    """Form body for a multi-fingerprint lookup; `items` are (duration, fingerprint).
+
+    Entries are numbered fingerprint.1/duration.1, ... and the service echoes
+    the number back as "index" in the response.
+    """
+    params = {"format": "json", "client": api_key, "meta": " ".join(meta)}
+    for n, (duration, fingerprint) in enumerate(items, start=1):
+        if isinstance(fingerprint, bytes):
+            fingerprint = fingerprint.decode("ascii")
+        params[f"duration.{n}"] = int(duration)
+        params[f"fingerprint.{n}"] = fingerprint
+    return urlencode(params).encode()
+
+
+def split_batch_response(data, count):
+    """Split a batch response into `count` single-lookup style responses (in order)."""
+    if data.get("status") != "ok":
+        return [data] * count
+    by_index = {
+        str(entry.get("index")): {"status": "ok", "results": entry.get("results", [])}
+        for entry in data.get("fingerprints", [])
+    }
+    empty = {"status": "ok", "results": []}
+    return [by_index.get(str(n), empty) for n in range(1, count + 1)]
+
+
+def acoustid_lookup_batch(api_key, items, meta=DEFAULT_META):
+    """Look up several (duration, fingerprint) pairs in one POST.
+
+    Returns one parsed response per item, each shaped like acoustid.lookup()'s.
+    """
+    import requests
+    body = acoustid_batch_body(api_key, items, meta)
+    try:
+        response = _session().post(
+            acoustid_lookup_url(),
+            data=gzip.compress(body),
+            headers=ACOUSTID_POST_HEADERS,
+            timeout=TIMEOUT,
+        )
+    except requests.RequestException as e:
+        raise TransientError(f"AcoustID request failed: {e}")
+    data = parse_acoustid_response(
+        response.status_code, response.headers.get("Retry-After"), response.content
+    )
+    return split_batch_response(data, len(items))
+
+
+# -- MusicBrainz --------------------------------------------------------------
+def _ws_root():
+    import musicbrainzngs
+    mb = musicbrainzngs.musicbrainz
+    scheme = "https" if mb.https else "http"
+    return f"{scheme}://{mb.hostname}/ws/2"
+
+
+def musicbrainz_url(entity, mbid, includes=()):
+    url = f"{_ws_root()}/{entity}/{mbid}"
+    if includes:
+        url += "?" + urlencode({"inc": " ".join(includes)})
+    return url
+
+
+def search_url(entity, query, limit):
+    return f"{_ws_root()}/{entity}?" + urlencode({"query": query, "limit": limit})
+
+
+def _phrase(text):
+    """A quoted Lucene phrase for a MusicBrainz search query."""
+    return '"' + text.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def recording_url(rid, includes=()):
+    return musicbrainz_url("recording", rid, includes)
+
+
+def user_agent():
+    import musicbrainzngs
+    return musicbrainzngs.musicbrainz._useragent or "MetadataFixer"
+
+
+def parse_recording_response(status, retry_after, body, rid, entity="recording"):
+    """Turn a MusicBrainz lookup response into musicbrainzngs' dict, or raise."""
+    import musicbrainzngs
+    from musicbrainzngs import mbxml
+    check_retry(status, retry_after, "MusicBrainz")
+    if status != 200:
+        raise musicbrainzngs.ResponseError(f"MusicBrainz HTTP {status} for {entity} {rid}")
+    return mbxml.parse_message(body)
+
+
+def _get_entity(entity, mbid, includes):
+    import requests
+    try:
+        response = _session().get(
+            musicbrainz_url(entity, mbid, includes),
+            headers={"User-Agent": user_agent()},
+            timeout=TIMEOUT,
+        )
+    except requests.RequestException as e:
+        raise TransientError(f"MusicBrainz request failed: {e}")
+    return parse_recording_response(
+        response.status_code, response.headers.get("Retry-After"), response.content, mbid, entity
+    )
+
+
+def get_recording_by_id(rid, includes=()):
+    """Fetch a recording; returns the same dict as musicbrainzngs.get_recording_by_id()."""
+    return _get_entity("recording", rid, includes)
+
+
+def get_release_by_id(release_id, includes=()):
+    """Fetch a release; returns the same dict as musicbrainzngs.get_release_by_id()."""
+    return _get_entity("release", release_id, includes)
+
+
+def search_recordings(artist, title, limit=5):
+    """Search recordings by title and artist; returns the same dict as
+    musicbrainzngs.search_recordings(): "recording-list" entries carry "ext:score"."""
+    import requests
+    query = f"recording:{_phrase(title)} AND artist:{_phrase(artist)}"
+    try:
+        response = _session().get(
+            search_url("recording", query, limit),
+            headers={"User-Agent": user_agent()},
+            timeout=TIMEOUT,
+        )
+    except requests.RequestException as e:
+        raise TransientError(f"MusicBrainz request failed: {e}")
+    return parse_recording_response(
+        response.status_code, response.headers.get("Retry-After"), response.content, query
+    )
@@ -0,0 +1,314 @@
+import os
+import sys
+import json
+import sqlite3
+import hashlib
+import threading
+from pathlib import Path, PurePath
+
+from core.cache import content_key
+
+# ---------------------------------------------------------------------------
+# Sharded runs: resolve on many nodes, write the tags in one step
+#
+#   python -m core.shard resolve --root /music --shard 3/16 --out results/3.jsonl
+#   python -m core.shard merge results/ --out merged.sqlite3
+#   python -m core.shard apply merged.sqlite3 --root /music
+#
+# resolve  scans the library (through the node's tag index), keeps the
+#          untagged files of one shard and runs the tagger on them as a dry
+#          run: fingerprints, AcoustID and MusicBrainz, nothing written.
+#          Each file's result, including the tags it would get, goes to a
+#          result store.
+# merge    combines result stores; a later store wins for the same file.
+# apply    writes the tags from a (merged) store. Files whose content changed
+#          since they were resolved (content key, see core.cache) are
+#          skipped.
+#
+# Files are assigned to shards by a hash of their folder's path relative to
+# the root: every node computes the same partition whatever its mount
+# point, and an album never spans shards (album mode and duplicate
+# detection see it whole). Paths in the results are relative as well.
+#
+# A result store is a JSONL file (one per shard, easy to copy around) or an
+# SQLite database (.sqlite3 / .db), which several processes on one machine
+# can share. On network filesystems, use one JSONL file per node.
+# ---------------------------------------------------------------------------
+
+SQLITE_SUFFIXES = (".sqlite3", ".sqlite", ".db")
+APPLIED = ("tagged", "guessed", "fallback")  # statuses whose tags apply writes
+FIELDS = ("path", "key", "shard", "status", "mbid", "score", "tags")
+
+
+def parse_shard(value):
+    """"I/N" (0 <= I < N) -> (I, N)."""
+    index, sep, count = value.partition("/")
+    try:
+        index, count = int(index), int(count)
+    except ValueError:
+        raise ValueError(f"invalid shard {value!r} (use e.g. 3/16)")
+    if not sep or count < 1 or not 0 <= index < count:
+        raise ValueError(f"invalid shard {value!r} (use I/N with 0 <= I < N)")
+    return index, count
+
+
+def relative_path(path, root):
+    """`path` relative to `root`, with forward slashes (the same on every node)."""
+    return PurePath(os.path.relpath(os.path.abspath(path), os.path.abspath(root))).as_posix()
+
+
+def shard_of(path, root, count):
+    """The shard (0..count-1) of a file: a hash of its folder relative to `root`."""
+    folder = PurePath(relative_path(path, root)).parent.as_posix()
+    return int.from_bytes(hashlib.sha1(folder.encode("utf-8")).digest()[:8], "big") % count
+
+
+# ---------------------------------------------------------------------------
+# Result stores
+# ---------------------------------------------------------------------------
+class JsonlResults:
+    """One JSON result per line."""
+
+    def __init__(self, path, write=False):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._out = None
+        if write:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._out = open(self.path, "a", encoding="utf-8")
+
+    def add(self, result):
+        with self._lock:
+            self._out.write(json.dumps(result, ensure_ascii=False, sort_keys=True) + "\n")
+            self._out.flush()
+
+    def results(self):
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+    def close(self):
+        if self._out:
+            self._out.close()
+
+
+class SqliteResults:
+    """Results in an SQLite table, one row per file (the last result wins)."""
+
+    def __init__(self, path, write=False):
+        self.path = Path(path)
+        if write:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(path), timeout=60, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS results (path TEXT PRIMARY KEY, key TEXT, "
+            "shard INTEGER, status TEXT, mbid TEXT, score REAL, tags TEXT)"
+        )
+        self._db.commit()
+
+    def add(self, result):
+        row = [result.get(field) for field in FIELDS]
+        row[-1] = json.dumps(row[-1], ensure_ascii=False, sort_keys=True) if row[-1] else None
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?)", row)
+            self._db.commit()
+
+    def results(self):
+        with self._lock:
+            rows = self._db.execute(f"SELECT {', '.join(FIELDS)} FROM results ORDER BY path").fetchall()
+        for row in rows:
+            result = dict(zip(FIELDS, row))
+            result["tags"] = json.loads(result["tags"]) if result["tags"] else None
+            yield result
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def open_results(path, write=False):
+    """A result store: SQLite for .sqlite3/.sqlite/.db paths, else JSONL."""
+    kind = SqliteResults if Path(path).suffix.lower() in SQLITE_SUFFIXES else JsonlResults
+    return kind(path, write)
+
+
+# ---------------------------------------------------------------------------
+# resolve / merge / apply
+# ---------------------------------------------------------------------------
+def resolve_shard(root, index, count, out, api_key, logger, workers=None, cache=None,
+                  backend=None, batch_size=None, album_mode=None):
+    """Resolve the untagged files of shard `index` of `count` and store each
+    file's result in `out` (a path, see open_results). Returns (resolved, total)."""
+    from core.file_utils import iter_untagged
+    from core.tagger import run_tagger
+
+    files = [p for p in iter_untagged(root) if shard_of(p, root, count) == index]
+    logger.info(f"Shard {index}/{count}: {len(files)} untagged files under {root}")
+    if not files:
+        return 0, 0
+    store = open_results(out, write=True)
+
+    def on_result(record):
+        path = record["path"]
+        try:
+            key = content_key(path)
+        except OSError:
+            key = None
+        result = {field: record.get(field) for field in FIELDS}
+        result.update(path=relative_path(path, root), key=key, shard=index)
+        store.add(result)
+
+    try:
+        # A list, not a stream: the scheduler ranks the shard as a whole,
+        # as it would the whole library on one node.
+        return run_tagger(root, api_key, logger, workers=workers, cache=cache, files=files,
+                          on_result=on_result, dry_run=True, backend=backend,
+                          batch_size=batch_size, album_mode=album_mode)
+    finally:
+        store.close()
+
+
+def _store_paths(inputs):
+    for item in inputs:
+        item = Path(item)
+        if item.is_dir():
+            yield from sorted(
+                p for p in item.iterdir()
+                if p.suffix.lower() in SQLITE_SUFFIXES + (".jsonl",)
+            )
+        else:
+            yield item
+
+
+def merge_results(inputs, output):
+    """Merge result stores (files, or folders of them) into `output`; for a
+    file in several stores, the last one wins. Returns the number of files."""
+    merged = {}
+    for path in _store_paths(inputs):
+        store = open_results(path)
+        try:
+            for result in store.results():
+                merged[result["path"]] = result
+        finally:
+            store.close()
+    store = open_results(output, write=True)
+    try:
+        for path in sorted(merged):
+            store.add(merged[path])
+    finally:
+        store.close()
+    return len(merged)
+
+
+def apply_results(store_path, root, logger, dry_run=False):
+    """Write the tags from a result store to the files under `root`.
+
+    Returns counts: written, changed (content differs from when it was
+    resolved), missing, unresolved (no tags to write), failed.
+    """
+    from core.tagwriter import WRITER, write_tags
+
+    counts = dict.fromkeys(("written", "changed", "missing", "unresolved", "failed"), 0)
+    WRITER.reset_stats()
+    store = open_results(store_path)
+    try:
+        for result in store.results():
+            if result["status"] not in APPLIED or not result["tags"]:
+                counts["unresolved"] += 1
+                continue
+            path = Path(root) / result["path"]
+            try:
+                if content_key(path) != result["key"]:
+                    logger.warning(f"Changed since it was resolved, skipping: {path}")
+                    counts["changed"] += 1
+                    continue
+                if not dry_run:
+                    write_tags(path, result["tags"])
+                counts["written"] += 1
+            except FileNotFoundError:
+                counts["missing"] += 1
+            except Exception as e:
+                logger.error(f"Could not write tags to {path}: {e}")
+                counts["failed"] += 1
+    finally:
+        store.close()
+    if not dry_run:
+        logger.info(WRITER.summary())
+    return counts
+
+
+# ---------------------------------------------------------------------------
+# CLI
+# ---------------------------------------------------------------------------
+def main(argv=None):
+    import argparse
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(
+        prog="python -m core.shard",
+        description="Resolve a library in shards on several nodes, then apply the tags once.",
+    )
+    sub = parser.add_subparsers(dest="command", required=True)
+    resolve = sub.add_parser("resolve", help="fingerprint and look up one shard (writes no tags)")
+    resolve.add_argument("--root", default=None, help="music folder (default: ROOT_FOLDER)")
+    resolve.add_argument("--shard", required=True, help="I/N: shard I (0-based) of N")
+    resolve.add_argument("--out", required=True, help="result store (.jsonl, or .sqlite3 to share)")
+    resolve.add_argument("--workers", type=int, default=None)
+    resolve.add_argument("--backend", choices=("threads", "async"), default=None)
+    resolve.add_argument("--batch-size", type=int, default=None)
+    resolve.add_argument("--album-mode", action="store_true", default=None)
+    merge = sub.add_parser("merge", help="combine result stores")
+    merge.add_argument("inputs", nargs="+", help="result stores, or folders of them")
+    merge.add_argument("--out", required=True, help="merged store (.jsonl or .sqlite3)")
+    apply = sub.add_parser("apply", help="write the tags from a result store")
+    apply.add_argument("store")
+    apply.add_argument("--root", default=None, help="music folder (default: ROOT_FOLDER)")
+    apply.add_argument("--dry-run", action="store_true", help="only check what would be written")
+    args = parser.parse_args(argv)
+
+    if args.command == "resolve":
+        try:
+            index, count = parse_shard(args.shard)
+        except ValueError as e:
+            parser.error(str(e))
+    if args.command == "merge":
+        print(f"Merged {merge_results(args.inputs, args.out)} results into {args.out}")
+        return 0
+
+    from core.file_utils import check_fpcalc, setup_logger
+    root = args.root or os.getenv("ROOT_FOLDER")
+    if not root or not os.path.isdir(root):
+        print("[MetadataFixer] Invalid or missing ROOT_FOLDER.")
+        return 1
+    logger = setup_logger()
+
+    if args.command == "apply":
+        counts = apply_results(args.store, root, logger, args.dry_run)
+        print(", ".join(f"{count} {name}" for name, count in counts.items()))
+        return 1 if counts["failed"] else 0
+
+    api_key = os.getenv("ACOUSTID_API_KEY")
+    if not api_key:
+        print("[MetadataFixer] ACOUSTID_API_KEY missing; aborting.")
+        return 1
+    check_fpcalc()
+    from core.cache import open_default_cache
+    cache = open_default_cache()
+    try:
+        resolved, total = resolve_shard(
+            root, index, count, args.out, api_key, logger, workers=args.workers, cache=cache,
+            backend=args.backend, batch_size=args.batch_size, album_mode=args.album_mode,
+        )
+    finally:
+        if cache:
+            cache.close()
+    print(f"Shard {index}/{count}: {resolved}/{total} files resolved into {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,63 @@
+import queue
+import threading
+
+# ---------------------------------------------------------------------------
+# Bounded hand-off between pipeline stages
+#
+# prefetch() runs a generator on its own thread and hands its items over
+# through a bounded queue, so a slow consumer holds the producer back
+# instead of letting it build up a list. The pipeline chains them:
+#
+#   walk the tree -> read tags / filter -> fingerprint pool -> lookups -> write
+#   (thread)         (thread)              (core.tagger)
+# ---------------------------------------------------------------------------
+
+DEFAULT_DEPTH = 256
+_END = object()
+
+
+def prefetch(iterable, maxsize=DEFAULT_DEPTH, name="prefetch"):
+    """Yield the items of `iterable`, produced ahead on a background thread.
+
+    At most `maxsize` items wait in between. An exception in the producer is
+    re-raised here. Closing the returned generator (or dropping it) stops
+    the producer and closes `iterable`.
+    """
+    items = queue.Queue(maxsize)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        error = None
+        try:
+            for item in iterable:
+                if not put((item, None)):
+                    break
+        except BaseException as e:
+            error = e
+        finally:
+            close = getattr(iterable, "close", None)
+            if close:
+                close()
+            put((_END, error))
+
+    thread = threading.Thread(target=produce, name=name, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item, error = items.get()
+            if item is _END:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        stop.set()
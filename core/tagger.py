@@ -1,15 +1,33 @@
 import os
 import time
-import subprocess
 import logging
 import traceback
-import acoustid
-import musicbrainzngs
-from mutagen.easyid3 import EasyID3
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-import re
-from tqdm import tqdm
-import logging as _logging
+from core.cache import RecordingMemo, content_key
+from core.ratelimit import ACOUSTID, MUSICBRAINZ, TransientError
+from core.metrics import METRICS
+
+# acoustid, musicbrainzngs and mutagen are imported where they are used, and
+# so are the tagging stages (core.services, core.fingerprint, core.formats,
+# core.tagwriter, core.heuristics, core.albums, core.mirror, core.duplicates,
+# core.scheduler), so importing this module (GUI/CLI start-up) stays cheap.
+
+# MusicBrainz recordings already fetched in this process, keyed by MBID.
+RECORDINGS = RecordingMemo()
+
+# AcoustID results at or below this score are ignored.
+MATCH_THRESHOLD = 0.6
+
+BACKENDS = ("threads", "async")
+
+# Fingerprints per AcoustID request on the threads backend.
+DEFAULT_BATCH_SIZE = 10
+
+# Files (skipped, failed and duplicates included) held back for one batch.
+MAX_BATCH_FILES = 200
 
 # ---------------------------------------------------------------------------
 # SETUP
@@ -17,106 +35,267 @@ import logging as _logging
 
 def setup_musicbrainz():
     """Initialize MusicBrainz user agent."""
+    import musicbrainzngs
     musicbrainzngs.set_useragent("MetadataFixer", "2.0", "https://musicbrainz.org")
-    _logging.getLogger("musicbrainzngs").setLevel(_logging.ERROR)
+    musicbrainzngs.set_rate_limit(False)  # core.ratelimit.MUSICBRAINZ does this now
+    logging.getLogger("musicbrainzngs").setLevel(logging.ERROR)
 
 def is_already_tagged(path):
-    """Check if the file already has artist and title."""
-    try:
-        song = EasyID3(path)
-        return all(k in song for k in ["artist", "title"])
-    except Exception:
+    """Check if the file already has artist and title (reads only the tag headers)."""
+    from core.formats import read_tag_state
+    has_artist, has_title = read_tag_state(path)
+    return has_artist and has_title
+
+def filename_tags(path, root=None):
+    """Guess artist/title (and album/track number) from the file's name and
+    folders below `root` (core.heuristics), however low the confidence, or None."""
+    from core.heuristics import guess_tags
+    tags, _ = guess_tags(path, root)
+    return tags
+
+def fallback_tag_from_filename(path, logger, dry_run=False, record=None, root=None):
+    """Tag from the file's name and folders (below the library `root`) if AcoustID fails."""
+    from core.tagwriter import write_tags
+    tags = filename_tags(path, root)
+    if tags is None:
+        if record is not None:
+            record["status"] = "no_match"
         return False
+    if not dry_run:
+        write_tags(path, tags)
+    if record is not None:
+        record.update(status="fallback", tags=tags)
+    logger.info(f"Fallback tagged from filename: {tags['artist']} - {tags['title']}")
+    return True
 
-def fallback_tag_from_filename(path, logger):
-    """Extract artist/title from filename if AcoustID fails."""
-    filename = Path(path).stem
-    parts = re.split(r"[-–_]", filename, maxsplit=1)
-    if len(parts) == 2:
-        artist, title = parts[0].strip(), parts[1].strip()
-        try:
-            song = EasyID3(path)
-        except Exception:
-            song = EasyID3()
-        song["artist"] = artist
-        song["title"] = title
-        song.save(path)
-        logger.info(f"Fallback tagged from filename: {artist} - {title}")
-        return True
-    return False
+def default_backend():
+    """Lookup backend: TAGGER_BACKEND in .env ("threads" or "async"), default "threads"."""
+    value = (os.getenv("TAGGER_BACKEND") or "").strip().lower()
+    return value if value in BACKENDS else "threads"
+
+def default_batch_size():
+    """AcoustID lookup batch size; TAGGER_ACOUSTID_BATCH in .env overrides it (1 = off)."""
+    value = os.getenv("TAGGER_ACOUSTID_BATCH", "").strip()
+    if value.isdigit() and int(value) > 0:
+        return int(value)
+    return DEFAULT_BATCH_SIZE
+
+def default_workers():
+    """Number of parallel fingerprint workers; TAGGER_WORKERS in .env overrides it."""
+    value = os.getenv("TAGGER_WORKERS", "").strip()
+    if value.isdigit() and int(value) > 0:
+        return int(value)
+    return min(8, os.cpu_count() or 1)
+
+def lookup_fingerprint(api_key, duration, fingerprint):
+    """Look up a fingerprint on AcoustID. Returns a list of (score, rid, title, artist)."""
+    import acoustid
+    from core import services
+    response = ACOUSTID.call(services.acoustid_lookup, api_key, fingerprint, duration)
+    return list(acoustid.parse_lookup_result(response))
+
+def lookup_fingerprints_batch(api_key, items):
+    """Look up several (duration, fingerprint) pairs in one AcoustID request.
+
+    Returns one list of (score, rid, title, artist) per item, in order.
+    """
+    import acoustid
+    from core import services
+    responses = ACOUSTID.call(services.acoustid_lookup_batch, api_key, items)
+    return [list(acoustid.parse_lookup_result(r)) for r in responses]
+
+RECORDING_INCLUDES = ["artists", "releases"]
+
+def _fetch_recording_remote(rid):
+    from core import services
+    return MUSICBRAINZ.call(services.get_recording_by_id, rid, includes=RECORDING_INCLUDES)
+
+def fetch_recording(rid, cache=None):
+    """Fetch a MusicBrainz recording with artists and releases.
+
+    Answered by the local mirror (core.mirror) when the run has one and it
+    knows the MBID. Otherwise memoized per MBID (RECORDINGS, then the
+    persistent `cache`), so album tracks and duplicate rips resolving to the
+    same recording cost one request.
+    """
+    from core.mirror import LOCAL
+    payload = LOCAL.recording(rid, RECORDING_INCLUDES)
+    if payload is not None:
+        return payload
+    return RECORDINGS.get(rid, _fetch_recording_remote, cache)
+
+def get_fingerprint(path, cache=None, key=None):
+    """Fingerprint a file, reusing the cached fingerprint if its content is unchanged."""
+    from core.fingerprint import fingerprint_file
+    if cache is None:
+        return fingerprint_file(path)
+    key = key or content_key(path)
+    cached = cache.get_fingerprint(key)
+    if cached:
+        METRICS.inc("tagger_cache_hits_total", kind="fingerprint")
+        return cached
+    METRICS.inc("tagger_cache_misses_total", kind="fingerprint")
+    duration, fp = fingerprint_file(path)
+    cache.put_fingerprint(key, duration, fp)
+    return duration, fp
 
 def acoustid_match_silent(api_key, path):
-    """Wrapper around acoustid.match that hides fpcalc.exe console windows on Windows."""
-    import subprocess
-    startupinfo = None
-    creationflags = 0
-    if hasattr(subprocess, "STARTF_USESHOWWINDOW"):
-        startupinfo = subprocess.STARTUPINFO()
-        startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-        creationflags = subprocess.CREATE_NO_WINDOW
-
-    old_popen = subprocess.Popen
-    def silent_popen(*args, **kwargs):
-        kwargs.setdefault("startupinfo", startupinfo)
-        kwargs.setdefault("creationflags", creationflags)
-        return old_popen(*args, **kwargs)
-
-    subprocess.Popen = silent_popen
+    """Fingerprint a file (see core.fingerprint) and look it up on AcoustID."""
+    from core.fingerprint import fingerprint_file
+    duration, fp = fingerprint_file(path)
+    return lookup_fingerprint(api_key, duration, fp)
+
+
+def tags_from_recording(info, title=None):
+    """Build EasyID3 tags from a MusicBrainz recording (the "recording" dict)."""
+    from core.albums import credit_names
+    tags = {"title": info.get("title", title or "")}
+    tags["artist"] = credit_names(info.get("artist-credit", []))
+
+    # musicbrainzngs calls the list "release-list"
+    releases = info.get("release-list") or info.get("releases")
+    if releases:
+        tags["album"] = releases[0].get("title", "")
+        tags["date"] = releases[0].get("date", "")
+    return tags
+
+@contextmanager
+def _timed(timings, stage):
+    """Add the time spent in the block to timings[stage] (seconds) and to the
+    tagger_stage_seconds histogram."""
+    start = time.perf_counter()
     try:
-        return acoustid.match(api_key, path)
+        yield
     finally:
-        subprocess.Popen = old_popen
+        elapsed = time.perf_counter() - start
+        timings[stage] = timings.get(stage, 0.0) + elapsed
+        METRICS.observe("tagger_stage_seconds", elapsed, stage=stage)
+
+def _undecodable(error):
+    """True if fingerprinting failed because of the file itself (fpcalc or the
+    decoder rejects it), so it would fail the same way again. Network errors,
+    a missing fpcalc or a missing Chromaprint backend are not the file's fault."""
+    import acoustid
+    return (
+        isinstance(error, acoustid.FingerprintGenerationError)
+        and not isinstance(error, acoustid.NoBackendError)
+        and not isinstance(error.__context__, OSError)  # fpcalc could not be run
+    )
 
+def new_record(path):
+    """Per-file result: status, matched MBID and score, tags and stage timings."""
+    return {
+        "path": str(path),
+        "status": None,
+        "mbid": None,
+        "score": None,
+        "tags": None,
+        "timings": {},
+    }
 
-def tag_file(path, api_key, logger):
-    """Tag a single MP3 file using AcoustID + MusicBrainz."""
+def tag_file(path, api_key, logger, fingerprint=None, cache=None, record=None, dry_run=False,
+             lookup=None, journal=None, albums=None, root=None):
+    """Tag a single audio file using AcoustID + MusicBrainz.
+
+    `fingerprint` is an optional zero-argument callable returning
+    (duration, fingerprint), e.g. the result of a fingerprint-pool future.
+    Without it, the file is fingerprinted inline. `lookup` is the same idea one stage
+    later: a callable returning the AcoustID results (async backend). With a `cache` (core.cache.LookupCache),
+    fingerprints, AcoustID results and MusicBrainz recordings are reused
+    from earlier runs.
+
+    `record` (see new_record) is filled in with the outcome. Its status is
+    one of skipped, tagged, fallback, no_match, failed or error; a failed
+    record's "undecodable" says whether the file itself could not be
+    fingerprinted (as opposed to a lookup that failed). With
+    `dry_run`, matches are resolved but nothing is written to the file.
+    Progress is recorded in `journal` (core.journal.RunJournal), if given.
+    With `albums` (core.albums.AlbumResolver), tags come from whole releases
+    when possible, including track numbers. Without a match, the file is
+    tagged from its name and the folders below `root` (the library root).
+    """
+    from core.tagwriter import write_tags
+    if record is None:
+        record = new_record(path)
+    timings = record["timings"]
+    started = time.perf_counter()
     try:
         if is_already_tagged(path):
             logger.info(f"Skipping already tagged file: {path}")
+            record["status"] = "skipped"
             return True
 
-        # fingerprint lookup
+        key = content_key(path) if cache else None
+        results = None
+        cached = False
         try:
-            results = acoustid_match_silent(api_key, path)
+            # Results resolved ahead of time (batched/async lookup stages)
+            # come first; they are already in the cache, too.
+            if lookup is not None:
+                with _timed(timings, "acoustid"):
+                    results = lookup()
+            if results is None and cache:
+                results = cache.get_lookup(key)
+                cached = results is not None
+                if cached:
+                    logger.info(f"Using cached AcoustID results for: {path}")
+            if results is None:
+                # fingerprint lookup
+                with _timed(timings, "fingerprint"):
+                    if fingerprint is None:
+                        duration, fp = get_fingerprint(path, cache, key)
+                    else:
+                        duration, fp = fingerprint()
+                if journal:
+                    journal.mark(path, "fingerprinted")
+                with _timed(timings, "acoustid"):
+                    results = lookup_fingerprint(api_key, duration, fp)
         except Exception as e:
             logger.warning(f"Fingerprinting failed for {path}: {e}")
-            time.sleep(1)
+            record.update(status="failed", error=str(e), undecodable=_undecodable(e))
             return False
 
-        time.sleep(1.2)  # respect rate limit
+        if cache:
+            METRICS.inc("tagger_cache_hits_total" if cached else "tagger_cache_misses_total",
+                        kind="lookup")
+            if not cached:
+                cache.put_lookup(key, results)
+        if journal:
+            journal.mark(path, "looked_up")
+
+        hit = albums.match(results, MATCH_THRESHOLD, path) if albums else None
+        if hit:
+            score, rid, tags = hit
+            if not dry_run:
+                with _timed(timings, "write"):
+                    write_tags(path, tags)
+            record.update(status="tagged", mbid=rid, score=score, tags=tags)
+            logger.info(f"Successfully tagged from release {tags.get('album', '?')!r}: {path}")
+            return True
 
         for score, rid, title, artist in results:
             try:
-                if score > 0.6:
-                    track = musicbrainzngs.get_recording_by_id(rid, includes=["artists", "releases"])
+                if score > MATCH_THRESHOLD:
                     try:
-                        track = musicbrainzngs.get_recording_by_id(rid, includes=["artists", "releases"])
-                    except musicbrainzngs.NetworkError as ne:
-                        logger.warning(f"Network error on {path}: {ne}. Retrying after 3s...")
-                        time.sleep(3)
+                        with _timed(timings, "musicbrainz"):
+                            track = fetch_recording(rid, cache)
+                    except TransientError as ne:
+                        logger.warning(f"Network error on {path}: {ne}. Giving up on {rid}.")
                         continue
 
-                    info = track.get("recording", {})
-                    try:
-                        song = EasyID3(path)
-                    except Exception:
-                        song = EasyID3()
-                        song.save(path)
-                        song = EasyID3(path)
-                    song["title"] = info.get("title", title or "")
-                    credits = info.get("artist-credit", [])
-                    names = []
-                    for a in credits:
-                        if isinstance(a, dict) and "artist" in a:
-                            names.append(a["artist"].get("name", ""))
-                        elif isinstance(a, str):
-                            names.append(a)
-                    song["artist"] = ", ".join(filter(None, names))
-
-                    if info.get("releases"):
-                        song["album"] = info["releases"][0].get("title", "")
-                        song["date"] = info["releases"][0].get("date", "")
-                    song.save()
+                    recording = track.get("recording", {})
+                    tags = None
+                    if albums:
+                        try:
+                            with _timed(timings, "musicbrainz"):
+                                tags = albums.learn(recording, path)
+                        except Exception as e3:
+                            logger.warning(f"Could not fetch the release for {path}: {e3}")
+                    tags = tags or tags_from_recording(recording, title)
+                    if not dry_run:
+                        with _timed(timings, "write"):
+                            write_tags(path, tags)
+                    record.update(status="tagged", mbid=rid, score=score, tags=tags)
                     logger.info(f"Successfully tagged: {path}")
                     return True
             except Exception as e2:
@@ -125,35 +304,437 @@ def tag_file(path, api_key, logger):
 
         # no good matches
         logger.warning(f"No good matches for: {path}")
-        return fallback_tag_from_filename(path, logger)
+        return fallback_tag_from_filename(path, logger, dry_run, record, root)
+
+    except Exception as e:
+        logger.error(f"Unhandled error tagging {path}: {e}")
+        traceback.print_exc()
+        record.update(status="error", error=str(e))
+        return False
+    finally:
+        timings["total"] = time.perf_counter() - started
+        METRICS.inc("tagger_files_total", status=record["status"])
 
+def tag_from_guess(path, guess, api_key, logger, cache=None, record=None, dry_run=False,
+                   journal=None, albums=None, root=None):
+    """Tag a file whose name identifies it (see core.heuristics.FilenameMatcher).
+
+    `guess` is the (tags, confidence) pair. One MusicBrainz search confirms
+    it and supplies the MBID and release; without a confirmation the guessed
+    tags are written as they are if the confidence reaches
+    DIRECT_CONFIDENCE, and otherwise the file goes through tag_file
+    (fingerprint + AcoustID) after all. Record statuses are those of
+    tag_file, plus "guessed"; record["heuristic"] says which way it went
+    (confirmed, guessed or unconfirmed).
+    """
+    from core import services
+    from core.heuristics import DIRECT_CONFIDENCE, best_search_hit
+    from core.tagwriter import write_tags
+    if record is None:
+        record = new_record(path)
+    tags, confidence = guess
+    timings = record["timings"]
+    started = time.perf_counter()
+    try:
+        try:
+            with _timed(timings, "musicbrainz"):
+                found = MUSICBRAINZ.call(services.search_recordings, tags["artist"], tags["title"])
+            hit = best_search_hit(found.get("recording-list", []), tags)
+        except TransientError as e:
+            logger.warning(f"MusicBrainz search failed for {path}: {e}")
+            hit = None
+
+        if hit:
+            matched = None
+            if albums:
+                try:
+                    with _timed(timings, "musicbrainz"):
+                        matched = albums.learn(hit, path)
+                except Exception as e:
+                    logger.warning(f"Could not fetch the release for {path}: {e}")
+            if matched is None:
+                matched = tags_from_recording(hit)
+                for key in ("album", "tracknumber"):
+                    if key in tags:
+                        matched[key] = tags[key]  # the folder's album, not the first release
+            status, rid, tags = "tagged", hit["id"], matched
+            outcome = "confirmed"
+        elif confidence >= DIRECT_CONFIDENCE:
+            status, rid = "guessed", None
+            outcome = "guessed"
+        else:
+            record["heuristic"] = "unconfirmed"
+            return tag_file(path, api_key, logger, cache=cache, record=record, dry_run=dry_run,
+                            journal=journal, albums=albums, root=root)
+        if not dry_run:
+            with _timed(timings, "write"):
+                write_tags(path, tags)
+        record.update(status=status, mbid=rid, score=confidence, tags=tags, heuristic=outcome)
+        logger.info(f"Tagged from its name ({outcome}): {tags['artist']} - {tags['title']}: {path}")
+        return True
     except Exception as e:
         logger.error(f"Unhandled error tagging {path}: {e}")
         traceback.print_exc()
+        record.update(status="error", error=str(e))
         return False
+    finally:
+        if record.get("heuristic") != "unconfirmed":
+            timings["total"] = time.perf_counter() - started
+            METRICS.inc("tagger_files_total", status=record["status"])
+
+def _fingerprint_stage(path, cache=None):
+    """Pool worker: fingerprint a file unless tag_file is going to skip it anyway."""
+    if is_already_tagged(path):
+        return None
+    key = content_key(path) if cache else None
+    if cache and cache.get_lookup(key) is not None:
+        return None
+    return get_fingerprint(path, cache, key)
+
+def iter_fingerprinted(paths, workers, cache=None):
+    """Yield (path, fingerprint) pairs in input order, fingerprinting ahead in a pool.
+
+    `fingerprint` is None when workers <= 1 (tag_file fingerprints inline),
+    otherwise the `result` method of the pool future. At most `workers * 2`
+    files are fingerprinted ahead of the consumer, so memory stays bounded
+    and the rate-limited lookups in the consumer set the overall pace.
+    """
+    if workers <= 1:
+        for path in paths:
+            yield path, None
+        return
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="fpcalc") as pool:
+        pending = deque()
+        try:
+            for path in paths:
+                pending.append((path, pool.submit(_fingerprint_stage, str(path), cache)))
+                if len(pending) >= workers * 2:
+                    done_path, future = pending.popleft()
+                    yield done_path, future.result
+            while pending:
+                done_path, future = pending.popleft()
+                yield done_path, future.result
+        finally:
+            for _, future in pending:
+                future.cancel()
+
+def _deferred(value=None, error=None):
+    """A zero-argument callable returning `value` or raising `error` (for tag_file)."""
+    def result():
+        if error is not None:
+            raise error
+        return value
+    return result
+
+def iter_batched_lookups(paths, api_key, workers, cache=None, batch_size=DEFAULT_BATCH_SIZE,
+                         duplicates=None):
+    """Yield (path, lookup) pairs in input order, looking fingerprints up in batches.
+
+    Files are fingerprinted first (on the worker pool), then every
+    `batch_size` fingerprints go to AcoustID in one request and the results
+    are mapped back to their files. `lookup` is None for files tag_file will
+    skip anyway (already tagged, or results cached). Such files, and files
+    that could not be fingerprinted, pass straight through unless earlier
+    files are still waiting for their batch; a batch is sent early once
+    MAX_BATCH_FILES files in all are waiting.
+
+    With `duplicates` (a core.duplicates.DuplicateIndex), a file whose
+    fingerprint matches an earlier file's reuses that file's results instead
+    of being sent again. Results are kept for as many recent files as the
+    index keeps leaders.
+    """
+    batch = []                # (path, (duration, fp) or None, fingerprint error, duplicate of)
+    resolved = OrderedDict()  # path -> AcoustID results, for files others may duplicate
+    keep = (duplicates.max_leaders or float("inf")) if duplicates is not None else 0
+    pending = 0
+
+    def flush():
+        looked_up = {str(batch[i][0]) for i in range(len(batch)) if batch[i][3] is None}
+        wanted = [
+            i for i, (_, fp, error, leader) in enumerate(batch)
+            if fp is not None and error is None
+            and (leader is None or (leader not in resolved and leader not in looked_up))
+        ]
+        results, batch_error = {}, None
+        if wanted:
+            try:
+                lists = lookup_fingerprints_batch(api_key, [batch[i][1] for i in wanted])
+                results = dict(zip(wanted, lists))
+                if keep:
+                    for i, found in results.items():
+                        resolved[str(batch[i][0])] = found
+                    while len(resolved) > keep:
+                        resolved.popitem(last=False)
+            except Exception as e:
+                batch_error = e
+        for i, (path, fp, error, leader) in enumerate(batch):
+            if i not in results and leader in resolved:
+                resolved.move_to_end(leader)
+                results[i] = resolved[leader]
+                METRICS.inc("tagger_duplicates_total")
+        if cache:
+            # Stored straight away, so a crash before tag_file gets to them
+            # doesn't cost the lookups (see core.journal).
+            for i, found in results.items():
+                cache.put_lookup(content_key(batch[i][0]), found)
+        for i, (path, fp, error, _) in enumerate(batch):
+            if error is not None:
+                yield path, _deferred(error=error)
+            elif fp is None:
+                yield path, None
+            elif i in results:
+                yield path, _deferred(results[i])
+            else:
+                yield path, _deferred(None, batch_error)
+        batch.clear()
+
+    for path, fingerprint in iter_fingerprinted(paths, workers, cache):
+        fp = error = leader = None
+        try:
+            fp = fingerprint() if fingerprint else _fingerprint_stage(str(path), cache)
+        except Exception as e:
+            error = e
+        if fp is not None and duplicates is not None:
+            match = duplicates.add(str(path), *fp)
+            leader = match[0] if match else None
+        if fp is None and not batch:
+            # Nothing to look up, and no file ahead of it waiting for a batch.
+            yield path, (_deferred(error=error) if error is not None else None)
+            continue
+        batch.append((path, fp, error, leader))
+        if fp is not None and leader is None:
+            pending += 1
+        if pending >= batch_size or len(batch) >= MAX_BATCH_FILES:
+            yield from flush()
+            pending = 0
+    yield from flush()
+
+def _divert_confident(paths, matcher, confident):
+    """Yield the paths that need fingerprinting; those whose names identify
+    them go to `confident` as (path, None, None, guess) instead."""
+    for path in paths:
+        guess = matcher.confident(path)
+        if guess is None:
+            yield path
+        else:
+            confident.append((path, None, None, guess))
+
+def _with_confident(stream, confident):
+    """Merge the lookup stream with the files diverted to `confident`, as
+    (path, fingerprint, lookup, guess). Diverted files come first: they are
+    ready as soon as they are found, while the stream waits on lookups."""
+    for path, fingerprint, lookup in stream:
+        while confident:
+            yield confident.popleft()
+        yield path, fingerprint, lookup, None
+    while confident:
+        yield confident.popleft()
+
+def _staged(pairs, scheduler=None):
+    """The paths of `stage`'s (origin, path) pairs; the scheduler follows moved files."""
+    for origin, path in pairs:
+        if scheduler and path != origin:
+            scheduler.relocate(origin, path)
+        yield path
+
+@contextmanager
+def _local_mirror(mirror, logger, close=False):
+    """Answer MusicBrainz lookups from `mirror` (may be None) inside the block."""
+    from core.mirror import LOCAL
+    LOCAL.use(mirror)
+    try:
+        yield mirror
+    finally:
+        if mirror is not None:
+            logger.info(LOCAL.summary())
+            METRICS.inc("tagger_cache_hits_total", LOCAL.stats["hits"], kind="mirror")
+            METRICS.inc("tagger_cache_misses_total", LOCAL.stats["misses"], kind="mirror")
+        LOCAL.use(None)
+        if close and mirror is not None:
+            mirror.close()
+
+def run_tagger(folder, api_key, logger, progress_callback=None, workers=None, cache=None,
+               files=None, on_result=None, dry_run=False, backend=None, batch_size=None,
+               journal=None, expected=None, album_mode=None, mirror=None, heuristics=None,
+               schedule=None, budget=None, stage=None):
+    """Run tagging on all audio files inside given folder, reporting progress if callback provided.
+
+    Fingerprinting runs on `workers` threads (default: default_workers()) while the
+    AcoustID/MusicBrainz lookups stay sequential in this thread, so the
+    per-file results are the same as with workers=1. `cache` is an optional
+    core.cache.LookupCache shared by both stages. Pass `files` when the
+    caller already knows which files to tag, to skip walking `folder` again;
+    it may be a generator that is still discovering files (e.g. fed by a
+    streaming scan), in which case `expected` is a callable returning the
+    current estimate of how many there will be, for progress reporting.
+    `on_result` is called with each file's record (see tag_file); `dry_run`
+    resolves matches without writing tags.
+
+    `backend="async"` (or TAGGER_BACKEND=async) switches the lookup stage to
+    core.async_lookup, which keeps many rate-limited requests in flight over
+    pooled connections; tagging and writing still happen here, in order.
+    On the threads backend, AcoustID lookups are sent `batch_size`
+    fingerprints per request (default: default_batch_size(); 1 = one by one).
+    Each file's progress goes to `journal` (core.journal.RunJournal), if given.
+    Batched runs also group duplicate audio (core.duplicates) and write the
+    groups to TAGGER_DUPLICATES (default logs/duplicates.json).
+    `album_mode` (default: TAGGER_ALBUM_MODE) tags whole albums from one
+    release lookup each (core.albums).
+    `mirror` (a core.mirror.MusicBrainzMirror; default: TAGGER_MB_MIRROR)
+    answers recording and release lookups locally before MusicBrainz is asked.
+    Files whose names identify them with at least `heuristics` confidence
+    (default: TAGGER_HEURISTIC) skip fingerprinting and AcoustID and are
+    tagged through tag_from_guess, ahead of the files still in the lookup
+    stages.
+    With `schedule` (default: TAGGER_SCHEDULE, on) files are ranked by how
+    likely they are to be fixed, and files that failed before wait for
+    their retry (core.scheduler). `budget` (a core.scheduler.Budget;
+    default: TAGGER_BUDGET_MINUTES / TAGGER_BUDGET_REQUESTS) stops the run
+    from starting new files once its time or AcoustID requests are spent.
+    `stage` is called with the ordered file stream and yields (origin, path)
+    pairs: it prepares each file right before the lookup stages get it (the
+    pipeline journals it and, in temp-folder mode, moves it), so files the
+    budget leaves out are never touched.
+    """
+    from core.albums import RELEASES, AlbumResolver, default_album_mode
+    from core.duplicates import MAX_LEADERS, DuplicateIndex, default_duplicates_report, write_report
+    from core.formats import is_audio_file
+    from core.heuristics import FilenameMatcher, default_threshold
+    from core.mirror import open_default_mirror
+    from core.scheduler import Scheduler, default_budget, default_schedule
+    from core.tagwriter import WRITER
 
-def run_tagger(folder, api_key, logger, progress_callback=None):
-    """Run tagging on all MP3s inside given folder, reporting progress if callback provided."""
     setup_musicbrainz()
-    mp3_files = [p for p in Path(folder).rglob("*.mp3")]
-    total = len(mp3_files)
-    logger.info(f"Found {total} MP3 files in {folder}")
+    audio_files = files if files is not None else [
+        p for p in Path(folder).rglob("*") if is_audio_file(p) and p.is_file()
+    ]
+    if expected is None and hasattr(audio_files, "__len__"):
+        count = len(audio_files)
+        logger.info(f"Found {count} audio files in {folder}")
+        if count == 0:
+            return 0, 0
+        expected = lambda: count
 
-    if total == 0:
-        return 0, 0
+    workers = workers or default_workers()
+    backend = backend or default_backend()
+    report_duplicates = default_duplicates_report()
+    batch_size = batch_size or default_batch_size()
+    if album_mode is None:
+        album_mode = default_album_mode()
+    albums = AlbumResolver(cache) if album_mode else None
+    own_mirror = mirror is None
+    if own_mirror:
+        mirror = open_default_mirror()
+    duplicates = None
+    RECORDINGS.reset_stats()
+    RELEASES.reset_stats()
+    WRITER.reset_stats()
+    for limiter in (ACOUSTID, MUSICBRAINZ):
+        limiter.reset_stats()
+    if schedule is None:
+        schedule = default_schedule()
+    if budget is None:
+        budget = default_budget()
+    scheduler = Scheduler(cache, budget, rank=schedule) if schedule or budget else None
+    if scheduler:
+        if budget:
+            budget.start()
+            logger.info(f"Run budget: {budget}")
+        audio_files = scheduler.order(audio_files)
+    if stage is not None:
+        audio_files = _staged(stage(audio_files), scheduler)
+    if heuristics is None:
+        heuristics = default_threshold()
+    matcher = FilenameMatcher(folder, heuristics) if heuristics is not None else None
+    confident = deque()  # files the lookup stages never see, as stream items
+    if matcher:
+        audio_files = _divert_confident(audio_files, matcher, confident)
+    if backend == "async":
+        from core.async_lookup import iter_async_lookups
+        stream = (
+            (path, None, lookup)
+            for path, lookup in iter_async_lookups(audio_files, api_key, workers, cache, logger=logger,
+                                                   prefetch_recordings=not (albums or mirror),
+                                                   journal=journal)
+        )
+    elif batch_size > 1:
+        duplicates = DuplicateIndex(max_leaders=MAX_LEADERS) if report_duplicates else None
+        stream = (
+            (path, None, lookup)
+            for path, lookup in iter_batched_lookups(
+                audio_files, api_key, workers, cache, batch_size, duplicates)
+        )
+    else:
+        stream = (
+            (path, fingerprint, None)
+            for path, fingerprint in iter_fingerprinted(audio_files, workers, cache)
+        )
 
-    success = 0
-    for idx, f in enumerate(mp3_files, start=1):
-        if tag_file(str(f), api_key, logger):
-            success += 1
+    with _local_mirror(mirror, logger, close=own_mirror):
+        success = total = 0
+        for idx, (f, fingerprint, lookup, guess) in enumerate(_with_confident(stream, confident),
+                                                               start=1):
+            total = idx
+            record = new_record(f)
+            if guess is not None:
+                ok = tag_from_guess(str(f), guess, api_key, logger, cache=cache, record=record,
+                                    dry_run=dry_run, journal=journal, albums=albums, root=folder)
+                matcher.count(record["heuristic"])
+            else:
+                ok = tag_file(str(f), api_key, logger, fingerprint=fingerprint, cache=cache,
+                              record=record, dry_run=dry_run, lookup=lookup, journal=journal,
+                              albums=albums, root=folder)
+            if ok:
+                success += 1
+            if scheduler and not dry_run:
+                scheduler.record(record)
+            if journal:
+                journal.mark(f, "written", record["status"])
+            if on_result:
+                on_result(record)
 
-        # ---- 🔄 Progress update ----
-        if progress_callback:
+            # ---- 🔄 Progress update ----
+            if progress_callback:
+                try:
+                    progress_callback(idx, max(idx, expected()) if expected else idx + 1)
+                except Exception:
+                    pass  # avoid GUI crash if callback fails
+
+        if progress_callback and total:
             try:
-                progress_callback(idx, total)
+                progress_callback(total, total)
             except Exception:
-                pass  # avoid GUI crash if callback fails
+                pass
 
     logger.info(f"Successfully tagged {success}/{total} files.")
+    if duplicates is not None:
+        groups = duplicates.groups()
+        if groups:
+            write_report(groups, report_duplicates)
+            logger.info(
+                f"Duplicates: {duplicates.stats['duplicates']} files in {len(groups)} groups "
+                f"reused another file's lookup; report written to {report_duplicates}"
+            )
+    for limiter in (ACOUSTID, MUSICBRAINZ):
+        logger.info(limiter.summary())
+        limiter.export_metrics()
+    logger.info(RECORDINGS.summary())
+    if scheduler:
+        logger.info(scheduler.summary())
+        scheduler.export_metrics()
+    if matcher:
+        logger.info(matcher.summary())
+    if not dry_run:
+        logger.info(WRITER.summary())
+    if albums:
+        logger.info(RELEASES.summary())
+        logger.info(albums.summary())
+    # The stats above are per run (reset at the start), so they are added to
+    # METRICS, not set: its counters keep adding up over the batches of a
+    # watch-mode session.
+    for kind, memo in (("recording", RECORDINGS), ("release", RELEASES)):
+        stats = memo.stats
+        METRICS.inc("tagger_cache_hits_total", stats["hits"] + stats["disk_hits"], kind=kind)
+        METRICS.inc("tagger_cache_misses_total", stats["misses"], kind=kind)
     return success, total
-
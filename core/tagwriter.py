@@ -0,0 +1,257 @@
+import os
+import threading
+from io import BytesIO
+from pathlib import Path
+
+from core.formats import _id3v2_size
+from core.metrics import METRICS
+
+# ---------------------------------------------------------------------------
+# Tag writer: one write per file, audio left where it is
+#
+# The new tags of a file are built in memory and written once:
+#
+#   in place   the new tag block fits the old one (its padding included), so
+#              only the tag bytes are overwritten; the audio is not touched
+#   rewrite    the tag block has to grow (or the file had none): the file is
+#              written to a temp file next to it and renamed over it, so an
+#              interrupted write never leaves a half-moved file behind
+#
+# For MP3 only the ID3v2 block (and the ID3v1 block at the end, if any) is
+# read and rendered; the rewrite streams the audio once. FLAC, Ogg and M4A
+# go through mutagen's own save, which is made to fail fast when the tags do
+# not fit; the rewrite then saves into an in-memory copy of the file (as
+# mutagen does on filesystems without read/write opens) and writes it once.
+#
+# WRITER counts files and bytes written per mode (tagger_tag_writes_total /
+# tagger_tag_bytes_written_total in the run metrics).
+# ---------------------------------------------------------------------------
+
+GROW_PADDING = 4096  # padding left after a rewrite, so the next edit fits in place
+COPY_CHUNK = 1024 * 1024
+
+
+class _Rewrite(Exception):
+    """Raised from mutagen's padding callback: the tags do not fit in place."""
+
+
+def _in_place(info):
+    if info.padding < 0:
+        raise _Rewrite()
+    return info.padding  # never shrink: that would move the audio too
+
+
+def _grow(info):
+    return GROW_PADDING
+
+
+def _keep_or_grow(info):
+    return info.padding if info.padding >= 0 else GROW_PADDING
+
+
+class _CountingFile:
+    """A file object that counts the bytes written through it."""
+
+    def __init__(self, f):
+        self.f = f
+        self.written = 0
+
+    def write(self, data):
+        self.written += len(data)
+        return self.f.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self.f, name)
+
+
+def _copy(src, dst, count):
+    while count > 0:
+        chunk = src.read(min(COPY_CHUNK, count))
+        if not chunk:
+            break
+        dst.write(chunk)
+        count -= len(chunk)
+
+
+def _vorbis_fields(tags):
+    """Vorbis comment fields for EasyID3-style tags: "n/total" numbers are
+    split into TRACKNUMBER/TRACKTOTAL (DISCNUMBER/DISCTOTAL) as taggers expect."""
+    fields = {}
+    for key, value in tags.items():
+        if key in ("tracknumber", "discnumber") and "/" in str(value):
+            number, _, total = str(value).partition("/")
+            fields[key] = number
+            fields[key.replace("number", "total")] = total
+        else:
+            fields[key] = value
+    return fields
+
+
+def _unchanged(audio, fields):
+    """True if the file's tags already hold exactly these values."""
+    try:
+        return all(
+            audio.get(key) == [str(v) for v in (value if isinstance(value, list) else [value])]
+            for key, value in fields.items()
+        )
+    except Exception:
+        return False
+
+
+def _replace(path, tmp):
+    """Move the finished temp file over `path`, keeping the file's mode."""
+    try:
+        os.chmod(tmp, os.stat(path).st_mode & 0o7777)
+    except OSError:
+        pass
+    os.replace(tmp, path)
+
+
+def _temp_path(path):
+    return path.with_name(f".{path.name}.tagging")
+
+
+class TagWriter:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.stats = {"in_place": 0, "rewrite": 0, "unchanged": 0, "bytes_written": 0}
+
+    def _count(self, mode, written):
+        with self._lock:
+            self.stats[mode] += 1
+            self.stats["bytes_written"] += written
+        METRICS.inc("tagger_tag_writes_total", mode=mode)
+        if written:
+            METRICS.inc("tagger_tag_bytes_written_total", written, mode=mode)
+
+    def write(self, path, tags):
+        """Write EasyID3-style tags (title/artist/album/date/...) to an audio
+        file in its container's format, creating the tag block if needed.
+        Returns the mode used: "in_place", "rewrite" or "unchanged"."""
+        path = Path(path)
+        if path.suffix.lower() == ".mp3":
+            mode, written = self._write_mp3(path, tags)
+        else:
+            mode, written = self._write_mutagen(path, tags)
+        self._count(mode, written)
+        return mode
+
+    def _write_mp3(self, path, tags):
+        from mutagen.easyid3 import EasyID3
+        from mutagen.id3 import ID3NoHeaderError
+
+        with open(path, "rb") as f:
+            header = f.read(10)
+            region = _id3v2_size(header)
+            # An ID3v2.4 footer is part of the region the new tag replaces;
+            # mutagen neither reads nor writes footers.
+            footer = 10 if region and header[3] == 4 and header[5] & 0x10 else 0
+            region += footer
+            size = f.seek(0, os.SEEK_END)
+            f.seek(0)
+            head = f.read(region)
+            tail = b""
+            if size - region >= 128:
+                f.seek(-128, os.SEEK_END)
+                tail = f.read(128)
+                if tail[:3] != b"TAG":
+                    tail = b""
+
+        # Render the new tag against just the tag bytes: EasyID3 sees the same
+        # ID3v2 (and ID3v1) tags as it would in the whole file.
+        old = head[:region - footer] + tail
+        buffer = BytesIO(old)
+        try:
+            song = EasyID3(buffer)
+        except ID3NoHeaderError:
+            song = EasyID3()
+        for key, value in tags.items():
+            song[key] = value
+        buffer.seek(0)
+        # With a footer, the new tag takes its 10 bytes as padding.
+        song.save(buffer, padding=lambda info: _keep_or_grow(info) + footer)
+        new = buffer.getvalue()
+        if new == old:
+            return "unchanged", 0
+        new_head, new_tail = new[:len(new) - len(tail)], new[len(new) - len(tail):]
+
+        if len(new_head) == region:
+            with open(path, "r+b") as f:
+                f.write(new_head)
+                if tail:
+                    f.seek(size - 128)
+                    f.write(new_tail)
+            return "in_place", len(new)
+
+        tmp = _temp_path(path)
+        try:
+            with open(path, "rb") as src, open(tmp, "wb") as dst:
+                dst.write(new_head)
+                src.seek(region)
+                _copy(src, dst, size - region - len(tail))
+                dst.write(new_tail)
+                written = dst.tell()
+                dst.flush()
+                os.fsync(dst.fileno())
+            _replace(path, tmp)
+        except BaseException:
+            tmp.unlink(missing_ok=True)
+            raise
+        return "rewrite", written
+
+    def _write_mutagen(self, path, tags):
+        import mutagen
+
+        audio = mutagen.File(path, easy=True)
+        if audio is None:
+            raise ValueError(f"Unsupported or unreadable audio file: {path.name}")
+        if audio.tags is None:
+            audio.add_tags()
+        fields = tags if path.suffix.lower() in (".m4a", ".mp4") else _vorbis_fields(tags)
+        if _unchanged(audio, fields):
+            return "unchanged", 0
+        for key, value in fields.items():
+            audio[key] = value
+
+        try:
+            with open(path, "r+b") as f:
+                counting = _CountingFile(f)
+                audio.save(counting, padding=_in_place)
+            return "in_place", counting.written
+        except _Rewrite:
+            pass  # raised before anything was written
+
+        # Ogg pages and MP4 chunk offsets change along with the tags, so the
+        # new file is built in memory by mutagen and written out in one go.
+        buffer = BytesIO(path.read_bytes())
+        audio.save(buffer, padding=_grow)
+        data = buffer.getbuffer()
+        tmp = _temp_path(path)
+        try:
+            with open(tmp, "wb") as dst:
+                dst.write(data)
+                dst.flush()
+                os.fsync(dst.fileno())
+            _replace(path, tmp)
+        except BaseException:
+            tmp.unlink(missing_ok=True)
+            raise
+        return "rewrite", len(data)
+
+    def summary(self):
+        s = self.stats
+        return (
+            f"Tag writes: {s['in_place']} in place, {s['rewrite']} rewritten, "
+            f"{s['unchanged']} unchanged; {s['bytes_written'] / 1024:.0f} KiB written"
+        )
+
+
+WRITER = TagWriter()
+
+
+def write_tags(path, tags):
+    """Write tags to `path` once (see TagWriter.write)."""
+    return WRITER.write(path, tags)
@@ -0,0 +1,507 @@
+import os
+import sys
+import time
+import errno
+import select
+import struct
+import threading
+from pathlib import Path
+
+from core.formats import AUDIO_EXTENSIONS, read_tag_state
+from core.scanner import TEMP_FOLDER_NAME, TrackState, open_default_index
+
+# ---------------------------------------------------------------------------
+# Watch mode: tag new files as they arrive
+#
+#   python fix_metadata.py --watch [--root FOLDER] [--watch-mode auto|inotify|poll]
+#
+# The library is walked once at startup: the usual pipeline tags the
+# backlog, and every folder gets a watch. After that only what changes is
+# looked at:
+#
+#   inotify  (Linux, through ctypes on libc) the kernel reports files closed
+#            after writing, moved in or deleted, and new folders, which are
+#            watched in turn. Idle, the daemon sleeps in select() with no
+#            timeout.
+#   poll     elsewhere, or when inotify is unavailable or out of watches:
+#            every TAGGER_WATCH_POLL seconds (default 10) each folder is
+#            stat()ed and only folders whose mtime changed are listed again.
+#            Files rewritten in place (same folder mtime) are not noticed.
+#
+# A new or changed audio file waits until its size and mtime have not
+# changed for TAGGER_WATCH_DEBOUNCE seconds (default 5), so half-written
+# downloads are left alone. Its tag state then goes into the tag index
+# (core.scanner). Untagged files are collected for up to BATCH_WAIT seconds,
+# or until BATCH_FILES are waiting, and tagged together by run_tagger, so
+# AcoustID lookups go out in batches. The tagger's own writes come back as
+# events too; those files are tagged by then and are only re-indexed.
+# ---------------------------------------------------------------------------
+
+MODES = ("auto", "inotify", "poll")
+DEFAULT_DEBOUNCE = 5.0
+DEFAULT_POLL_INTERVAL = 10.0
+BATCH_FILES = 50
+BATCH_WAIT = 30.0
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = (IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+              | IN_DELETE_SELF | IN_ONLYDIR)
+_EVENT = struct.Struct("iIII")  # struct inotify_event, followed by `len` bytes of name
+
+
+def _env_seconds(name, default):
+    try:
+        value = float(os.getenv(name) or default)
+    except ValueError:
+        return default
+    return value if value > 0 else default
+
+
+def default_debounce():
+    """TAGGER_WATCH_DEBOUNCE from .env: seconds a file must stay unchanged (default 5)."""
+    return _env_seconds("TAGGER_WATCH_DEBOUNCE", DEFAULT_DEBOUNCE)
+
+
+def default_poll_interval():
+    """TAGGER_WATCH_POLL from .env: seconds between polls in poll mode (default 10)."""
+    return _env_seconds("TAGGER_WATCH_POLL", DEFAULT_POLL_INTERVAL)
+
+
+def _is_audio_name(name):
+    return name.lower().endswith(AUDIO_EXTENSIONS) and not name.startswith(".")
+
+
+class Inotify:
+    """The few inotify calls watch mode needs, through ctypes."""
+
+    def __init__(self):
+        import ctypes
+        import ctypes.util
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or None, use_errno=True)
+        if not hasattr(libc, "inotify_init1"):
+            raise OSError(errno.ENOSYS, "inotify is not available")
+        self._libc = libc
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.folders = {}  # watch descriptor -> folder
+
+    def add(self, folder):
+        import ctypes
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(folder), WATCH_MASK)
+        if wd < 0:
+            code = ctypes.get_errno()
+            raise OSError(code, f"inotify_add_watch failed for {folder}: {os.strerror(code)}")
+        self.folders[wd] = folder
+
+    def remove_under(self, top):
+        """Stop watching `top` and the folders below it (moved out of the library)."""
+        prefix = os.path.join(top, "")
+        for wd, folder in list(self.folders.items()):
+            if folder == top or folder.startswith(prefix):
+                self._libc.inotify_rm_watch(self.fd, wd)
+                del self.folders[wd]
+
+    def read(self):
+        """Pending events as (folder, name, mask); folder is None after an overflow."""
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        events, offset = [], 0
+        while offset + _EVENT.size <= len(data):
+            wd, mask, _, length = _EVENT.unpack_from(data, offset)
+            name = os.fsdecode(data[offset + _EVENT.size:offset + _EVENT.size + length].rstrip(b"\0"))
+            offset += _EVENT.size + length
+            folder = self.folders.get(wd)
+            if mask & IN_IGNORED:
+                self.folders.pop(wd, None)
+            elif folder is not None or mask & IN_Q_OVERFLOW:
+                events.append((folder, name, mask))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class Debouncer:
+    """Files waiting until their size and mtime stop changing."""
+
+    def __init__(self, delay):
+        self.delay = delay
+        self.pending = {}  # path -> ((size, mtime_ns), due)
+
+    def touch(self, path, now):
+        try:
+            st = os.stat(path)
+        except OSError:
+            self.pending.pop(path, None)
+            return
+        self.pending[path] = ((st.st_size, st.st_mtime_ns), now + self.delay)
+
+    def forget(self, path):
+        self.pending.pop(path, None)
+
+    def next_due(self):
+        return min((due for _, due in self.pending.values()), default=None)
+
+    def ready(self, now):
+        """Yield (path, stat) for files unchanged for `delay` seconds."""
+        for path, (seen, due) in list(self.pending.items()):
+            if due > now:
+                continue
+            try:
+                st = os.stat(path)
+            except OSError:
+                del self.pending[path]
+                continue
+            current = (st.st_size, st.st_mtime_ns)
+            if current != seen or not st.st_size:
+                self.pending[path] = (current, now + self.delay)  # still being written
+                continue
+            del self.pending[path]
+            yield path, st
+
+
+class Watcher:
+    """Watches `root` and hands batches of new untagged files to `on_batch`.
+
+    `mode` is "inotify", "poll" or "auto" (inotify if it works). start()
+    sets up the watches (one walk over the folders); run() loops until
+    stop() is called from another thread or the process is interrupted.
+    """
+
+    def __init__(self, root, on_batch, logger, mode="auto", debounce=None, poll_interval=None,
+                 batch_files=BATCH_FILES, batch_wait=BATCH_WAIT):
+        self.root = os.path.abspath(root)
+        self.on_batch = on_batch
+        self.logger = logger
+        self.mode = mode
+        self.debounce = Debouncer(debounce or default_debounce())
+        self.poll_interval = poll_interval or default_poll_interval()
+        self.batch_files = batch_files
+        self.batch_wait = batch_wait
+        self.inotify = None
+        self.watched = set()
+        self.folders = {}  # folder -> mtime_ns (poll mode)
+        self.known = {}    # path -> TrackState, as in the tag index (poll mode)
+        self.batch = []
+        self.batch_due = None
+        self.index = None
+        self.stats = {"events": 0, "indexed": 0, "batches": 0, "files": 0}
+        self._wake = threading.Event()  # poll mode
+        self._wake_r, self._wake_w = os.pipe()  # inotify mode (select)
+        self._stopping = False
+
+    # -- setup ----------------------------------------------------------------
+    def _walk_folders(self, top):
+        stack = [top]
+        while stack:
+            folder = stack.pop()
+            try:
+                with os.scandir(folder) as it:
+                    subdirs = [e.path for e in it
+                               if e.is_dir(follow_symlinks=False) and e.name != TEMP_FOLDER_NAME]
+            except OSError:
+                continue
+            yield folder
+            stack.extend(subdirs)
+
+    def _add_folder(self, folder):
+        self.watched.add(folder)
+        if self.inotify is not None:
+            try:
+                self.inotify.add(folder)
+                return
+            except OSError as e:
+                if self.mode == "inotify":
+                    raise
+                self.logger.warning(f"{e}; falling back to polling.")
+                self._switch_to_polling()
+        try:
+            self.folders[folder] = os.stat(folder).st_mtime_ns
+        except OSError:
+            pass
+
+    def _switch_to_polling(self):
+        watched = list(self.inotify.folders.values())
+        self.inotify.close()
+        self.inotify = None
+        for folder in watched:
+            try:
+                self.folders[folder] = os.stat(folder).st_mtime_ns
+            except OSError:
+                pass
+        self.known = self.index.load(self.root)
+
+    def start(self):
+        """Open the tag index and watch every folder under root."""
+        self.index = open_default_index()
+        if self.mode in ("auto", "inotify") and sys.platform.startswith("linux"):
+            try:
+                self.inotify = Inotify()
+            except OSError as e:
+                if self.mode == "inotify":
+                    raise
+                self.logger.warning(f"inotify unavailable ({e}); polling instead.")
+        elif self.mode == "inotify":
+            raise OSError(errno.ENOSYS, "inotify is only available on Linux")
+        for folder in self._walk_folders(self.root):
+            self._add_folder(folder)
+        how = "inotify" if self.inotify is not None else f"polling every {self.poll_interval:g}s"
+        count = len(self.inotify.folders) if self.inotify is not None else len(self.folders)
+        self.logger.info(f"Watching {count} folders under {self.root} ({how}).")
+
+    def sync(self):
+        """Reload what the tag index knows (after the startup pipeline has scanned)."""
+        if self.inotify is None:
+            self.known = self.index.load(self.root)
+
+    # -- events ---------------------------------------------------------------
+    def _new_folder(self, folder, now):
+        """A folder appeared (created or moved in): watch it and everything in it."""
+        if folder not in self.watched:
+            self._add_folder(folder)
+            self._list_folder(folder, now)
+
+    def _list_folder(self, folder, now):
+        """Queue the audio files of `folder` that are new or changed."""
+        try:
+            with os.scandir(folder) as it:
+                entries = list(it)
+        except OSError:
+            return
+        seen = set()
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.name != TEMP_FOLDER_NAME:
+                        self._new_folder(entry.path, now)
+                elif _is_audio_name(entry.name) and entry.is_file():
+                    seen.add(entry.path)
+                    st = entry.stat()
+                    old = self.known.get(entry.path)
+                    if old is None or (old.size, old.mtime_ns) != (st.st_size, st.st_mtime_ns):
+                        self.debounce.touch(entry.path, now)
+            except OSError:
+                continue
+        if self.inotify is None:
+            prefix = os.path.join(folder, "")
+            gone = [p for p in self.known
+                    if p.startswith(prefix) and os.sep not in p[len(prefix):] and p not in seen]
+            self._removed(gone)
+
+    def _removed(self, paths):
+        if not paths:
+            return
+        for path in paths:
+            self.known.pop(path, None)
+            self.debounce.forget(path)
+        self.index.update([], removed=paths)
+
+    def _handle(self, folder, name, mask, now):
+        self.stats["events"] += 1
+        if mask & IN_Q_OVERFLOW:
+            # Events were dropped: list the watched folders again (no tag reads
+            # for files the index already has).
+            self.logger.warning("inotify queue overflowed; re-listing watched folders.")
+            self.known = self.index.load(self.root)
+            for watched in list(self.inotify.folders.values()):
+                self._list_folder(watched, now)
+            self.known = {}
+            return
+        if mask & IN_DELETE_SELF:
+            self.watched.discard(folder)
+            return
+        path = os.path.join(folder, name)
+        if mask & IN_ISDIR:
+            if mask & (IN_CREATE | IN_MOVED_TO) and name != TEMP_FOLDER_NAME:
+                self._new_folder(path, now)
+            elif mask & IN_MOVED_FROM:
+                self.inotify.remove_under(path)
+                prefix = os.path.join(path, "")
+                self.watched = {f for f in self.watched if f != path and not f.startswith(prefix)}
+            return
+        if not _is_audio_name(name):
+            return
+        if mask & (IN_DELETE | IN_MOVED_FROM):
+            self._removed([path])
+        elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE):
+            self.debounce.touch(path, now)
+
+    def _poll(self, now):
+        for folder, mtime in list(self.folders.items()):
+            try:
+                current = os.stat(folder).st_mtime_ns
+            except OSError:
+                del self.folders[folder]
+                self.watched.discard(folder)
+                prefix = os.path.join(folder, "")
+                self._removed([p for p in self.known if p.startswith(prefix)])
+                continue
+            if current != mtime:
+                self.folders[folder] = current
+                self._list_folder(folder, now)
+
+    # -- settled files --------------------------------------------------------
+    def _settled(self, now):
+        states = []
+        for path, st in self.debounce.ready(now):
+            try:
+                has_artist, has_title = read_tag_state(path)
+            except OSError:
+                continue
+            state = TrackState(path, st.st_size, st.st_mtime_ns, has_artist, has_title)
+            states.append(state)
+            self.known[path] = state
+            if not state.tagged and path not in self.batch:
+                if not self.batch:
+                    self.batch_due = now + self.batch_wait
+                self.batch.append(path)
+        if states:
+            self.index.update(states)
+            self.stats["indexed"] += len(states)
+
+    def _flush(self):
+        batch, self.batch, self.batch_due = self.batch, [], None
+        batch = [p for p in batch if os.path.exists(p)]
+        if not batch:
+            return
+        self.stats["batches"] += 1
+        self.stats["files"] += len(batch)
+        self.logger.info(f"Watch: tagging {len(batch)} new file(s).")
+        try:
+            self.on_batch([Path(p) for p in batch])
+        except Exception as e:
+            self.logger.error(f"Watch: tagging batch failed: {e}")
+
+    # -- loop -----------------------------------------------------------------
+    def stop(self):
+        """Make run() return (safe to call from another thread)."""
+        self._stopping = True
+        self._wake.set()
+        os.write(self._wake_w, b"x")
+
+    def _timeout(self, now, next_poll):
+        deadlines = [d for d in (self.debounce.next_due(), self.batch_due, next_poll) if d is not None]
+        if self.batch and len(self.batch) >= self.batch_files:
+            return 0
+        return max(0.0, min(deadlines) - now) if deadlines else None
+
+    def run(self):
+        next_poll = None
+        try:
+            while not self._stopping:
+                now = time.monotonic()
+                if self.inotify is None and next_poll is None:
+                    next_poll = now + self.poll_interval
+                if self.inotify is not None:
+                    fds = [self._wake_r, self.inotify.fd]
+                    readable, _, _ = select.select(fds, [], [], self._timeout(now, next_poll))
+                else:
+                    # select() only takes sockets on Windows; wait on an event there.
+                    self._wake.wait(self._timeout(now, next_poll))
+                    readable = []
+                now = time.monotonic()
+                if self._wake_r in readable:
+                    os.read(self._wake_r, 64)
+                if self.inotify is not None and self.inotify.fd in readable:
+                    for folder, name, mask in self.inotify.read():
+                        self._handle(folder, name, mask, now)
+                        if self.inotify is None:
+                            break  # switched to polling while adding a folder
+                if next_poll is not None and now >= next_poll:
+                    self._poll(now)
+                    next_poll = now + self.poll_interval
+                self._settled(now)
+                if self.batch and (len(self.batch) >= self.batch_files or now >= self.batch_due):
+                    self._flush()
+        finally:
+            if self.batch:
+                self._flush()
+
+    def close(self):
+        if self.inotify is not None:
+            self.inotify.close()
+        if self.index is not None:
+            self.index.close()
+        os.close(self._wake_r)
+        os.close(self._wake_w)
+
+    def summary(self):
+        s = self.stats
+        return (
+            f"Watch: {s['events']} events, {s['indexed']} files re-indexed, "
+            f"{s['files']} files tagged in {s['batches']} batches"
+        )
+
+
+def run_watch(source_folder=None, workers=None, backend=None, batch_size=None, album_mode=None,
+              dry_run=False, on_result=None, mode="auto", metrics_out=None, watcher_ready=None):
+    """Tag the backlog of `source_folder` (default: ROOT_FOLDER), then keep
+    tagging new files as they arrive until interrupted (see the module
+    comment). `watcher_ready` is called with the Watcher once it runs, so a
+    caller can stop() it. Returns False if the pipeline could not start."""
+    from dotenv import load_dotenv
+    from core.cache import open_default_cache
+    from core.file_utils import run_auto_tag_pipeline, setup_logger
+    from core.metrics import METRICS, default_metrics_path
+    from core.tagger import run_tagger
+
+    load_dotenv()
+    source_folder = source_folder or os.getenv("ROOT_FOLDER")
+    if not source_folder or not os.path.isdir(source_folder):
+        print("[MetadataFixer] Invalid or missing ROOT_FOLDER; not watching.")
+        return False
+    logger = setup_logger()
+    api_key = os.getenv("ACOUSTID_API_KEY")
+    cache = None
+
+    def tag_batch(files):
+        success, total = run_tagger(
+            source_folder, api_key, logger, workers=workers, cache=cache, files=files,
+            on_result=on_result, dry_run=dry_run, backend=backend, batch_size=batch_size,
+            album_mode=album_mode,
+        )
+        logger.info(f"Watch: {success}/{total} tagged.")
+        metrics_path = metrics_out or default_metrics_path()
+        if metrics_path:
+            try:
+                METRICS.write_prometheus(metrics_path)
+            except OSError as e:
+                logger.warning(f"Could not write metrics to {metrics_path}: {e}")
+
+    watcher = Watcher(source_folder, tag_batch, logger, mode)
+    try:
+        # Watch first, so files arriving while the backlog is tagged are not missed.
+        watcher.start()
+        if run_auto_tag_pipeline(source_folder, workers=workers, backend=backend,
+                                 batch_size=batch_size, metrics_out=metrics_out, album_mode=album_mode,
+                                 dry_run=dry_run, on_result=on_result) is None:
+            return False
+        watcher.sync()
+        cache = open_default_cache()
+        logger.info("Watching for new files (Ctrl+C to stop).")
+        if watcher_ready:
+            watcher_ready(watcher)
+        try:
+            watcher.run()
+        except KeyboardInterrupt:
+            pass
+        logger.info(watcher.summary())
+        return True
+    finally:
+        watcher.close()
+        if cache:
+            cache.close()
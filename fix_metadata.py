@@ -1,4 +1,173 @@
-from core.file_utils import run_auto_tag_pipeline
+"""Headless command-line entry point.
+
+Never imports tkinter/customtkinter, so it runs on servers and in containers.
+
+    python fix_metadata.py --root "D:\\My Music" --workers 4 --json-out results.jsonl
+"""
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import contextlib
+from datetime import datetime
+
+
+def parse_since(value):
+    """Parse --since: an ISO date/time (2024-05-01, 2024-05-01T18:00) or an
+    age such as 90m, 36h, 7d. Returns epoch seconds."""
+    match = re.fullmatch(r"(\d+(?:\.\d+)?)\s*([smhdw])", value.strip().lower())
+    if match:
+        unit = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}[match.group(2)]
+        return time.time() - float(match.group(1)) * unit
+    try:
+        return datetime.fromisoformat(value.strip()).timestamp()
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            f"invalid --since value {value!r} (use e.g. 2024-05-01 or 36h)"
+        )
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description="Find untagged audio files (MP3, FLAC, Ogg, M4A) and tag them via AcoustID + MusicBrainz."
+    )
+    parser.add_argument(
+        "--root", "--folder", dest="root",
+        help="music folder (default: ROOT_FOLDER from .env)",
+    )
+    parser.add_argument(
+        "--workers", type=int, default=None,
+        help="parallel fingerprint workers (default: TAGGER_WORKERS or CPU count)",
+    )
+    parser.add_argument(
+        "--backend", choices=("threads", "async"), default=None,
+        help="lookup engine (default: TAGGER_BACKEND or threads)",
+    )
+    parser.add_argument(
+        "--batch-size", type=int, default=None,
+        help="fingerprints per AcoustID request, threads backend (default: TAGGER_ACOUSTID_BATCH or 10; 1 = off)",
+    )
+    parser.add_argument(
+        "--album-mode", action="store_true", default=None,
+        help="tag whole albums from one MusicBrainz release lookup each (default: TAGGER_ALBUM_MODE)",
+    )
+    parser.add_argument(
+        "--budget-minutes", type=float, default=None,
+        help="stop starting new files after this many minutes (default: TAGGER_BUDGET_MINUTES)",
+    )
+    parser.add_argument(
+        "--budget-requests", type=int, default=None,
+        help="stop starting new files after this many AcoustID requests (default: TAGGER_BUDGET_REQUESTS)",
+    )
+    parser.add_argument(
+        "--dry-run", action="store_true",
+        help="resolve matches but don't write tags or move files",
+    )
+    parser.add_argument(
+        "--since", type=parse_since, default=None,
+        help="only files modified since this date/time or age (e.g. 2024-05-01, 36h, 7d)",
+    )
+    parser.add_argument(
+        "--json-out", metavar="PATH",
+        help="write one JSON record per file to PATH ('-' for stdout)",
+    )
+    parser.add_argument(
+        "--metrics-out", metavar="PATH",
+        help="Prometheus text file for the run's metrics (default: TAGGER_METRICS or logs/metrics.prom)",
+    )
+    parser.add_argument(
+        "--watch", action="store_true",
+        help="after tagging the backlog, keep running and tag new files as they arrive "
+             "(not with --since, --budget-* or --temp-folder)",
+    )
+    parser.add_argument(
+        "--watch-mode", choices=("auto", "inotify", "poll"), default="auto",
+        help="how --watch notices new files (default: inotify on Linux, else polling)",
+    )
+    parser.add_argument(
+        "--temp-folder", action="store_true", default=None,
+        help="move untagged files to _temp_untagged while tagging (old behaviour)",
+    )
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.watch:
+        ignored = [
+            option for option, value in (
+                ("--since", args.since), ("--budget-minutes", args.budget_minutes),
+                ("--budget-requests", args.budget_requests), ("--temp-folder", args.temp_folder),
+            ) if value is not None
+        ]
+        if ignored:
+            parser.error(f"--watch cannot be combined with {', '.join(ignored)}")
+    if args.root and not os.path.isdir(args.root):
+        print(f"[MetadataFixer] Folder not found: {args.root}", file=sys.stderr)
+        return 1
+
+    from core.file_utils import run_auto_tag_pipeline
+    from core.scheduler import Budget
+
+    budget = None
+    if args.budget_minutes or args.budget_requests:
+        budget = Budget(args.budget_minutes * 60 if args.budget_minutes else None,
+                        args.budget_requests or None)
+
+    out = None
+    if args.json_out == "-":
+        out = sys.stdout
+    elif args.json_out:
+        out = open(args.json_out, "w", encoding="utf-8")
+
+    def emit(record):
+        record = dict(record, dry_run=args.dry_run)
+        record["timings"] = {k: round(v, 4) for k, v in record["timings"].items()}
+        out.write(json.dumps(record, ensure_ascii=False) + "\n")
+        out.flush()
+
+    # With --json-out -, stdout carries only the JSON lines; anything else
+    # printed along the way goes to stderr.
+    quiet = contextlib.redirect_stdout(sys.stderr) if out is sys.stdout else contextlib.nullcontext()
+    try:
+        with quiet:
+            if args.watch:
+                from core.watch import run_watch
+                return 0 if run_watch(
+                    args.root,
+                    workers=args.workers,
+                    backend=args.backend,
+                    batch_size=args.batch_size,
+                    album_mode=args.album_mode,
+                    dry_run=args.dry_run,
+                    on_result=emit if out else None,
+                    mode=args.watch_mode,
+                    metrics_out=args.metrics_out,
+                ) else 1
+            result = run_auto_tag_pipeline(
+                args.root,
+                workers=args.workers,
+                backend=args.backend,
+                batch_size=args.batch_size,
+                metrics_out=args.metrics_out,
+                album_mode=args.album_mode,
+                budget=budget,
+                use_temp_folder=args.temp_folder,
+                since=args.since,
+                dry_run=args.dry_run,
+                on_result=emit if out else None,
+            )
+    except FileNotFoundError as e:
+        print(f"[MetadataFixer] {e}", file=sys.stderr)
+        return 1
+    finally:
+        if out and out is not sys.stdout:
+            out.close()
+    return 0 if result is not None else 1
+
 
 if __name__ == "__main__":
-    run_auto_tag_pipeline()
+    sys.exit(main())
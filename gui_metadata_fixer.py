@@ -1,10 +1,11 @@
 import customtkinter as ctk
 from tkinter import filedialog, messagebox
 import threading
+import queue
 import sys
 import os
-from core.file_utils import run_auto_tag_pipeline, ensure_env_setup, find_mp3_files
-from core import tagger
+from core.file_utils import run_auto_tag_pipeline, ensure_env_setup
+from core.scanner import scan_with_default_index
 import traceback
 
 
@@ -13,6 +14,14 @@ import traceback
 ctk.set_appearance_mode("dark")
 ctk.set_default_color_theme("blue")
 
+# Worker threads never touch Tk: they post ("log", text) / ("progress", done,
+# total) / ("call", func) events, and the main loop drains them every
+# POLL_MS, applying only the latest progress and one insert per batch of
+# log lines. The log box keeps the last MAX_LOG_LINES lines (the full log
+# is in logs/metadata_fix.log).
+POLL_MS = 100
+MAX_LOG_LINES = 2000
+
 
 class MetadataFixerApp(ctk.CTk):
 
@@ -64,6 +73,9 @@ class MetadataFixerApp(ctk.CTk):
             text_color="gray"
         )
         footer.pack(side="bottom", pady=(0,6))
+
+        self.events = queue.SimpleQueue()
+        self.after(POLL_MS, self.drain_events)
         self.log("✅ Ready to start.\n")
 
     # -----------------------------------------------------------------------
@@ -78,14 +90,15 @@ class MetadataFixerApp(ctk.CTk):
         self.entry_path.insert(0, folder)
 
         try:
-            mp3_files = find_mp3_files(folder)
-            count = len(mp3_files)
+            states = scan_with_default_index(folder)
+            count = len(states)
             if count == 0:
-                messagebox.showinfo("No MP3 Files", "No MP3 files were found in this folder.")
-                self.log("ℹ️ No MP3 files found in this folder.\n")
+                messagebox.showinfo("No Audio Files", "No audio files were found in this folder.")
+                self.log("ℹ️ No audio files found in this folder.\n")
                 self.button_start.configure(state="disabled")
             else:
-                self.log(f"🎶 Found {count} MP3 files in this folder.\n")
+                untagged = sum(1 for s in states if not s.tagged)
+                self.log(f"🎶 Found {count} audio files in this folder ({untagged} untagged).\n")
                 self.button_start.configure(state="normal")
         except Exception as e:
             self.log(f"⚠️ Error scanning folder: {e}\n")
@@ -102,41 +115,41 @@ class MetadataFixerApp(ctk.CTk):
             self.log("ℹ️ Please complete the AcoustID setup wizard, then click Start again.\n")
             return
 
-        self.button_start.configure(state="disabled")
-        self.progress.set(0)
-        self.text_log.delete("1.0", "end")
-        self.log(f"🚀 Started tagging pipeline for: {folder}\n")
-
-        threading.Thread(
-            target=self.run_pipeline_thread,
-            args=(folder,),
-            daemon=True
-        ).start()
-
         # --- Pre-check: see if all files are already tagged ---
+        # (incremental scan: only files changed since Browse are re-read)
         try:
-            from core import tagger
-            mp3_files = find_mp3_files(folder)
-            if not mp3_files:
-                messagebox.showinfo("No MP3 Files", "No MP3 files were found in this folder.")
-                self.log("ℹ️ No MP3 files found in this folder.\n")
+            states = scan_with_default_index(folder)
+            if not states:
+                messagebox.showinfo("No Audio Files", "No audio files were found in this folder.")
+                self.log("ℹ️ No audio files found in this folder.\n")
                 return
 
-            already_tagged = [f for f in mp3_files if tagger.is_already_tagged(f)]
-            if len(already_tagged) == len(mp3_files):
+            if all(s.tagged for s in states):
                 messagebox.showinfo(
                     "All Files Tagged",
-                    f"🎶 All {len(mp3_files)} MP3 files in this folder are already tagged!"
+                    f"🎶 All {len(states)} audio files in this folder are already tagged!"
                 )
-                self.log(f"ℹ️ All {len(mp3_files)} MP3 files are already tagged. Skipping processing.\n")
+                self.log(f"ℹ️ All {len(states)} audio files are already tagged. Skipping processing.\n")
                 return
         except Exception as e:
             # Log the error quietly without popping up Windows dialog
             self.log(f"⚠️ Non-fatal error during processing: {e}\n{traceback.format_exc()}\n")
             print(f"[gui_metadata_fixer] Suppressed GUI popup for: {e}")
 
+        self.button_start.configure(state="disabled")
+        self.progress.set(0)
+        self.drain_events(reschedule=False)
+        self.text_log.delete("1.0", "end")
+        self.log(f"🚀 Started tagging pipeline for: {folder}\n")
+
+        threading.Thread(
+            target=self.run_pipeline_thread,
+            args=(folder,),
+            daemon=True
+        ).start()
+
     def run_pipeline_thread(self, folder):
-        """Run the tagging pipeline in a background thread."""
+        """Run the tagging pipeline in a background thread (talks to Tk only via self.events)."""
         old_stdout = sys.stdout
         old_stderr = sys.stderr
         try:
@@ -146,29 +159,69 @@ class MetadataFixerApp(ctk.CTk):
             sys.stdout = sys.stderr = LogRedirector(gui_logger)
 
             def update_progress(done, total):
-                self.progress.set(done / total)
-                self.update_idletasks()
+                self.events.put(("progress", done, total))
 
             run_auto_tag_pipeline(folder, progress_callback=update_progress)
 
-            self.progress.set(1)
+            self.events.put(("progress", 1, 1))
             self.log("✅ Tagging completed successfully.\n")
 
         except Exception as e:
-            self.log(f"❌ Error: {e}\n{traceback.format_exc()}\n")
-            messagebox.showerror("Error", str(e))
+            message = str(e)
+            self.log(f"❌ Error: {message}\n{traceback.format_exc()}\n")
+            self.events.put(("call", lambda: messagebox.showerror("Error", message)))
 
         finally:
             sys.stdout = old_stdout
             sys.stderr = old_stderr
-            self.button_start.configure(state="normal")
+            self.events.put(("call", lambda: self.button_start.configure(state="normal")))
 
 
     def log(self, msg):
-        """Append text to the log box."""
-        self.text_log.insert("end", msg)
-        self.text_log.see("end")
-        self.update_idletasks()
+        """Queue text for the log box (safe from any thread)."""
+        self.events.put(("log", msg))
+
+    def drain_events(self, reschedule=True):
+        """Apply everything the worker posted since the last tick, then re-arm the timer.
+
+        The timer is re-armed even if applying an event fails, so one bad
+        event cannot stop the GUI from updating.
+        """
+        try:
+            lines = []
+            progress = None
+            calls = []
+            while True:
+                try:
+                    event = self.events.get_nowait()
+                except queue.Empty:
+                    break
+                if event[0] == "log":
+                    lines.append(event[1])
+                elif event[0] == "progress":
+                    progress = event[1:]
+                else:
+                    calls.append(event[1])
+
+            if lines:
+                self.text_log.insert("end", "".join(lines))
+                excess = int(self.text_log.index("end-1c").split(".")[0]) - MAX_LOG_LINES
+                if excess > 0:
+                    self.text_log.delete("1.0", f"{excess + 1}.0")
+                self.text_log.see("end")
+            if progress:
+                done, total = progress
+                self.progress.set(done / total if total else 1)
+            for call in calls:
+                try:
+                    call()
+                except Exception as e:
+                    self.log(f"⚠️ GUI update failed: {e}\n{traceback.format_exc()}\n")
+        except Exception as e:
+            self.log(f"⚠️ GUI update failed: {e}\n{traceback.format_exc()}\n")
+        finally:
+            if reschedule:
+                self.after(POLL_MS, self.drain_events)
 
 
 class LogRedirector:
@@ -0,0 +1,49 @@
+import os
+import random
+from pathlib import Path
+
+import pytest
+
+from bench.library import audio_frames, flac_stream, m4a_stream, ogg_stream
+
+# ---------------------------------------------------------------------------
+# Shared helpers: untagged files in each container (the synthetic streams of
+# bench.library), and what mutagen itself says about a file's tags.
+# ---------------------------------------------------------------------------
+
+AUDIO = audio_frames(random.Random(0), 16)
+STREAMS = {".mp3": bytes, ".flac": flac_stream, ".ogg": ogg_stream, ".m4a": m4a_stream}
+
+
+def write_untagged(path, audio=AUDIO):
+    """An untagged file of the container given by `path`'s suffix."""
+    path = Path(path)
+    path.write_bytes(STREAMS[path.suffix](audio))
+    return path
+
+
+def mutagen_state(path):
+    """(has_artist, has_title) as mutagen's easy interface sees it."""
+    import mutagen
+    audio = mutagen.File(path, easy=True)
+    if audio is None or audio.tags is None:
+        return False, False
+    return tuple(
+        any(str(v).strip() for v in (audio.tags.get(key) or []))
+        for key in ("artist", "title")
+    )
+
+
+def mutagen_tags(path):
+    """The file's tags as a plain {key: [values]} dict (easy keys)."""
+    import mutagen
+    audio = mutagen.File(path, easy=True)
+    return {key: list(values) for key, values in (audio.tags or {}).items()}
+
+
+@pytest.fixture(autouse=True)
+def _isolated(tmp_path, monkeypatch):
+    """Run each test in its own folder, so nothing lands in the repo (logs/, cache/)."""
+    monkeypatch.chdir(tmp_path)
+    for name in [n for n in os.environ if n.startswith("TAGGER_")]:
+        monkeypatch.delenv(name)
@@ -0,0 +1,129 @@
+import pytest
+
+from bench.library import id3v1_block
+from core.formats import HEAD_BYTES, is_audio_file, read_tag_state
+from tests.conftest import mutagen_state, write_untagged
+
+BIG = "x" * (2 * HEAD_BYTES)  # a comment too large for the in-memory fast path
+
+
+def mp3(path, frames=None, v1=None, version=3):
+    """An MP3 with ID3v2 `frames` ({"TPE1": text, ...}) and/or an ID3v1 (artist, title)."""
+    from mutagen import id3
+
+    write_untagged(path)
+    if frames is not None:
+        tags = id3.ID3()
+        for frame_id, text in frames.items():
+            if frame_id == "APIC":
+                tags.add(id3.APIC(encoding=3, mime="image/jpeg", type=3, desc="", data=text))
+            else:
+                tags.add(getattr(id3, frame_id)(encoding=3, text=[text]))
+        tags.save(path, v2_version=version)
+    if v1:  # after the save, which would rewrite it from the ID3v2 frames
+        with open(path, "ab") as f:
+            f.write(id3v1_block(*v1))
+    return path
+
+
+def container(path, fields):
+    """A FLAC/Ogg/M4A file with `fields` ({"artist": text, ...}) written in order."""
+    import mutagen
+
+    write_untagged(path)
+    audio = mutagen.File(path, easy=path.suffix == ".m4a")
+    if audio.tags is None:
+        audio.add_tags()
+    for key, value in fields.items():
+        audio.tags[key] = [value]
+    audio.save()
+    return path
+
+
+def unsynchronised_mp3(path):
+    """ID3v2.3 with the whole-tag unsynchronisation flag (the fast reader hands it to mutagen)."""
+    def frame(frame_id, text):
+        body = b"\x00" + text.encode("latin-1")
+        return frame_id + len(body).to_bytes(4, "big") + b"\x00\x00" + body
+    frames = frame(b"TPE1", "Artist") + frame(b"TIT2", "Title")
+    size = bytes((len(frames) >> shift) & 0x7F for shift in (21, 14, 7, 0))
+    path.write_bytes(b"ID3\x03\x00\x80" + size + frames + write_untagged(path).read_bytes())
+    return path
+
+
+CASES = {
+    "mp3 v2.3": (lambda p: mp3(p, {"TPE1": "A", "TIT2": "T"}), ".mp3", (True, True)),
+    "mp3 v2.4": (lambda p: mp3(p, {"TPE1": "A", "TIT2": "T"}, version=4), ".mp3", (True, True)),
+    "mp3 artist only": (lambda p: mp3(p, {"TPE1": "A"}), ".mp3", (True, False)),
+    "mp3 blank title": (lambda p: mp3(p, {"TPE1": "A", "TIT2": "  "}), ".mp3", (True, False)),
+    "mp3 cover first": (
+        lambda p: mp3(p, {"APIC": b"\0" * 20000, "TPE1": "A", "TIT2": "T"}), ".mp3", (True, True)
+    ),
+    "mp3 v1 only": (lambda p: mp3(p, v1=("A", "T")), ".mp3", (True, True)),
+    "mp3 v2 artist, v1 title": (
+        lambda p: mp3(p, {"TPE1": "A"}, v1=("", "T")), ".mp3", (True, True)
+    ),
+    "mp3 unsynchronised": (unsynchronised_mp3, ".mp3", (True, True)),
+    "mp3 untagged": (mp3, ".mp3", (False, False)),
+    "flac": (lambda p: container(p, {"artist": "A", "title": "T"}), ".flac", (True, True)),
+    "flac artist only": (lambda p: container(p, {"artist": "A"}), ".flac", (True, False)),
+    "flac large comment first": (
+        lambda p: container(p, {"comment": BIG, "artist": "A", "title": "T"}), ".flac", (True, True)
+    ),
+    "flac untagged": (write_untagged, ".flac", (False, False)),
+    "ogg": (lambda p: container(p, {"artist": "A", "title": "T"}), ".ogg", (True, True)),
+    "ogg title only": (lambda p: container(p, {"title": "T"}), ".ogg", (False, True)),
+    "ogg large comment first": (
+        lambda p: container(p, {"comment": BIG, "artist": "A", "title": "T"}), ".ogg", (True, True)
+    ),
+    "ogg untagged": (write_untagged, ".ogg", (False, False)),
+    "m4a": (lambda p: container(p, {"artist": "A", "title": "T"}), ".m4a", (True, True)),
+    "m4a artist only": (lambda p: container(p, {"artist": "A"}), ".m4a", (True, False)),
+    "m4a blank artist": (lambda p: container(p, {"artist": " ", "title": "T"}), ".m4a", (False, True)),
+    "m4a untagged": (write_untagged, ".m4a", (False, False)),
+}
+
+
+@pytest.mark.parametrize("case", list(CASES))
+def test_read_tag_state_matches_mutagen(tmp_path, case):
+    build, suffix, expected = CASES[case]
+    path = build(tmp_path / f"song{suffix}")
+    assert mutagen_state(path) == expected
+    assert read_tag_state(path) == expected
+
+
+def test_flac_behind_id3v2(tmp_path):
+    from mutagen.id3 import ID3, TPE1
+    path = container(tmp_path / "song.flac", {"artist": "A", "title": "T"})
+    tags = ID3()
+    tags.add(TPE1(encoding=3, text=["Other"]))
+    prefix = tmp_path / "prefix.mp3"
+    prefix.write_bytes(b"")
+    tags.save(prefix)
+    path.write_bytes(prefix.read_bytes() + path.read_bytes())
+    assert read_tag_state(path) == (True, True)
+
+
+@pytest.mark.parametrize("name, data", [
+    ("truncated.mp3", b"ID3\x03\x00\x00\x00\x00\x10"),
+    ("empty.flac", b""),
+    ("garbage.ogg", b"OggS" + b"\xff" * 40),
+    ("bad-atom.m4a", b"\x00\x00\xff\xffmoov"),
+])
+def test_unreadable_files_count_as_untagged(tmp_path, name, data):
+    path = tmp_path / name
+    path.write_bytes(data)
+    assert read_tag_state(path) == (False, False)
+
+
+def test_unknown_extension_and_missing_file(tmp_path):
+    path = tmp_path / "song.wav"
+    path.write_bytes(b"RIFF")
+    assert read_tag_state(path) == (False, False)
+    assert read_tag_state(tmp_path / "missing.mp3") == (False, False)
+
+
+def test_is_audio_file():
+    assert is_audio_file("a/b/Song.MP3")
+    assert is_audio_file("song.opus")
+    assert not is_audio_file("cover.jpg")
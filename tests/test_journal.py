@@ -0,0 +1,105 @@
+import logging
+from pathlib import Path
+
+import pytest
+
+from core.file_utils import recover_stranded
+from core.journal import RunJournal, default_journal_path, open_default_journal
+
+
+@pytest.fixture
+def journal_path(tmp_path):
+    return tmp_path / "cache" / "journal.sqlite3"
+
+
+def test_interrupted_run_resumes_after_reopen(tmp_path, journal_path):
+    root = tmp_path / "music"
+    files = [(root / f"{n}.mp3", root / f"{n}.mp3") for n in "abcd"]
+    journal = RunJournal(journal_path)
+    run_id = journal.start(root, files[:3])
+    journal.add(*files[3])
+    journal.mark(files[0][0], "fingerprinted")
+    journal.mark(files[0][0], "written", status="success")
+    journal.mark(files[1][0], "written", status="no_match")
+    journal.mark(files[2][0], "looked_up")
+    journal.close()  # the process dies here
+
+    journal = RunJournal(journal_path)
+    assert journal.unfinished(root)[0] == run_id
+    assert journal.unfinished(tmp_path / "elsewhere") is None
+    done, pending = journal.resume(run_id)
+    assert done == 2
+    assert pending == [str(files[2][1]), str(files[3][1])]  # in scan order
+    assert journal.origins() == {str(origin) for _, origin in files}
+
+    for path, _ in files[2:]:
+        journal.mark(path, "written", status="success")
+    journal.finish()
+    assert journal.run_id is None
+    assert journal.unfinished(root) is None
+    journal.close()
+
+
+def test_relative_root_matches_the_absolute_one(tmp_path, journal_path):
+    journal = RunJournal(journal_path)
+    run_id = journal.start("music", [("music/a.mp3", "music/a.mp3")])
+    assert journal.unfinished(tmp_path / "music")[0] == run_id  # the cwd is tmp_path
+
+
+def test_dry_runs_are_kept_apart(tmp_path, journal_path):
+    journal = RunJournal(journal_path)
+    run_id = journal.start(tmp_path, [("a.mp3", "a.mp3")], dry_run=True)
+    assert journal.unfinished(tmp_path) is None
+    assert journal.unfinished(tmp_path, dry_run=True)[0] == run_id
+
+
+def test_temp_folder_run_tracks_moves(tmp_path, journal_path):
+    origin = tmp_path / "Artist" / "a.mp3"
+    moved = tmp_path / "_temp_untagged" / "Artist" / "a.mp3"
+    journal = RunJournal(journal_path)
+    run_id = journal.start(tmp_path, [(origin, origin)], temp_folder=True)
+    journal.relocate({origin: moved})
+    journal.mark(origin, "written")  # no longer its working path: ignored
+    assert journal.resume(run_id) == (0, [str(origin)])
+
+    journal.mark(moved, "written", status="success")
+    journal.mark_all("moved_back", "written")
+    assert journal.resume(run_id) == (1, [])
+
+
+def test_mark_without_a_run_is_ignored(journal_path):
+    journal = RunJournal(journal_path)
+    journal.mark("a.mp3", "written")  # e.g. a run without journaling
+
+
+def test_default_journal(monkeypatch, tmp_path):
+    assert default_journal_path() == Path("cache") / "run_journal.sqlite3"
+    monkeypatch.setenv("TAGGER_JOURNAL", str(tmp_path / "j.sqlite3"))
+    journal = open_default_journal()
+    assert journal.path == tmp_path / "j.sqlite3" and journal.path.exists()
+    journal.close()
+    for value in ("off", "None", "0"):
+        monkeypatch.setenv("TAGGER_JOURNAL", value)
+        assert open_default_journal() is None
+
+
+def test_recover_stranded_moves_files_back(tmp_path, caplog):
+    library = tmp_path / "music"
+    temp = library / "_temp_untagged"
+    (temp / "Artist" / "Album").mkdir(parents=True)
+    (temp / "Artist" / "Album" / "01 Song.mp3").write_bytes(b"audio")
+    (temp / "loose.flac").write_bytes(b"flac")
+    (temp / "notes.txt").write_bytes(b"not audio")
+
+    with caplog.at_level(logging.INFO):
+        assert recover_stranded(library, logging.getLogger("test")) == 2
+
+    assert (library / "Artist" / "Album" / "01 Song.mp3").read_bytes() == b"audio"
+    assert (library / "loose.flac").read_bytes() == b"flac"
+    assert (temp / "notes.txt").exists()  # only audio is moved; the folder stays
+    assert not (temp / "Artist").exists()
+    assert "Recovered 2 files" in caplog.text
+
+
+def test_recover_stranded_without_a_temp_folder(tmp_path):
+    assert recover_stranded(tmp_path, logging.getLogger("test")) == 0
@@ -0,0 +1,169 @@
+import asyncio
+import time
+from email.utils import formatdate
+
+import pytest
+
+from core.ratelimit import (
+    ServiceLimiter, ThrottledError, TokenBucket, TransientError, parse_retry_after,
+)
+from core.services import check_retry
+
+
+class FakeClock:
+    """time.monotonic / time.sleep stand-ins: sleeping advances the clock."""
+
+    def __init__(self):
+        self.now = 100.0
+        self.slept = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+def test_bucket_spaces_requests_at_the_rate():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=2.0, clock=clock)
+    assert [bucket.reserve() for _ in range(3)] == [0.0, 0.5, 1.0]
+    clock.now += 0.75
+    assert bucket.reserve() == pytest.approx(0.75)
+
+
+def test_bucket_saves_up_to_capacity():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=1.0, capacity=3.0, clock=clock)
+    clock.now += 60  # idle for a long time: only `capacity` tokens saved
+    assert [bucket.reserve() for _ in range(4)] == [0.0, 0.0, 0.0, 1.0]
+
+
+def test_bucket_pause_delays_every_caller():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=10.0, clock=clock, sleep=clock.sleep)
+    bucket.pause(5)
+    assert bucket.acquire() == 5
+    assert clock.slept == [5]
+    bucket.pause(0.01)  # a shorter pause never moves the schedule back
+    assert bucket.reserve() == pytest.approx(0.1)
+
+
+def test_acquire_sleeps_only_when_needed():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=4.0, clock=clock, sleep=clock.sleep)
+    assert bucket.acquire() == 0.0
+    assert bucket.acquire() == 0.25
+    assert clock.slept == [0.25]
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("7", 7.0),
+    (" 120 ", 120.0),
+    ("0", 0.0),
+    (formatdate(time.time() - 3600, usegmt=True), 0.0),  # already past
+    ("soon", None),
+    ("", None),
+    (None, None),
+])
+def test_parse_retry_after(value, expected):
+    assert parse_retry_after(value) == expected
+
+
+def test_parse_retry_after_http_date():
+    seconds = parse_retry_after(formatdate(time.time() + 30, usegmt=True))
+    assert 28 <= seconds <= 30
+
+
+def limiter(**kwargs):
+    clock = FakeClock()
+    service = ServiceLimiter("Test", rate=1000.0, sleep=clock.sleep, **kwargs)
+    service.bucket = TokenBucket(1000.0, clock=clock, sleep=clock.sleep)
+    return service, clock
+
+
+def flaky(*errors, result="ok"):
+    """A function raising `errors` one call at a time, then returning `result`."""
+    errors = list(errors)
+
+    def func():
+        if errors:
+            raise errors.pop(0)
+        return result
+    return func
+
+
+def test_throttled_call_waits_for_retry_after():
+    service, clock = limiter()
+    assert service.call(flaky(ThrottledError("429", retry_after=7))) == "ok"
+
+    assert len(clock.slept) == 1 and 7 <= clock.slept[0] <= 7.25
+    assert service.bucket._next >= 100 + clock.slept[0]  # the whole bucket waits
+    s = service.stats
+    assert (s["requests"], s["retries"], s["throttled"], s["failures"]) == (2, 1, 1, 0)
+    assert s["backoff_seconds"] == clock.slept[0]
+
+
+def test_retry_after_is_capped_by_max_delay():
+    service, clock = limiter(max_delay=10.0)
+    service.call(flaky(ThrottledError("503", retry_after=3600)))
+    assert 10 <= clock.slept[0] <= 10.25
+
+
+def test_transient_errors_back_off_exponentially():
+    service, clock = limiter(base_delay=1.0)
+    errors = [TransientError("HTTP 502") for _ in range(3)]
+    assert service.call(flaky(*errors)) == "ok"
+    for attempt, delay in enumerate(clock.slept):
+        assert 2 ** attempt / 2 <= delay <= 2 ** attempt
+    assert service.stats["retries"] == 3 and service.stats["throttled"] == 0
+
+
+def test_gives_up_after_max_retries():
+    service, clock = limiter(max_retries=2)
+    with pytest.raises(TransientError, match="down"):
+        service.call(flaky(*[TransientError("down") for _ in range(5)]))
+    assert len(clock.slept) == 2
+    assert service.stats["requests"] == 3 and service.stats["failures"] == 1
+
+
+def test_other_errors_are_not_retried():
+    service, clock = limiter()
+    with pytest.raises(ValueError):
+        service.call(flaky(ValueError("bad response")))
+    assert clock.slept == [] and service.stats["requests"] == 1
+    assert service.stats["failures"] == 0
+
+
+def test_call_async_retries_after_retry_after(monkeypatch):
+    slept = []
+
+    async def fake_sleep(seconds):
+        slept.append(seconds)
+    monkeypatch.setattr(asyncio, "sleep", fake_sleep)
+    service, _ = limiter()
+    errors = [ThrottledError("429", retry_after=2)]
+
+    async def fetch():
+        if errors:
+            raise errors.pop()
+        return "ok"
+
+    assert asyncio.run(service.call_async(fetch)) == "ok"
+    assert 2 <= slept[-1] <= 2.25
+    assert service.stats["throttled"] == 1 and service.stats["requests"] == 2
+
+
+def test_check_retry():
+    with pytest.raises(ThrottledError) as e:
+        check_retry(429, "7", "AcoustID")
+    assert e.value.retry_after == 7
+    with pytest.raises(ThrottledError) as e:
+        check_retry(503, None, "MusicBrainz")
+    assert e.value.retry_after is None
+    with pytest.raises(TransientError) as e:
+        check_retry(500, "7", "MusicBrainz")
+    assert not isinstance(e.value, ThrottledError)
+    check_retry(200, None, "AcoustID")
+    check_retry(404, None, "AcoustID")  # not worth retrying: the caller handles it
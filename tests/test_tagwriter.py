@@ -0,0 +1,173 @@
+import os
+
+import pytest
+
+from core import tagwriter
+from core.formats import read_tag_state
+from core.tagwriter import GROW_PADDING, TagWriter
+from tests.conftest import AUDIO, mutagen_tags, write_untagged
+
+TAGS = {"artist": "Artist", "title": "Title", "album": "Album", "date": "2001"}
+
+
+@pytest.fixture
+def writer():
+    return TagWriter()
+
+
+def tagged(path, padding=1024, version=3, footer=False):
+    """A file tagged with mutagen (artist "Old"), `padding` bytes to spare."""
+    import mutagen
+
+    write_untagged(path)
+    if path.suffix == ".mp3":
+        from mutagen.id3 import ID3, TPE1
+        tags = ID3()
+        tags.add(TPE1(encoding=3, text=["Old"]))
+        tags.save(path, v2_version=version, padding=lambda info: padding)
+        if footer:
+            data = path.read_bytes()
+            size = id3_size(data)
+            header = bytearray(data[:10])
+            header[5] |= 0x10
+            path.write_bytes(bytes(header) + data[10:size] + b"3DI" + bytes(header[3:])
+                             + data[size:])
+        return path
+    audio = mutagen.File(path, easy=True)
+    if audio.tags is None:
+        audio.add_tags()
+    audio["artist"] = ["Old"]
+    audio.save(padding=lambda info: padding)
+    return path
+
+
+def id3_size(data):
+    """Size of the ID3v2 tag at the start of `data`, header included (no footer)."""
+    return 10 + ((data[6] << 21) | (data[7] << 14) | (data[8] << 7) | data[9])
+
+
+def audio_of(path):
+    """The audio bytes behind the tags (for Ogg: the packets after the three headers)."""
+    data = path.read_bytes()
+    if path.suffix == ".ogg":
+        from io import BytesIO
+        from mutagen.ogg import OggPage
+        f, pages = BytesIO(data), []
+        while f.tell() < len(data):
+            pages.append(OggPage(f))
+        return b"".join(OggPage.to_packets(pages)[3:])
+    return data[-len(AUDIO):]
+
+
+@pytest.mark.parametrize("suffix", [".mp3", ".flac", ".ogg", ".m4a"])
+def test_in_place_when_the_tags_fit(tmp_path, writer, suffix):
+    path = tagged(tmp_path / f"song{suffix}", padding=4096)
+    size = path.stat().st_size
+    inode = path.stat().st_ino
+
+    assert writer.write(path, TAGS) == "in_place"
+
+    assert path.stat().st_size == size  # only the tag bytes were overwritten
+    assert path.stat().st_ino == inode  # same file, not a renamed copy
+    tags = mutagen_tags(path)
+    assert tags["artist"] == ["Artist"] and tags["title"] == ["Title"]
+    assert read_tag_state(path) == (True, True)
+    assert writer.stats["in_place"] == 1 and writer.stats["rewrite"] == 0
+    assert audio_of(path) == AUDIO
+
+
+@pytest.mark.parametrize("suffix", [".mp3", ".flac", ".ogg", ".m4a"])
+def test_rewrite_when_the_tags_grow(tmp_path, writer, suffix):
+    path = tagged(tmp_path / f"song{suffix}", padding=0)
+    os.chmod(path, 0o640)
+    inode = path.stat().st_ino
+
+    assert writer.write(path, dict(TAGS, album="x" * 2000)) == "rewrite"
+
+    assert path.stat().st_ino != inode  # a temp file renamed over the original
+    assert path.stat().st_mode & 0o777 == 0o640
+    assert not list(tmp_path.glob(".*.tagging"))
+    assert mutagen_tags(path)["title"] == ["Title"]
+    assert writer.stats["rewrite"] == 1
+    assert audio_of(path) == AUDIO
+    # The rewrite left room to spare: the next edit fits in place.
+    assert writer.write(path, dict(TAGS, album="Another album")) == "in_place"
+
+
+def test_untagged_mp3_gets_a_tag(tmp_path, writer):
+    path = write_untagged(tmp_path / "song.mp3")
+    assert writer.write(path, TAGS) == "rewrite"
+    data = path.read_bytes()
+    assert data.startswith(b"ID3") and data.endswith(AUDIO)
+    assert len(data) >= len(AUDIO) + GROW_PADDING
+    assert mutagen_tags(path)["album"] == ["Album"]
+
+
+def test_same_tags_again_are_unchanged(tmp_path, writer):
+    path = tagged(tmp_path / "song.mp3")
+    writer.write(path, TAGS)
+    before = path.read_bytes()
+    assert writer.write(path, TAGS) == "unchanged"
+    assert path.read_bytes() == before
+    assert writer.stats["unchanged"] == 1
+
+
+def test_id3v1_block_is_updated_in_place(tmp_path, writer):
+    from bench.library import id3v1_block
+    path = tagged(tmp_path / "song.mp3")
+    with open(path, "ab") as f:
+        f.write(id3v1_block("Old", "Old title"))
+    size = path.stat().st_size
+
+    assert writer.write(path, TAGS) == "in_place"
+
+    data = path.read_bytes()
+    assert len(data) == size
+    assert data[-128:-125] == b"TAG" and data[-125:-120] == b"Title"
+    assert data[-128 - len(AUDIO):-128] == AUDIO
+
+
+@pytest.mark.parametrize("padding, mode", [(1024, "in_place"), (0, "rewrite")])
+def test_id3v24_footer_is_replaced(tmp_path, writer, padding, mode):
+    path = tagged(tmp_path / "song.mp3", padding=padding, version=4, footer=True)
+    assert path.read_bytes()[5] & 0x10
+    size = path.stat().st_size
+
+    assert writer.write(path, TAGS) == mode
+
+    data = path.read_bytes()
+    assert b"3DI" not in data  # no stale footer between the tag and the audio
+    assert data[id3_size(data):] == AUDIO
+    if mode == "in_place":
+        assert len(data) == size
+    assert mutagen_tags(path)["artist"] == ["Artist"]
+
+
+def test_failed_rename_leaves_the_original(tmp_path, writer, monkeypatch):
+    path = tagged(tmp_path / "song.mp3", padding=0)
+    before = path.read_bytes()
+
+    def fail(src, dst):
+        raise OSError("disk full")
+    monkeypatch.setattr(tagwriter.os, "replace", fail)
+
+    with pytest.raises(OSError):
+        writer.write(path, dict(TAGS, album="x" * 2000))
+    assert path.read_bytes() == before
+    assert not list(tmp_path.glob(".*.tagging"))
+    assert writer.stats["rewrite"] == 0
+
+
+def test_vorbis_track_numbers_are_split(tmp_path, writer):
+    import mutagen
+    path = tagged(tmp_path / "song.flac")
+    writer.write(path, dict(TAGS, tracknumber="3/12"))
+    tags = mutagen.File(path).tags
+    assert tags["tracknumber"] == ["3"] and tags["tracktotal"] == ["12"]
+
+
+def test_summary_counts_bytes(tmp_path, writer):
+    writer.write(tagged(tmp_path / "a.mp3", padding=4096), TAGS)
+    writer.write(write_untagged(tmp_path / "b.mp3"), TAGS)
+    assert writer.stats["bytes_written"] > 0
+    assert writer.summary().startswith("Tag writes: 1 in place, 1 rewritten, 0 unchanged")